@@ -1,83 +1,585 @@
-from flask import Flask, request, jsonify, redirect
+from flask import Flask, g, request, jsonify, redirect
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import json
-import os
+import csv
 import datetime
+import gzip
+import io
+import os
+import time
+import zlib
+from urllib.parse import urlencode
+from cache import ResponseCache
+from dates import due_date_key, parse_date_key, today_key
+from events import DROPPED, EventBroker, format_event
+from metrics import metrics
+from profiling import RequestProfiler
+from serialization import RecordCache, dumps, loads
+from storage import open_storage
+from store import BookStore, SORT_FIELDS
 
 app = Flask(__name__)
 CORS(app)
 
-DATA_FILE = 'data.db'
+# Request and stage metrics for GET /metrics; off (and free) unless LIBRARY_METRICS is set
+if os.environ.get('LIBRARY_METRICS', '') not in ('', '0'):
+    metrics.enable()
+
+# Storage engine: 'json' rewrites data.db on every change, 'journal' appends changes
+# to data.db.journal, 'snapshot' appends them to the journal of a binary snapshot,
+# 'sqlite' keeps the books in an indexed SQLite database (create the snapshot or the
+# database from data.db with migrate.py)
+STORAGE_ENGINE = os.environ.get('LIBRARY_STORAGE', 'json')
+DATA_FILE = {'sqlite': 'library.sqlite', 'snapshot': 'library.snap'}.get(STORAGE_ENGINE, 'data.db')
+DATA_FILE = os.environ.get('LIBRARY_DATA_FILE', DATA_FILE)
+
+# Loaded once at startup; reloads by itself if the data is changed externally
+store = BookStore(open_storage(STORAGE_ENGINE, DATA_FILE))
+
+# Change events for GET /events. Every open stream occupies one of the server's request
+# threads, so at most 1/EVENT_THREAD_SHARE of them (main.py --threads, 8 by default) serve
+# streams unless LIBRARY_MAX_SUBSCRIBERS sets the cap; events a subscriber has not read
+# yet are capped too
+EVENT_QUEUE_SIZE = 1000
+EVENT_THREAD_SHARE = 4
+DEFAULT_SERVER_THREADS = 8
+
+
+def max_event_subscribers(threads):
+    """
+    Return how many event streams may be open on a server with the given request threads.
+    """
+    return int(os.environ.get('LIBRARY_MAX_SUBSCRIBERS', max(threads // EVENT_THREAD_SHARE, 1)))
+
+
+events = EventBroker(EVENT_QUEUE_SIZE, max_event_subscribers(DEFAULT_SERVER_THREADS))
+store.listeners.append(events.publish)
+
+# Seconds between keep-alive comments on idle event streams. A stream only notices that
+# its client has left when it writes, so this is kept short to free the slot and the
+# server thread of a closed page quickly (every form on the web page reloads it)
+EVENT_KEEPALIVE = 1
+
+# Seconds a new event stream waits for a slot when all are taken, while the open streams
+# are probed for clients that have left
+EVENT_SUBSCRIBE_WAIT = 3
+
+# Encoded GET /books responses and rendered web pages, keyed by their normalized
+# parameters and the catalogue version, and emptied on every change
+response_cache = ResponseCache(int(os.environ.get('LIBRARY_CACHE_ENTRIES', 256)),
+                               int(os.environ.get('LIBRARY_CACHE_MB', 64)) * 1024 * 1024)
+store.listeners.append(response_cache.clear)
+
+# Encoded JSON of recently sent books (at most LIBRARY_RECORD_CACHE_MB), so lists are
+# built by joining bytes
+records = RecordCache(int(os.environ.get('LIBRARY_RECORD_CACHE_MB', 64)) * 1024 * 1024)
+store.listeners.append(records.invalidate)
+
+# Responses of at least GZIP_MIN_SIZE bytes are gzip-compressed for clients that accept it
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+
+# Books per page on the web page, and the largest page GET /books hands out
+WEB_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Fields every book must have, and the ones an edit may change
+REQUIRED_FIELDS = ('name', 'publication_date', 'author', 'category')
+
+# Most operations accepted by one POST /books/bulk or /books/batch request
+MAX_BATCH_SIZE = 10000
+
+# Columns of a CSV export, and how many books export and import handle per chunk
+EXPORT_FIELDS = ('id', 'name', 'author', 'publication_date', 'category',
+                 'borrowed', 'borrow_date', 'due_date', 'borrower_name')
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+TRANSFER_CHUNK_SIZE = 1000
+
+# An import commits at least TRANSFER_CHUNK_SIZE books at a time, and at least
+# 1/IMPORT_CHUNK_RATIO of the catalogue once it is larger, so the work per commit that
+# grows with the catalogue (rewriting data.db, merging the sorted indexes) adds up
+# to a constant factor of the import instead of growing with its square
+IMPORT_CHUNK_RATIO = 8
+
+# How many rejected rows an import reports back
+MAX_IMPORT_ERRORS = 100
+
+
+def not_modified(etag):
+    """
+    Return a 304 response if the client's If-None-Match already has etag, else None.
+    """
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
 
 
-def load_books():
+def tagged(response, etag, version=None):
     """
-    Load the list of books from the JSON data file.
-    Returns an empty list if no data file exists.
+    Set the ETag (and, for list responses, the X-Catalogue-Version header) on a response.
     """
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    return []
+    response.set_etag(etag)
+    if version is not None:
+        response.headers['X-Catalogue-Version'] = str(version)
+    return response
 
 
-def save_books(books):
+def json_response(body, status=200):
     """
-    Save the list of books to the JSON data file with indentation for readability.
+    Wrap an already encoded JSON body in a response.
     """
-    with open(DATA_FILE, 'w') as f:
-        json.dump(books, f, indent=4)
+    return app.response_class(body, status=status, mimetype='application/json')
+
+
+def encode_json(data):
+    with metrics.stage('serialize'):
+        return dumps(data)
+
+
+def overdue_ids(books):
+    """
+    Return the ids of the overdue books among books, for clients to mark them without
+    consulting their own clock.
+    """
+    return store.overdue_ids(books)
+
+
+def encode_books(books):
+    """
+    Encode a list of books from their cached per-book JSON bytes.
+    """
+    with metrics.stage('serialize'):
+        return records.encode_list(books)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider for jsonify() and request.get_json() that uses orjson when it is
+    installed. Encoding is timed as the serialize stage.
+    """
+    def dumps(self, obj, **kwargs):
+        with metrics.stage('serialize'):
+            return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+
+app.json = FastJSONProvider(app)
+
+
+def start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    metrics.request_started(g.metrics_route, request.content_length)
+
+
+def finish_request_metrics(response):
+    # Streamed bodies (exports, event streams) have no known length and are timed until they start
+    metrics.request_finished(g.metrics_route, request.method, response.status_code,
+                             time.perf_counter() - g.metrics_started, response.calculate_content_length())
+    return response
+
+
+def end_request_metrics(exception):
+    if 'metrics_route' in g:
+        metrics.request_ended(g.metrics_route)
+
+
+# The hooks are only installed with metrics enabled, so requests pay nothing otherwise
+if metrics.enabled:
+    app.before_request(start_request_metrics)
+    app.after_request(finish_request_metrics)
+    app.teardown_request(end_request_metrics)
 
+# cProfile a fraction of the requests (LIBRARY_PROFILE_SAMPLE, e.g. 0.01) and/or keep the
+# profiles of requests slower than LIBRARY_PROFILE_SLOW_MS; off unless one of them is set
+profiler = RequestProfiler(
+    os.environ.get('LIBRARY_PROFILE_DIR', 'profiles'),
+    sample_rate=float(os.environ.get('LIBRARY_PROFILE_SAMPLE', 0)),
+    slow_ms=float(os.environ['LIBRARY_PROFILE_SLOW_MS']) if os.environ.get('LIBRARY_PROFILE_SLOW_MS') else None,
+    keep=int(os.environ.get('LIBRARY_PROFILE_KEEP', 100)),
+    fmt=os.environ.get('LIBRARY_PROFILE_FORMAT', 'prof'),
+)
 
-def filter_books(books, borrowed_filter=None, category=None, name=None):
+
+def start_request_profile():
+    g.profile = profiler.start()
+
+
+def end_request_profile(exception):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        profiler.finish(profile, route, request.method, request.query_string.decode(errors='replace'))
+
+
+if profiler.enabled:
+    app.before_request(start_request_profile)
+    app.teardown_request(end_request_profile)
+
+
+def filter_books(borrowed_filter=None, category=None, name=None):
     """
-    Filter books list based on borrowed status, category, and name.
-    :param books: list of book dicts
+    Filter books based on borrowed status, category, and name.
+    The query is answered by the store's indexes (indexed SQL for the sqlite engine).
     :param borrowed_filter: 'available' or 'borrowed' or None
     :param category: category string (case-insensitive) or None
     :param name: exact book name string (case-insensitive) or None
-    :return: filtered list of books
+    :return: list of book dicts, each with its persistent 'id'
+    """
+    return store.filter(borrowed_filter, category, name)
+
+
+def validate_book(data):
+    """
+    Check a new book's data. Returns an error message, or None if the book is valid.
+    """
+    if not isinstance(data, dict) or not all(k in data for k in REQUIRED_FIELDS):
+        return 'Missing fields'
+    return invalid_fields(data)
+
+
+def invalid_fields(fields):
+    """
+    Check that the REQUIRED_FIELDS among fields are strings. Returns an error message, or None.
     """
-    if borrowed_filter == 'available':
-        books = [b for b in books if not b.get('borrowed', False)]
-    elif borrowed_filter == 'borrowed':
-        books = [b for b in books if b.get('borrowed', False)]
-    if category:
-        books = [b for b in books if b.get('category', '').lower() == category.lower()]
-    if name:
-        books = [b for b in books if b.get('name', '').lower() == name.lower()]
-    return books
+    for k in REQUIRED_FIELDS:
+        if k in fields and not isinstance(fields[k], str):
+            return f'Field {k} must be a string'
+    return None
+
+
+def validate_due_date(data):
+    """
+    Check the optional 'due_date' of a borrow request. Returns an error message, or None.
+    """
+    if isinstance(data, dict) and data.get('due_date') and not due_date_key(data['due_date']):
+        return 'Invalid due_date, expected dd.mm.yyyy'
+    return None
+
+
+def borrow_changes(data):
+    """
+    Return the fields set when a book is borrowed: today's borrow_date plus the
+    optional 'due_date' and 'borrower_name' from the request data.
+    """
+    changes = {
+        'borrowed': True,
+        'borrow_date': datetime.datetime.now().strftime('%d.%m.%Y'),
+    }
+    if data and 'due_date' in data:
+        changes['due_date'] = data['due_date']
+    if data and 'borrower_name' in data:
+        changes['borrower_name'] = data['borrower_name']
+    return changes
+
+
+def batch_record(operation, book):
+    """
+    Turn one POST /books/batch operation into a store record.
+    book is the addressed book as it will be when the operation runs (None if it
+    does not exist by then). Returns (record, None) or (None, (error message, status)).
+    """
+    op = operation.get('op')
+    if op not in ('borrow', 'return', 'delete', 'edit'):
+        return None, ('Unknown op', 400)
+    if book is None:
+        return None, ('Book not found', 404)
+    book_id = book['id']
+    if op == 'borrow':
+        if book.get('borrowed', False):
+            return None, ('Book already borrowed', 400)
+        error = validate_due_date(operation)
+        if error:
+            return None, (error, 400)
+        return {'op': 'update', 'id': book_id, 'fields': borrow_changes(operation)}, None
+    if op == 'return':
+        if not book.get('borrowed', False):
+            return None, ('Book not borrowed', 400)
+        return {'op': 'update', 'id': book_id, 'fields': {'borrowed': False},
+                'remove': ['borrow_date', 'due_date', 'borrower_name']}, None
+    if op == 'delete':
+        return {'op': 'delete', 'id': book_id}, None
+    fields = operation.get('fields')
+    if not isinstance(fields, dict) or not fields or not all(k in REQUIRED_FIELDS for k in fields):
+        return None, ('Invalid fields', 400)
+    error = invalid_fields(fields)
+    if error:
+        return None, (error, 400)
+    return {'op': 'update', 'id': book_id, 'fields': fields}, None
+
+
+def accepts_gzip():
+    return request.accept_encodings['gzip'] > 0
+
+
+def gzip_stream(chunks):
+    """
+    Gzip-compress a streamed body chunk by chunk.
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Gzip the response if the client accepts it, unless it is small, already encoded
+    (e.g. a cached GET /books body) or an event stream, whose events must reach the
+    client one by one. Streamed bodies such as exports are compressed as they are sent.
+    """
+    if (response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+            or response.direct_passthrough or response.mimetype == 'text/event-stream'):
+        return response
+    response.vary.add('Accept-Encoding')
+    if not accepts_gzip():
+        return response
+    if response.is_streamed:
+        response.response = gzip_stream(response.iter_encoded())
+    else:
+        data = response.get_data()
+        if len(data) < GZIP_MIN_SIZE:
+            return response
+        response.set_data(gzip.compress(data, GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Liveness check: the server process is up and answering requests.
+    """
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    Readiness check: 200 with the storage engine, number of books and catalogue version
+    once the catalogue is loaded and its storage can be read, otherwise 503.
+    """
+    try:
+        if not store.loaded:
+            return jsonify({'status': 'loading'}), 503
+        version = store.version
+        books = len(store.books())
+    except Exception as e:
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    return jsonify({'status': 'ready', 'storage': STORAGE_ENGINE, 'books': books, 'version': version})
+
+
+def event_stream(subscription):
+    """
+    Generate the Server-Sent Events of one subscriber until it disconnects or is dropped.
+    Idle streams get a keep-alive comment every EVENT_KEEPALIVE seconds, which also
+    checks the stored data for changes made by other processes.
+    """
+    try:
+        yield 'retry: 2000\n' + format_event({'op': 'ready', 'version': store.version})
+        while True:
+            event = subscription.get(timeout=EVENT_KEEPALIVE)
+            if event is None:
+                store.refresh()
+                yield ': keep-alive\n\n'
+            elif event is DROPPED:
+                # Too far behind: tell the client to resync, then end the stream
+                yield format_event({'op': 'reset', 'version': store.version})
+                return
+            else:
+                yield format_event(event)
+    finally:
+        events.unsubscribe(subscription)
+
+
+@app.route('/events', methods=['GET'])
+def get_events():
+    """
+    Server-Sent Events stream of catalogue changes. Every change is sent as an event of
+    type 'upsert' or 'delete' with data {'op', 'id', 'version'} and the version as event id.
+    The stream starts with a 'ready' event carrying the current version; a 'reset' event
+    means the client missed changes and must reload. Clients that fall more than
+    EVENT_QUEUE_SIZE events behind are sent 'reset' and disconnected.
+    Returns 503 when events.max_subscribers streams are still open after the open ones
+    were probed for clients that left.
+    """
+    subscription = events.subscribe(EVENT_SUBSCRIBE_WAIT)
+    if subscription is None:
+        return jsonify({'error': 'Too many event subscribers'}), 503
+    response = app.response_class(event_stream(subscription), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @app.route('/books', methods=['GET'])
 def get_books():
     """
     Get all books with optional filters for borrowed status, category, and name.
-    Adds an 'id' field to each book based on its index.
+    Every book carries its persistent 'id', which the other routes take.
+    Optional 'sort' orders the books by name, author, publication_date or due_date.
+    With 'limit' (at most 1000) and/or 'cursor' the response is one page:
+    {'books': [...], 'total': <matching books>, 'next_cursor': <cursor or null>},
+    and the next page is requested with cursor=<next_cursor>.
+    A page also lists the ids of its overdue books as 'overdue'.
+    The response carries the catalogue version as X-Catalogue-Version and, with the day
+    (overdue books change with it), as ETag; a request with a matching If-None-Match
+    gets 304 Not Modified.
     """
-    books = load_books()
+    # Read the version before the books, so a change in between can only make the tag older
+    version = store.version
+    today = today_key()
+    etag = f'v{version}-{today}'
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    # Parameters are normalized (filters are case-insensitive) so equivalent requests share a cache entry
     borrowed_filter = request.args.get('borrowed')
-    category = request.args.get('category')
-    name = request.args.get('name')
-    filtered = filter_books(books, borrowed_filter, category, name)
+    if borrowed_filter not in ('available', 'borrowed'):
+        borrowed_filter = None
+    category = (request.args.get('category') or '').lower() or None
+    name = (request.args.get('name') or '').lower() or None
+    sort = request.args.get('sort') or 'id'
+    if sort not in SORT_FIELDS:
+        return jsonify({'error': 'Invalid sort field'}), 400
+    paginated = 'limit' in request.args or 'cursor' in request.args
+    limit = None
+    if paginated:
+        limit = min(max(request.args.get('limit', WEB_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor') or None
+
+    def encode():
+        if not paginated and sort == 'id':
+            with metrics.stage('filter'):
+                books = filter_books(borrowed_filter, category, name)
+            return encode_books(books)
+        with metrics.stage('filter'):
+            books, total, next_cursor = store.page(borrowed_filter, category, name, sort, limit, cursor)
+        if not paginated:
+            return encode_books(books)
+        return (b'{"books":' + encode_books(books) + b',"total":' + encode_json(total)
+                + b',"next_cursor":' + encode_json(next_cursor)
+                + b',"overdue":' + encode_json(overdue_ids(books)) + b'}')
+
+    # The compressed body is cached as well, so a repeated list costs no compression either
+    key = ('books', version, today, borrowed_filter, category, name, sort, paginated, limit, cursor)
+    try:
+        if accepts_gzip():
+            body = response_cache.get_or_create(
+                key + ('gzip',), lambda: gzip.compress(response_cache.get_or_create(key, encode), GZIP_LEVEL))
+            response = json_response(body)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = json_response(response_cache.get_or_create(key, encode))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response.vary.add('Accept-Encoding')
+    return tagged(response, etag, version)
+
+
+@app.route('/books/changes', methods=['GET'])
+def get_changes():
+    """
+    Delta sync. Expects query parameter 'since' (a catalogue version from X-Catalogue-Version
+    or an earlier call). Returns {'version', 'upserted': [books], 'deleted': [ids]} with the
+    books changed after that version and 'overdue', the ids of the overdue ones among them,
+    or {'version', 'reset': true} if the server no longer knows what changed since then
+    and the client must reload the full list.
+    """
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': 'Missing since'}), 400
+    delta = store.changes(since)
+    if 'upserted' in delta:
+        delta['overdue'] = overdue_ids(delta['upserted'])
+    return jsonify(delta)
+
+
+@app.route('/books/search', methods=['GET'])
+def search_books():
+    """
+    Full-text search over book name, author and category.
+    Expects query parameter 'q' (one or more words) and optional 'limit' (default 50).
+    Returns matching books ranked by relevance, best first; the X-Overdue header lists
+    the ids of the overdue ones, separated by commas.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query'}), 400
+    limit = request.args.get('limit', 50, type=int)
+    version = store.version
+    books = store.search(query, limit)
+    response = json_response(encode_books(books))
+    response.headers['X-Overdue'] = ','.join(map(str, overdue_ids(books)))
+    return tagged(response, f'v{version}-{today_key()}', version)
+
+
+@app.route('/books/suggest', methods=['GET'])
+def suggest_books():
+    """
+    Search-as-you-type suggestions. Expects query parameter 'prefix' and optional
+    'limit' (default 10, at most 50). Returns a list of {'text', 'field'} where field
+    is 'name' or 'author', in alphabetical order.
+    """
+    prefix = request.args.get('prefix', '')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    return jsonify(store.suggest(prefix, limit))
 
-    # Add id based on position index
-    for i, book in enumerate(filtered):
-        book['id'] = i
 
-    return jsonify(filtered)
+@app.route('/books/overdue', methods=['GET'])
+def overdue_books():
+    """
+    Get the borrowed books whose due date has passed, earliest due first.
+    Optional parameter 'limit' (at least 1).
+    """
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({'error': 'Invalid limit, expected at least 1'}), 400
+    return json_response(encode_books(store.overdue(limit)))
+
+
+@app.route('/books/due', methods=['GET'])
+def due_books():
+    """
+    Get the borrowed books due before a date, earliest due first.
+    Expects query parameter 'before' (dd.mm.yyyy or yyyy-mm-dd) and optional 'limit' (at least 1).
+    """
+    before = parse_date_key(request.args.get('before', ''))
+    if not before:
+        return jsonify({'error': 'Invalid or missing before, expected dd.mm.yyyy'}), 400
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({'error': 'Invalid limit, expected at least 1'}), 400
+    return json_response(encode_books(store.due_before(before, limit)))
 
 
 @app.route('/books/<int:book_id>', methods=['GET'])
 def get_book(book_id):
     """
-    Get details of a single book by its ID (index).
-    Returns 404 if book not found.
+    Get details of a single book by its ID.
+    Returns 404 if book not found. The ETag changes whenever the book changes,
+    and a request with a matching If-None-Match gets 304 Not Modified.
     """
-    books = load_books()
-    if 0 <= book_id < len(books):
-        return jsonify(books[book_id])
-    return jsonify({'error': 'Book not found'}), 404
+    # Read the version before the book, so a change in between can only make the tag older
+    version = store.book_version(book_id)
+    book = store.get(book_id)
+    if book is None:
+        return jsonify({'error': 'Book not found'}), 404
+    etag = f'b{book_id}-{version}'
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    with metrics.stage('serialize'):
+        body = records.encode(book)
+    return tagged(json_response(body), etag)
 
 
 @app.route('/books', methods=['POST'])
@@ -85,18 +587,17 @@ def create_book():
     """
     Add a new book. Expects JSON or form data with
     fields: name, publication_date, author, category.
+    The book is given a new persistent id.
     """
-    books = load_books()
     data = request.get_json() if request.is_json else request.form.to_dict()
-    required_fields = ('name', 'publication_date', 'author', 'category')
 
     # Check for missing fields
-    if not all(k in data for k in required_fields):
-        return jsonify({'error': 'Missing fields'}), 400
+    error = validate_book(data)
+    if error:
+        return jsonify({'error': error}), 400
 
     data['borrowed'] = False
-    books.append(data)
-    save_books(books)
+    store.add(data)
     if request.is_json:
         return jsonify(data), 201
     else:
@@ -104,33 +605,273 @@ def create_book():
         return redirect('/')
 
 
+@app.route('/books/bulk', methods=['POST'])
+def bulk_create_books():
+    """
+    Add many books at once. Expects a JSON list of books (or {'books': [...]}), each
+    with fields name, publication_date, author, category.
+    All books are validated first: if any is invalid nothing is added and the answer is
+    400 with {'error', 'results'}, where results has {'index', 'status', 'error'} per bad book.
+    Otherwise all books are stored with a single write and the answer is 201 with
+    {'results': [{'status': 201, 'book': ...}, ...]} in request order.
+    """
+    data = request.get_json(silent=True)
+    books = data.get('books') if isinstance(data, dict) else data
+    if not isinstance(books, list):
+        return jsonify({'error': 'Expected a list of books'}), 400
+    if len(books) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} books per request'}), 400
+
+    errors = []
+    for i, book in enumerate(books):
+        error = validate_book(book)
+        if error:
+            errors.append({'index': i, 'status': 400, 'error': error})
+    if errors:
+        return jsonify({'error': 'Bulk add rejected', 'results': errors}), 400
+
+    for book in books:
+        book['borrowed'] = False
+    added = store.add_many(books)
+    return jsonify({'results': [{'status': 201, 'book': book} for book in added]}), 201
+
+
+@app.route('/books/batch', methods=['POST'])
+def batch_books():
+    """
+    Apply many operations on existing books at once. Expects a JSON list of operations
+    (or {'operations': [...]}), each {'op': ..., 'id': <book id>, ...} where op is one of:
+    'borrow' (optional 'due_date', 'borrower_name'), 'return', 'delete', or
+    'edit' (with 'fields', a dict of name/publication_date/author/category).
+    Operations run in order, so a book can be borrowed and returned in one batch.
+    Every operation is checked before any is applied: if one would fail nothing is changed
+    and the answer is 400 with {'error', 'results'}, one {'status'[, 'error']} per operation.
+    Otherwise they are applied atomically with a single write and the answer is
+    {'results': [{'status': 200, 'book': <book after the operation>}, ...]}.
+    """
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else data
+    if not isinstance(operations, list):
+        return jsonify({'error': 'Expected a list of operations'}), 400
+    if len(operations) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} operations per request'}), 400
+
+    results = []
+
+    def plan(get):
+        # Runs under the store's write and inter-process locks, so no other request (in this
+        # or another process) changes the books between these checks and the write. Each
+        # operation is checked against the books as the earlier operations leave them
+        pending = {}
+        records = []
+        failed = False
+        results.clear()
+        for operation in operations:
+            if not isinstance(operation, dict):
+                operation = {}
+            book_id = operation.get('id')
+            if type(book_id) is not int:
+                failed = True
+                results.append({'status': 400, 'error': 'Invalid id'})
+                continue
+            if book_id not in pending:
+                book = get(book_id)
+                pending[book_id] = dict(book) if book is not None else None
+            record, error = batch_record(operation, pending[book_id])
+            if error:
+                failed = True
+                results.append({'status': error[1], 'error': error[0]})
+                continue
+            records.append(record)
+            results.append({'status': 200})
+            if record['op'] == 'delete':
+                pending[book_id] = None
+            else:
+                pending[book_id].update(record['fields'])
+                for key in record.get('remove', ()):
+                    pending[book_id].pop(key, None)
+        return None if failed else records
+
+    books = store.apply_plan(plan)
+    if books is None:
+        return jsonify({'error': 'Batch rejected', 'results': results}), 400
+    return jsonify({'results': [{'status': 200, 'book': book} for book in books]})
+
+
+def export_chunks(fmt):
+    """
+    Generate the whole catalogue as CSV or JSON Lines text, TRANSFER_CHUNK_SIZE books
+    at a time. Books are read page by page through keyset pagination, so memory use
+    does not grow with the catalogue and changes made meanwhile do not break the export.
+    Logs the throughput when done.
+    """
+    started = time.perf_counter()
+    count = 0
+    cursor = None
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, EXPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+    while True:
+        books, _, cursor = store.page(limit=TRANSFER_CHUNK_SIZE, cursor=cursor)
+        if fmt == 'csv':
+            writer.writerows(books)
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            # Encoded without the record cache: a whole-catalogue export would only evict
+            # the books that are listed often
+            chunk = b''.join(dumps(book) + b'\n' for book in books)
+        count += len(books)
+        yield chunk
+        if cursor is None:
+            break
+    elapsed = time.perf_counter() - started
+    app.logger.info('Exported %d books in %.2fs (%.0f books/s)', count, elapsed, count / max(elapsed, 1e-9))
+
+
+def import_rows(fmt, stream):
+    """
+    Parse an uploaded CSV or JSON Lines body one row at a time.
+    Yields (line number, book dict) or (line number, None) for a row that cannot be parsed.
+    CSV cells that are empty are left out, and 'borrowed' is read as true/false.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            book = {k: v for k, v in row.items() if k and v not in (None, '')}
+            if 'borrowed' in book:
+                book['borrowed'] = book['borrowed'].strip().lower() in ('true', '1', 'yes')
+            yield reader.line_num, book
+        return
+    for line_num, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_num, loads(line)
+        except ValueError:
+            yield line_num, None
+
+
+@app.route('/books/export', methods=['GET'])
+def export_books():
+    """
+    Stream the whole catalogue as a download. Optional parameter 'format': 'jsonl'
+    (default, one JSON book per line) or 'csv' (header row, columns EXPORT_FIELDS).
+    """
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'Invalid format'}), 400
+    response = app.response_class(export_chunks(fmt), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=books.{fmt}'
+    return response
+
+
+@app.route('/books/import', methods=['POST'])
+def import_books():
+    """
+    Add the books of an uploaded file, sent as the raw request body.
+    Optional parameter 'format': 'jsonl' (default) or 'csv' (as written by /books/export).
+    The body is parsed as it arrives and committed in chunks (see IMPORT_CHUNK_RATIO),
+    so the upload itself is never held in memory; a failure part way through keeps the
+    chunks committed before it. Every book gets a new id; rows missing a
+    required field (the same check as POST /books) are skipped.
+    Returns {'imported', 'rejected', 'errors': [{'line', 'error'}, ...], 'seconds',
+    'books_per_second'}, with at most MAX_IMPORT_ERRORS errors listed.
+    """
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'Invalid format'}), 400
+
+    started = time.perf_counter()
+    imported = rejected = 0
+    errors = []
+    chunk = []
+    chunk_size = max(TRANSFER_CHUNK_SIZE, len(store.books()) // IMPORT_CHUNK_RATIO)
+
+    def reject(line_num, error):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append({'line': line_num, 'error': error})
+
+    def summary():
+        elapsed = time.perf_counter() - started
+        return {
+            'imported': imported,
+            'rejected': rejected,
+            'errors': errors,
+            'seconds': round(elapsed, 3),
+            'books_per_second': round(imported / max(elapsed, 1e-9)),
+        }
+
+    try:
+        for line_num, book in import_rows(fmt, request.stream):
+            error = validate_book(book) if book is not None else 'Invalid JSON'
+            if error:
+                reject(line_num, error)
+                continue
+            book.pop('id', None)
+            book.setdefault('borrowed', False)
+            chunk.append(book)
+            if len(chunk) >= chunk_size:
+                imported += len(store.add_many(chunk))
+                chunk = []
+                chunk_size = max(TRANSFER_CHUNK_SIZE, len(store.books()) // IMPORT_CHUNK_RATIO)
+        if chunk:
+            imported += len(store.add_many(chunk))
+    except (UnicodeDecodeError, csv.Error) as e:
+        result = summary()
+        result['error'] = f'Cannot parse upload: {e}'
+        return jsonify(result), 400
+    result = summary()
+    app.logger.info('Imported %d books in %.2fs (%d books/s)',
+                    imported, result['seconds'], result['books_per_second'])
+    return jsonify(result)
+
+
 @app.route('/books/<int:book_id>', methods=['DELETE'])
 def delete_book(book_id):
     """
     Delete a book by its ID.
     """
-    books = load_books()
-    if 0 <= book_id < len(books):
-        deleted = books.pop(book_id)
-        save_books(books)
+    deleted = store.delete(book_id)
+    if deleted is not None:
         return jsonify(deleted)
     return jsonify({'error': 'Book not found'}), 404
 
 
+def check_available(book):
+    """
+    Precondition of a borrow: returns an error message if the book is already borrowed.
+    """
+    return 'Book already borrowed' if book.get('borrowed', False) else None
+
+
+def check_borrowed(book):
+    """
+    Precondition of a return: returns an error message if the book is not borrowed.
+    """
+    return None if book.get('borrowed', False) else 'Book not borrowed'
+
+
 def update_borrowed_status(book_id, borrowed_status):
     """
     Helper function to update borrowed status of a book.
     Returns tuple (success: bool, response: dict or tuple with error and code).
     """
-    books = load_books()
-    if 0 <= book_id < len(books):
-        if books[book_id].get('borrowed', False) == borrowed_status:
-            err_msg = 'Book already borrowed' if borrowed_status else 'Book not borrowed'
-            return False, (jsonify({'error': err_msg}), 400)
-        books[book_id]['borrowed'] = borrowed_status
-        save_books(books)
-        return True, jsonify(books[book_id])
-    return False, (jsonify({'error': 'Book not found'}), 404)
+    # The check runs inside the store's write, under its inter-process lock, so concurrent
+    # requests (in this or another server process) cannot both pass it
+    precondition = check_available if borrowed_status else check_borrowed
+    try:
+        book = store.update(book_id, {'borrowed': borrowed_status}, precondition=precondition)
+    except ValueError as e:
+        return False, (jsonify({'error': str(e)}), 400)
+    if book is None:
+        return False, (jsonify({'error': 'Book not found'}), 404)
+    return True, jsonify(book)
 
 
 @app.route('/books/<int:book_id>/borrow', methods=['POST'])
@@ -139,20 +880,19 @@ def borrow_book(book_id):
     Mark a book as borrowed. Expects optional JSON or form data with 'due_date' (dd.mm.yyyy) and 'borrower_name'.
     Sets borrow_date automatically to current date.
     """
-    books = load_books()
-    if not (0 <= book_id < len(books)):
-        return jsonify({'error': 'Book not found'}), 404
-    if books[book_id].get('borrowed', False):
-        return jsonify({'error': 'Book already borrowed'}), 400
-    books[book_id]['borrowed'] = True
-    books[book_id]['borrow_date'] = datetime.datetime.now().strftime('%d.%m.%Y')
     data = request.get_json() if request.is_json else request.form.to_dict()
-    if data and 'due_date' in data:
-        books[book_id]['due_date'] = data['due_date']
-    if data and 'borrower_name' in data:
-        books[book_id]['borrower_name'] = data['borrower_name']
-    save_books(books)
-    return jsonify(books[book_id])
+    error = validate_due_date(data)
+    if error:
+        return jsonify({'error': error}), 400
+    # The check runs inside the store's write, under its inter-process lock, so concurrent
+    # requests (in this or another server process) cannot both pass it
+    try:
+        book = store.update(book_id, borrow_changes(data), precondition=check_available)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if book is None:
+        return jsonify({'error': 'Book not found'}), 404
+    return jsonify(book)
 
 
 @app.route('/books/<int:book_id>/return', methods=['POST'])
@@ -161,20 +901,14 @@ def return_book(book_id):
     Mark a book as returned (not borrowed).
     Clears borrow_date, due_date, and borrower_name.
     """
-    books = load_books()
-    if not (0 <= book_id < len(books)):
+    try:
+        book = store.update(book_id, {'borrowed': False}, remove=('borrow_date', 'due_date', 'borrower_name'),
+                            precondition=check_borrowed)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if book is None:
         return jsonify({'error': 'Book not found'}), 404
-    if not books[book_id].get('borrowed', False):
-        return jsonify({'error': 'Book not borrowed'}), 400
-    books[book_id]['borrowed'] = False
-    if 'borrow_date' in books[book_id]:
-        del books[book_id]['borrow_date']
-    if 'due_date' in books[book_id]:
-        del books[book_id]['due_date']
-    if 'borrower_name' in books[book_id]:
-        del books[book_id]['borrower_name']
-    save_books(books)
-    return jsonify(books[book_id])
+    return jsonify(book)
 
 
 @app.route('/web/borrow/<int:book_id>', methods=['POST'])
@@ -200,18 +934,16 @@ def web_delete_book(book_id):
     """
     Web interface: delete a book and redirect to main page.
     """
-    books = load_books()
-    if 0 <= book_id < len(books):
-        books.pop(book_id)
-        save_books(books)
+    store.delete(book_id)
     return redirect('/')
 
 
-def render_book_row(book, idx):
+def render_book_row(book, overdue=False):
     """
     Helper function to generate a table row HTML string for one book in the web UI.
-    Marks row red if borrowed and due_date is past today.
+    Marks row red if overdue is set (see BookStore.overdue_ids).
     """
+    idx = book['id']
     status = "Borrowed" if book.get('borrowed', False) else "Available"
     actions = ""
     if not book.get('borrowed', False):
@@ -221,14 +953,10 @@ def render_book_row(book, idx):
     actions += f'<form method="post" action="/web/delete/{idx}" style="display:inline;"><button type="submit">Delete</button></form>'
     actions += f'<form method="get" action="/edit/{idx}" style="display:inline; margin-left: 5px;"><button type="submit">Edit</button></form>'
 
-    # Check if overdue
-    today = datetime.datetime.now().strftime('%d.%m.%Y')
-    due_date = book.get('due_date', '')
-    is_overdue = book.get('borrowed', False) and due_date and due_date < today
-    row_style = 'style="background-color: red;"' if is_overdue else ''
+    row_style = 'style="background-color: red;"' if overdue else ''
 
     return f"""
-    <tr {row_style}>
+    <tr id="book-{idx}" {row_style}>
         <td>{book.get('name','')}</td>
         <td>{book.get('author','')}</td>
         <td>{book.get('publication_date','')}</td>
@@ -242,30 +970,117 @@ def render_book_row(book, idx):
     """
 
 
+@app.route('/web/row/<int:book_id>', methods=['GET'])
+def web_book_row(book_id):
+    """
+    Web interface: the table row of one book, used by the main page to update itself live.
+    """
+    book = store.get(book_id)
+    if book is None:
+        return "Book not found", 404
+    with metrics.stage('render'):
+        return render_book_row(book, bool(store.overdue_ids([book])))
+
+
+@app.route('/debug/cache', methods=['GET'])
+def cache_stats():
+    """
+    Hit/miss counters and size of the response cache.
+    """
+    return jsonify(response_cache.stats())
+
+
+@app.route('/debug/profiles', methods=['GET'])
+def list_profiles():
+    """
+    The saved request profiles as {'captures', 'missed'}. captures lists them slowest first:
+    their file name in LIBRARY_PROFILE_DIR, route, method, query string, duration in ms
+    and time. Optional 'limit' (default 20). missed is {'count', 'recent'}: the slow requests
+    this server process could not profile because another request was being profiled.
+    Returns 404 unless profiling is enabled.
+    """
+    if not profiler.enabled:
+        return jsonify({'error': 'Profiling is disabled, set LIBRARY_PROFILE_SAMPLE or LIBRARY_PROFILE_SLOW_MS'}), 404
+    return jsonify({'captures': profiler.captures(request.args.get('limit', 20, type=int)),
+                    'missed': profiler.missed()})
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus metrics: requests per route, method and status, latency and payload size
+    histograms, in-flight requests, the time spent in the storage, filter, serialize and
+    render stages, and the response cache and catalogue size.
+    Returns 404 unless the backend was started with LIBRARY_METRICS=1.
+    """
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled, set LIBRARY_METRICS=1'}), 404
+    cache = response_cache.stats()
+    extra = (
+        ('library_cache_hits_total', 'counter', 'Response cache hits.', cache['hits']),
+        ('library_cache_misses_total', 'counter', 'Response cache misses.', cache['misses']),
+        ('library_cache_entries', 'gauge', 'Responses in the cache.', cache['entries']),
+        ('library_cache_bytes', 'gauge', 'Size of the cached responses.', cache['bytes']),
+        ('library_books', 'gauge', 'Books in the catalogue.', len(store.books())),
+    )
+    return app.response_class(metrics.render(extra), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/')
 def index():
     """
     Web UI main page that displays the list of books with filters.
-    Filters supported: borrowed status, name search, category.
+    Filters supported: borrowed status, exact name, category, and a full-text search ('q')
+    over name, author and category whose results are listed by relevance.
+    Books are shown WEB_PAGE_SIZE at a time in the chosen sort order, with a link to the next page.
+    Rendered pages are cached per catalogue version, day (for the overdue marks) and parameters.
+    """
+    args = tuple(sorted((k, v) for k, v in request.args.items() if v))
+    key = ('index', store.version, today_key(), args)
+    html = response_cache.get(key)
+    if html is None:
+        try:
+            html = render_index()
+        except ValueError:
+            return redirect('/')
+        response_cache.put(key, html)
+    return html
+
+
+def render_index():
+    """
+    Render the main page for the current request's parameters.
+    Raises ValueError for an invalid page cursor.
     """
-    books = load_books()
     borrowed_filter = request.args.get('borrowed')
     name_search = request.args.get('name')
     category_filter = request.args.get('category')
+    text_search = request.args.get('q', '').strip()
+    sort = request.args.get('sort') or 'id'
+    if sort not in SORT_FIELDS:
+        sort = 'id'
 
-    filtered_books = []
-    for idx, book in enumerate(books):
-        if borrowed_filter == 'available' and book.get('borrowed', False):
-            continue
-        elif borrowed_filter == 'borrowed' and not book.get('borrowed', False):
-            continue
-        if name_search and book.get('name', '').lower() != name_search.lower():
-            continue
-        if category_filter and book.get('category', '').lower() != category_filter.lower():
-            continue
-        filtered_books.append((idx, book))
+    next_cursor = None
+    with metrics.stage('filter'):
+        if text_search:
+            filtered_books = store.search(text_search, WEB_PAGE_SIZE)
+            total = len(filtered_books)
+        else:
+            filtered_books, total, next_cursor = store.page(
+                borrowed_filter, category_filter, name_search, sort, WEB_PAGE_SIZE, request.args.get('cursor'))
+
+    with metrics.stage('render'):
+        overdue = set(store.overdue_ids(filtered_books))
+        table_rows = "".join([render_book_row(book, book['id'] in overdue) for book in filtered_books])
 
-    table_rows = "".join([render_book_row(book, idx) for idx, book in filtered_books])
+    # Links to the first and next page keep the current filters and sort order
+    page_args = {k: v for k, v in request.args.items() if k != 'cursor' and v}
+    pagination = f'<p>{total} books'
+    if 'cursor' in request.args:
+        pagination += f' | <a href="/?{urlencode(page_args)}">First page</a>'
+    if next_cursor:
+        pagination += f' | <a href="/?{urlencode(dict(page_args, cursor=next_cursor))}">Next page</a>'
+    pagination += '</p>'
 
     return f"""
     <!DOCTYPE html>
@@ -298,10 +1113,17 @@ def index():
                 <option value="History" {"selected" if category_filter=="History" else ""}>History</option>
                 <option value="Philosophy" {"selected" if category_filter=="Philosophy" else ""}>Philosophy</option>
             </select>
+            <select name="sort" style="margin-left: 10px;">
+                <option value="id" {"selected" if sort=="id" else ""}>Sort: Added</option>
+                <option value="name" {"selected" if sort=="name" else ""}>Sort: Name</option>
+                <option value="author" {"selected" if sort=="author" else ""}>Sort: Author</option>
+                <option value="publication_date" {"selected" if sort=="publication_date" else ""}>Sort: Publication Date</option>
+                <option value="due_date" {"selected" if sort=="due_date" else ""}>Sort: Due Date</option>
+            </select>
             <button type="submit">Filter</button>
         </form>
         <form method="get" style="margin-bottom: 10px;">
-            <input name="name" placeholder="Search by exact name" value="{name_search or ''}">
+            <input name="q" placeholder="Search by title, author or category" value="{text_search}">
             <button type="submit">Search</button>
         </form>
         <form method="post" action="/books" style="margin-bottom: 10px;">
@@ -336,6 +1158,25 @@ def index():
                 {table_rows}
             </tbody>
         </table>
+        {pagination}
+        <script>
+            // Update the rows on this page as books change, without reloading it
+            const source = new EventSource('/events');
+            source.addEventListener('upsert', async (e) => {{
+                const row = document.getElementById('book-' + JSON.parse(e.data).id);
+                if (!row) return;
+                const response = await fetch('/web/row/' + JSON.parse(e.data).id);
+                if (response.ok) row.outerHTML = await response.text();
+            }});
+            source.addEventListener('delete', (e) => {{
+                const row = document.getElementById('book-' + JSON.parse(e.data).id);
+                if (row) row.remove();
+            }});
+            source.addEventListener('reset', () => {{
+                source.close();
+                location.reload();
+            }});
+        </script>
     </body>
     </html>
     """
@@ -347,27 +1188,21 @@ def edit_book(book_id):
     Edit a book's details via web form.
     Supports GET to show form and POST to submit updates.
     """
-    books = load_books()
-    if book_id < 0 or book_id >= len(books):
+    book = store.get(book_id)
+    if book is None:
         return "Book not found", 404
 
     if request.method == 'POST':
         form = request.form
         # Validate required fields
-        required_fields = ('name', 'publication_date', 'author', 'category')
-        if not all(k in form for k in required_fields):
+        if not all(k in form for k in REQUIRED_FIELDS):
             return "Missing fields", 400
 
         # Update book info
-        books[book_id]['name'] = form['name']
-        books[book_id]['publication_date'] = form['publication_date']
-        books[book_id]['author'] = form['author']
-        books[book_id]['category'] = form['category']
-        save_books(books)
+        store.update(book_id, {k: form[k] for k in REQUIRED_FIELDS})
         return redirect('/')
 
     # Show edit form
-    book = books[book_id]
     return f"""
     <!DOCTYPE html>
     <html lang="en">
@@ -0,0 +1,456 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CATEGORIES = ('Fiction', 'Non-Fiction', 'Science', 'History', 'Philosophy')
+CATEGORY_WEIGHTS = (35, 25, 15, 15, 10)
+TITLE_WORDS = ('Silent', 'Patient', 'Stone', 'Garden', 'River', 'Empire', 'Night', 'Origin',
+               'Mind', 'Shadow', 'History', 'Light', 'Winter', 'Journey', 'Secret', 'Ocean')
+FIRST_NAMES = ('Alex', 'Maria', 'John', 'Omar', 'Yuki', 'Ines', 'Peter', 'Lena', 'Ravi', 'Sara')
+LAST_NAMES = ('Smith', 'Lark', 'Novak', 'Haddad', 'Tanaka', 'Moreau', 'Okafor', 'Berg', 'Costa', 'Kim')
+
+# Share of books that are borrowed, and of those the share that is overdue
+BORROWED_RATIO = 0.3
+OVERDUE_RATIO = 0.25
+
+
+def generate_books(count, seed=0):
+    """
+    Return count synthetic books with a realistic mix: weighted categories, about
+    BORROWED_RATIO of them borrowed, and due dates spread around today so that
+    about OVERDUE_RATIO of the loans are overdue. The same seed gives the same books.
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    books = []
+    for i in range(count):
+        book = {
+            'id': i,
+            'name': f"The {rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)} {i}",
+            'publication_date': str(rng.randint(1800, 2025)),
+            'author': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.randint(1, 500)}",
+            'category': rng.choices(CATEGORIES, CATEGORY_WEIGHTS)[0],
+            'borrowed': rng.random() < BORROWED_RATIO,
+        }
+        if book['borrowed']:
+            days = -rng.randint(1, 60) if rng.random() < OVERDUE_RATIO else rng.randint(0, 30)
+            due = today + datetime.timedelta(days=days)
+            book['borrow_date'] = (due - datetime.timedelta(days=14)).strftime('%d.%m.%Y')
+            book['due_date'] = due.strftime('%d.%m.%Y')
+            book['borrower_name'] = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        books.append(book)
+    return books
+
+
+def write_catalogue(path, count, seed=0):
+    """
+    Write a synthetic catalogue of count books as a data.db file at path.
+    """
+    books = generate_books(count, seed)
+    with open(path, 'w') as f:
+        json.dump({'next_id': count, 'books': books}, f)
+    return books
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+    }
+
+
+def plan(books, reads, writes):
+    """
+    Return the list of (endpoint name, [(method, path, json body), ...]) to run, in order.
+    Every backend route is covered except GET /events (a stream that never ends), GET
+    /metrics (off unless LIBRARY_METRICS is set) and the /web/borrow, /web/return and
+    /web/delete redirects (thin wrappers around the API routes measured here).
+    Writes use distinct books, so that they all succeed when run concurrently: borrows
+    and returns use available books, and deletes remove the books added earlier in the run.
+    """
+    rng = random.Random(1)
+    ids = [book['id'] for book in books]
+    available = [book['id'] for book in books if not book['borrowed']]
+    pick = lambda: rng.choice(ids)
+    new_book = lambda i: {'name': f"Benchmark {i}", 'publication_date': '2024',
+                          'author': 'Bench Mark', 'category': 'Science'}
+    today = datetime.date.today()
+    soon = (today + datetime.timedelta(days=7)).strftime('%d.%m.%Y')
+    borrow_ids = available[:writes]
+    batch_ids = available[writes:writes * 2]
+    steps = [
+        ('GET /books', [('GET', '/books', None)] * max(reads // 10, 1)),
+        ('GET /books?category&borrowed', [
+            ('GET', f"/books?category={rng.choice(CATEGORIES)}&borrowed={rng.choice(['available', 'borrowed'])}", None)
+            for _ in range(reads)]),
+        ('GET /books?limit', [('GET', '/books?limit=50', None)] * reads),
+        ('GET /books?sort&limit', [('GET', '/books?sort=name&limit=50', None)] * reads),
+        ('GET /books/<id>', [('GET', f"/books/{pick()}", None) for _ in range(reads)]),
+        ('GET /books/search', [('GET', f"/books/search?q={rng.choice(TITLE_WORDS)}+{rng.choice(LAST_NAMES)}", None)
+                               for _ in range(reads)]),
+        ('GET /books/suggest', [('GET', f"/books/suggest?prefix={rng.choice(TITLE_WORDS)[:3]}", None)
+                                for _ in range(reads)]),
+        ('GET /books/changes', [('GET', '/books/changes?since=0', None)] * reads),
+        ('GET /books/overdue', [('GET', '/books/overdue?limit=100', None)] * reads),
+        ('GET /books/due', [('GET', f"/books/due?before={soon}&limit=100", None)] * reads),
+        ('GET /books/export', [('GET', '/books/export?format=jsonl', None)] * max(reads // 50, 1)),
+        ('GET /healthz', [('GET', '/healthz', None)] * reads),
+        ('GET /readyz', [('GET', '/readyz', None)] * reads),
+        ('GET /debug/cache', [('GET', '/debug/cache', None)] * reads),
+        ('GET /', [('GET', f"/?category={rng.choice(CATEGORIES)}", None) for _ in range(reads)]),
+        ('GET /web/row/<id>', [('GET', f"/web/row/{pick()}", None) for _ in range(reads)]),
+        ('GET /edit/<id>', [('GET', f"/edit/{pick()}", None) for _ in range(reads)]),
+        ('POST /books', [('POST', '/books', new_book(i)) for i in range(writes)]),
+        ('POST /books/bulk', [('POST', '/books/bulk', [new_book(f"{i}-{j}") for j in range(100)])
+                              for i in range(max(writes // 10, 1))]),
+        ('POST /books/import', [('POST', '/books/import?format=jsonl',
+                                 ''.join(json.dumps(new_book(f"import {i}-{j}")) + '\n' for j in range(100)))
+                                for i in range(max(writes // 10, 1))]),
+        ('POST /books/<id>/borrow', [('POST', f"/books/{book_id}/borrow",
+                                      {'borrower_name': 'Bench', 'due_date': soon}) for book_id in borrow_ids]),
+        ('POST /books/<id>/return', [('POST', f"/books/{book_id}/return", None) for book_id in borrow_ids]),
+        ('POST /books/batch', [('POST', '/books/batch', [
+            {'op': 'borrow', 'id': book_id, 'due_date': soon}, {'op': 'return', 'id': book_id}])
+            for book_id in batch_ids]),
+        ('POST /edit/<id>', [('POST', f"/edit/{book_id}", dict(new_book(book_id), form=True))
+                             for book_id in borrow_ids]),
+        ('DELETE /books/<id>', 'added'),
+    ]
+    return steps
+
+
+def run_steps(steps, send, concurrency):
+    """
+    Run every step of plan() with send(method, path, body) -> (status, payload) on
+    concurrency threads and return {endpoint: summary}.
+    """
+    results = {}
+    added = []
+    for name, calls in steps:
+        if calls == 'added':
+            calls = [('DELETE', f"/books/{book_id}", None) for book_id in added]
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+
+        def call(request):
+            nonlocal errors
+            method, path, body = request
+            started = time.perf_counter()
+            status, payload = send(method, path, body)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors += 1
+                elif name == 'POST /books' and isinstance(payload, dict):
+                    added.append(payload['id'])
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(call, calls))
+        results[name] = summarize(latencies, errors, time.perf_counter() - started)
+    return results
+
+
+def split_body(body):
+    """
+    Return (json body, form data, raw data) for a planned request body.
+    """
+    if isinstance(body, str):
+        return None, None, body.encode()
+    if isinstance(body, dict) and body.get('form'):
+        return None, {k: v for k, v in body.items() if k != 'form'}, None
+    return body, None, None
+
+
+def bench_in_process(data_file, engine, reads, writes, concurrency):
+    """
+    Drive the routes through Flask's test client. Must run in a fresh process, because
+    backend.py opens its data file when imported.
+    """
+    os.environ['LIBRARY_DATA_FILE'] = data_file
+    os.environ['LIBRARY_STORAGE'] = engine
+    started = time.perf_counter()
+    import backend
+    load_seconds = time.perf_counter() - started
+    books = list(backend.store.books().values())
+    local = threading.local()
+
+    def send(method, path, body):
+        if not hasattr(local, 'client'):
+            local.client = backend.app.test_client()
+        json_body, form, data = split_body(body)
+        response = local.client.open(path, method=method, json=json_body, data=form or data)
+        payload = response.get_json(silent=True) if response.mimetype == 'application/json' else None
+        return response.status_code, payload
+
+    results = run_steps(plan(books, reads, writes), send, concurrency)
+    return {'load_seconds': round(load_seconds, 3), 'endpoints': results}
+
+
+def bench_http(base_url, books, reads, writes, concurrency):
+    """
+    Drive the routes over real HTTP against a running server, one keep-alive
+    session per thread.
+    """
+    import requests
+    local = threading.local()
+
+    def send(method, path, body):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        json_body, form, data = split_body(body)
+        response = local.session.request(method, base_url + path, json=json_body, data=form or data,
+                                         allow_redirects=False, timeout=300)
+        payload = None
+        if response.headers.get('Content-Type', '').startswith('application/json'):
+            payload = response.json()
+        return response.status_code, payload
+
+    return {'endpoints': run_steps(plan(books, reads, writes), send, concurrency)}
+
+
+def bench_gui(base_url, data_file, repeat=3):
+    """
+    Time MainWindow.populate_table() for the whole catalogue on the offscreen Qt
+    platform, best of repeat runs. Must run in a fresh process.
+    """
+    os.environ['QT_QPA_PLATFORM'] = 'offscreen'
+    from PyQt6.QtWidgets import QApplication
+    from gui import MainWindow
+    from storage import JSONStorage
+
+    books = list(JSONStorage(data_file).load()[0].values())
+    app = QApplication([])
+    window = MainWindow(base_url)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        window.populate_table(books)
+        app.processEvents()
+        timings.append(time.perf_counter() - started)
+    window.close()
+    return {'books': len(books), 'populate_table_ms': round(min(timings) * 1000, 3)}
+
+
+def run_worker(mode, *args):
+    """
+    Run bench_<mode>(*args) in a fresh Python process and return its result.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--worker', mode, json.dumps(args)]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_mode(runs, size, mode, bench, *args):
+    """
+    Run bench(*args) and store its result as runs[mode]. A mode that fails is recorded
+    as {'error': ...} instead, so the results of the other modes are still written.
+    Returns whether it succeeded.
+    """
+    try:
+        runs[mode] = bench(*args)
+    except Exception as e:
+        if isinstance(e, subprocess.CalledProcessError):
+            error = f"worker exited with code {e.returncode}"
+        else:
+            error = f"{type(e).__name__}: {e}"
+        runs[mode] = {'error': error}
+        print(f"{size} books: {mode} failed: {error}", file=sys.stderr)
+        return False
+    print(f"{size} books: {mode} done", file=sys.stderr)
+    return True
+
+
+def start_server(data_file, engine, port, threads):
+    """
+    Start `main.py --serve` on a copy of the catalogue and wait until it is ready.
+    """
+    from main import wait_until_ready
+    env = dict(os.environ, LIBRARY_DATA_FILE=data_file, LIBRARY_STORAGE=engine)
+    here = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen([sys.executable, os.path.join(here, 'main.py'), '--serve',
+                                '--port', str(port), '--threads', str(threads)], env=env, cwd=here)
+    try:
+        wait_until_ready(f"http://127.0.0.1:{port}/readyz", [ProcessHandle(process)], timeout=600)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process
+
+
+class ProcessHandle:
+    """
+    Adapts a subprocess.Popen to the is_alive()/exitcode interface wait_until_ready expects.
+    """
+    def __init__(self, process):
+        self.process = process
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    @property
+    def exitcode(self):
+        return self.process.returncode
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return a list of regressions of results against baseline: endpoints whose p95
+    latency grew, or whose throughput fell, by more than tolerance (e.g. 0.25 = 25%).
+    """
+    regressions = []
+    for size, modes in results['runs'].items():
+        for mode, run in modes.items():
+            old_run = baseline.get('runs', {}).get(size, {}).get(mode)
+            if not old_run:
+                continue
+            for endpoint, new in run.get('endpoints', {}).items():
+                old = old_run.get('endpoints', {}).get(endpoint)
+                if not old:
+                    continue
+                where = f"{size} books, {mode}, {endpoint}"
+                if old['p95_ms'] and new['p95_ms'] and new['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+                    regressions.append(f"{where}: p95 {old['p95_ms']} ms -> {new['p95_ms']} ms")
+                if (old['throughput_rps'] and new['throughput_rps']
+                        and new['throughput_rps'] < old['throughput_rps'] * (1 - tolerance)):
+                    regressions.append(f"{where}: throughput {old['throughput_rps']} -> {new['throughput_rps']} req/s")
+            old_gui, new_gui = old_run.get('populate_table_ms'), run.get('populate_table_ms')
+            if old_gui and new_gui and new_gui > old_gui * (1 + tolerance):
+                regressions.append(f"{size} books, gui: populate_table {old_gui} ms -> {new_gui} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the library backend and GUI on synthetic catalogues.")
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help="comma-separated catalogue sizes (default 1000,10000,100000; add 1000000 for 1M)")
+    parser.add_argument('--modes', default='in-process,http,gui',
+                        help="comma-separated: in-process (Flask test client), http (real server), gui")
+    parser.add_argument('--engine', default='json', choices=('json', 'journal', 'snapshot', 'sqlite'))
+    parser.add_argument('--reads', type=int, default=200, help="requests per read endpoint (default 200)")
+    parser.add_argument('--writes', type=int, default=20, help="requests per write endpoint (default 20)")
+    parser.add_argument('--concurrency', type=int, default=4, help="concurrent clients (default 4)")
+    parser.add_argument('--threads', type=int, default=8, help="server threads in http mode (default 8)")
+    parser.add_argument('--port', type=int, default=5099, help="server port in http mode (default 5099)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the synthetic catalogues")
+    parser.add_argument('--output', default='benchmark.json', help="where to write the results")
+    parser.add_argument('--baseline', help="results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown against the baseline before the run fails (default 0.25)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    modes = args.modes.split(',')
+    results = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'engine': args.engine,
+            'reads': args.reads,
+            'writes': args.writes,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+        },
+        'runs': {},
+    }
+    succeeded = True
+    workdir = tempfile.mkdtemp(prefix='library-bench-')
+    try:
+        for size in sizes:
+            source = os.path.join(workdir, f"catalogue-{size}.db")
+            started = time.perf_counter()
+            books = write_catalogue(source, size, args.seed)
+            print(f"{size} books: generated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+            runs = results['runs'][str(size)] = {}
+
+            def fresh_copy(mode):
+                # Every mode starts from the same catalogue; sqlite and snapshot need it migrated first
+                extension = {'sqlite': 'sqlite', 'snapshot': 'snap'}.get(args.engine, 'db')
+                target = os.path.join(workdir, f"{size}-{mode}.{extension}")
+                if args.engine in ('sqlite', 'snapshot'):
+                    from migrate import migrate
+                    migrate(source, target, args.engine)
+                else:
+                    shutil.copy(source, target)
+                return target
+
+            if 'in-process' in modes:
+                succeeded &= run_mode(runs, size, 'in-process', run_worker, 'in_process', fresh_copy('in-process'),
+                                      args.engine, args.reads, args.writes, args.concurrency)
+            server_modes = [mode for mode in ('http', 'gui') if mode in modes]
+            if server_modes:
+                try:
+                    server = start_server(fresh_copy('http'), args.engine, args.port, args.threads)
+                except RuntimeError as e:
+                    for mode in server_modes:
+                        runs[mode] = {'error': f"server did not start: {e}"}
+                    print(f"{size} books: server did not start: {e}", file=sys.stderr)
+                    succeeded = False
+                    continue
+                base_url = f"http://127.0.0.1:{args.port}"
+                try:
+                    if 'http' in modes:
+                        succeeded &= run_mode(runs, size, 'http', bench_http, base_url, books,
+                                              args.reads, args.writes, args.concurrency)
+                    if 'gui' in modes:
+                        succeeded &= run_mode(runs, size, 'gui', run_worker, 'gui', base_url, source)
+                finally:
+                    server.terminate()
+                    server.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            return 1
+        print("No regressions against the baseline", file=sys.stderr)
+    if not succeeded:
+        print("Some modes failed; their results hold the error", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--worker':
+        worker = {'in_process': bench_in_process, 'gui': bench_gui}[sys.argv[2]]
+        print(json.dumps(worker(*json.loads(sys.argv[3]))))
+    else:
+        sys.exit(main())
@@ -0,0 +1,331 @@
+import json
+import socket
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# One list of books from GET /books or GET /books/search, with what is needed to
+# continue (next_cursor) or revalidate it (etag, version) and the set of ids of its
+# overdue books (None if the backend does not send them, as for an unpaged GET /books)
+Listing = namedtuple('Listing', 'books total next_cursor version etag overdue')
+
+
+class LibraryError(Exception):
+    """
+    The backend answered with an error status. message is the backend's 'error' text.
+    """
+    def __init__(self, status_code, message):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+class EventStream:
+    """
+    The events of a GET /events response. Iterating yields {'event', 'id', 'data'} dicts
+    with data decoded from JSON; close() ends the iteration, also from another thread.
+    """
+    def __init__(self, response):
+        self.response = response
+
+    def __iter__(self):
+        event = {}
+        for line in self.response.iter_lines(decode_unicode=True):
+            if not line:
+                if 'data' in event:
+                    yield {'event': event.get('event', 'message'), 'id': event.get('id'),
+                           'data': json.loads(event['data'])}
+                event = {}
+                continue
+            if line.startswith(':'):
+                continue
+            field, _, value = line.partition(':')
+            if value.startswith(' '):
+                value = value[1:]
+            if field == 'data':
+                event['data'] = event['data'] + '\n' + value if 'data' in event else value
+            elif field in ('event', 'id'):
+                event[field] = value
+
+    def close(self):
+        # Closing the response does not wake a thread blocked reading it (and waits
+        # for that read), so the connection is shut down first to make the read return
+        try:
+            sock = socket.socket(fileno=self.response.raw.fileno())
+        except (OSError, ValueError):
+            pass  # already closed
+        else:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            finally:
+                sock.detach()
+        self.response.close()
+
+
+class LibraryClient:
+    """
+    HTTP client for the library backend, shared by the GUI and scripts.
+    All calls go through one requests.Session, so connections are kept alive and
+    reused from a pool instead of opening a new TCP connection per call.
+    Connection failures, and 502/503/504 answers to GET requests, are retried with
+    exponential backoff; POST and DELETE are only retried if they never reached the
+    server. Methods return the decoded JSON and raise LibraryError for error answers
+    and requests.exceptions.RequestException when the backend cannot be reached.
+
+    :param base_url: backend address
+    :param timeout: seconds to wait for a connection and for an answer (or a (connect, read) tuple)
+    :param retries: how many times a failed request is retried
+    :param backoff: backoff factor in seconds (waits backoff, 2*backoff, 4*backoff, ...)
+    :param gzip: ask the backend for gzip-compressed responses
+    :param pool_size: how many connections are kept open for concurrent calls
+    """
+    def __init__(self, base_url="http://localhost:5000", timeout=5, retries=3, backoff=0.2,
+                 gzip=True, pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, method, path, expected=(200,), **kwargs):
+        """
+        Send one request and return the response.
+        Raises LibraryError unless the status is in expected.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        if response.status_code not in expected:
+            try:
+                message = response.json().get('error', response.reason)
+            except ValueError:
+                message = response.reason
+            raise LibraryError(response.status_code, message)
+        return response
+
+    def health(self):
+        """
+        GET /healthz. Returns {'status': 'ok'} while the server process is up.
+        """
+        return self.request('GET', "/healthz").json()
+
+    def ready(self):
+        """
+        GET /readyz. Returns {'status', ...}: 'ready' with the storage engine, number of
+        books and catalogue version once the catalogue is loaded, else 'loading' or
+        'unavailable' (the server answered 503).
+        """
+        return self.request('GET', "/readyz", expected=(200, 503)).json()
+
+    def _listing(self, response, books=None, total=None, next_cursor=None, overdue=None):
+        version = response.headers.get('X-Catalogue-Version')
+        if books is None:
+            books = response.json()
+        return Listing(
+            books,
+            len(books) if total is None else total,
+            next_cursor,
+            int(version) if version else None,
+            response.headers.get('ETag'),
+            None if overdue is None else set(overdue),
+        )
+
+    def list_books(self, borrowed=None, category=None, name=None, sort=None, limit=None, cursor=None,
+                   etag=None):
+        """
+        GET /books. Returns a Listing, or None if etag is given and the list has not changed.
+        With limit or cursor only one page is returned; pass listing.next_cursor for the next.
+        """
+        params = {k: v for k, v in (('borrowed', borrowed), ('category', category), ('name', name),
+                                    ('sort', sort), ('limit', limit), ('cursor', cursor)) if v is not None}
+        headers = {'If-None-Match': etag} if etag else {}
+        response = self.request('GET', "/books", expected=(200, 304), params=params, headers=headers)
+        if response.status_code == 304:
+            return None
+        if limit is None and cursor is None:
+            return self._listing(response)
+        page = response.json()
+        return self._listing(response, page['books'], page['total'], page['next_cursor'], page.get('overdue'))
+
+    def search(self, query, limit=None):
+        """
+        GET /books/search. Returns a Listing of the matches, best first.
+        """
+        params = {'q': query}
+        if limit is not None:
+            params['limit'] = limit
+        response = self.request('GET', "/books/search", params=params)
+        overdue = response.headers.get('X-Overdue')
+        if overdue is not None:
+            overdue = [int(book_id) for book_id in overdue.split(',') if book_id]
+        return self._listing(response, overdue=overdue)
+
+    def suggest(self, prefix, limit=10):
+        """
+        GET /books/suggest. Returns a list of {'text', 'field'}.
+        """
+        return self.request('GET', "/books/suggest", params={'prefix': prefix, 'limit': limit}).json()
+
+    def changes(self, since):
+        """
+        GET /books/changes. Returns {'version', 'upserted', 'deleted', 'overdue'} or
+        {'version', 'reset': True}.
+        """
+        return self.request('GET', "/books/changes", params={'since': since}).json()
+
+    def overdue(self, limit=None):
+        """
+        GET /books/overdue. Returns the borrowed books past their due date, earliest due first.
+        """
+        params = {'limit': limit} if limit is not None else {}
+        return self.request('GET', "/books/overdue", params=params).json()
+
+    def due_before(self, before, limit=None):
+        """
+        GET /books/due. before is 'dd.mm.yyyy' (or 'yyyy-mm-dd'). Returns the borrowed
+        books due before that date, earliest due first.
+        """
+        params = {'before': before}
+        if limit is not None:
+            params['limit'] = limit
+        return self.request('GET', "/books/due", params=params).json()
+
+    def events(self, read_timeout=60):
+        """
+        GET /events. Returns an EventStream of catalogue changes. The server sends a
+        keep-alive every second, so a stream silent for read_timeout
+        seconds is treated as lost and raises.
+        """
+        connect_timeout = self.timeout[0] if isinstance(self.timeout, tuple) else self.timeout
+        response = self.request('GET', "/events", stream=True, timeout=(connect_timeout, read_timeout),
+                                headers={'Accept': 'text/event-stream'})
+        return EventStream(response)
+
+    def get_book(self, book_id, etag=None):
+        """
+        GET /books/<id>. Returns the book, or None if etag is given and the book has not changed.
+        """
+        headers = {'If-None-Match': etag} if etag else {}
+        response = self.request('GET', f"/books/{book_id}", expected=(200, 304), headers=headers)
+        return None if response.status_code == 304 else response.json()
+
+    def add_book(self, name, publication_date, author, category):
+        """
+        POST /books. Returns the new book with its id.
+        """
+        data = {'name': name, 'publication_date': publication_date, 'author': author, 'category': category}
+        return self.request('POST', "/books", expected=(201,), json=data).json()
+
+    def delete_book(self, book_id):
+        """
+        DELETE /books/<id>. Returns the deleted book.
+        """
+        return self.request('DELETE', f"/books/{book_id}").json()
+
+    def borrow_book(self, book_id, borrower_name=None, due_date=None):
+        """
+        POST /books/<id>/borrow. due_date is 'dd.mm.yyyy'. Returns the updated book.
+        """
+        data = {k: v for k, v in (('borrower_name', borrower_name), ('due_date', due_date)) if v is not None}
+        return self.request('POST', f"/books/{book_id}/borrow", json=data).json()
+
+    def return_book(self, book_id):
+        """
+        POST /books/<id>/return. Returns the updated book.
+        """
+        return self.request('POST', f"/books/{book_id}/return").json()
+
+    def bulk_add(self, books):
+        """
+        POST /books/bulk. Adds all books (dicts with name, publication_date, author,
+        category) with one request and one write on the server. Returns the new books
+        in order; if any book is invalid none is added and LibraryError is raised.
+        """
+        response = self.request('POST', "/books/bulk", expected=(201,), json=books)
+        return [result['book'] for result in response.json()['results']]
+
+    def batch(self, operations):
+        """
+        POST /books/batch. operations is a list of {'op': 'borrow'|'return'|'delete'|'edit',
+        'id': ...} dicts, applied in order and all or nothing. Returns the per-operation
+        results; if any operation would fail nothing is applied and LibraryError is raised.
+        """
+        return self.request('POST', "/books/batch", json=operations).json()['results']
+
+    def export_books(self, path, fmt='jsonl', chunk_size=1 << 16):
+        """
+        GET /books/export. Streams the catalogue in format 'jsonl' or 'csv' into the file
+        at path without holding it in memory. Returns the number of bytes written.
+        """
+        written = 0
+        with self.request('GET', "/books/export", params={'format': fmt}, stream=True) as response:
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+        return written
+
+    def import_books(self, path, fmt='jsonl', timeout=None):
+        """
+        POST /books/import. Uploads the 'jsonl' or 'csv' file at path as a stream.
+        Returns {'imported', 'rejected', 'errors', 'seconds', 'books_per_second'}.
+        Large files take a while, so there is no read timeout unless one is given.
+        """
+        connect_timeout = self.timeout[0] if isinstance(self.timeout, tuple) else self.timeout
+        with open(path, 'rb') as f:
+            return self.request('POST', "/books/import", params={'format': fmt}, data=f,
+                                timeout=(connect_timeout, timeout)).json()
+
+    def run_many(self, calls, workers=None):
+        """
+        Run many client calls concurrently over the pooled connections.
+        calls is an iterable of zero-argument callables, e.g. lambda: client.return_book(3).
+        Returns one entry per call, in order: its result, or the exception it raised.
+        """
+        def run(call):
+            try:
+                return call()
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=workers or self.pool_size) as executor:
+            return list(executor.map(run, calls))
+
+    def add_books(self, books, workers=None):
+        """
+        Add many books (dicts with name, publication_date, author, category) concurrently.
+        Returns the new books (or exceptions) in order.
+        """
+        return self.run_many([
+            lambda book=book: self.add_book(book['name'], book['publication_date'], book['author'], book['category'])
+            for book in books
+        ], workers)
+
+    def delete_books(self, book_ids, workers=None):
+        """
+        Delete many books concurrently. Returns the deleted books (or exceptions) in order.
+        """
+        return self.run_many([lambda book_id=book_id: self.delete_book(book_id) for book_id in book_ids], workers)
@@ -0,0 +1,46 @@
+import datetime
+
+# Format of due dates in books and requests
+DUE_DATE_FORMAT = '%d.%m.%Y'
+
+
+def date_key(date):
+    """
+    Return a date as a 'yyyy-mm-dd' string, which compares chronologically.
+    """
+    return f"{date.year:04d}-{date.month:02d}-{date.day:02d}"
+
+
+def due_date_key(due_date):
+    """
+    Turn a 'dd.mm.yyyy' due date into its sortable 'yyyy-mm-dd' key.
+    Returns '' for a missing or invalid date.
+    """
+    text = str(due_date or '').strip()
+    if not text:
+        return ''
+    try:
+        return date_key(datetime.datetime.strptime(text, DUE_DATE_FORMAT))
+    except ValueError:
+        return ''
+
+
+def parse_date_key(text):
+    """
+    Turn a date given as 'dd.mm.yyyy' or 'yyyy-mm-dd' into its sortable key.
+    Returns '' if it is neither.
+    """
+    key = due_date_key(text)
+    if key:
+        return key
+    try:
+        return date_key(datetime.date.fromisoformat(str(text).strip()))
+    except ValueError:
+        return ''
+
+
+def today_key():
+    """
+    Return today's date as a sortable key.
+    """
+    return date_key(datetime.date.today())
@@ -0,0 +1,107 @@
+import json
+import queue
+import threading
+
+# Put in the queue of a subscriber that fell too far behind, in place of its events
+DROPPED = object()
+
+# Put in the queue of a subscriber to make its stream write a keep-alive right away
+PROBE = object()
+
+
+class Subscription:
+    """
+    One subscriber's bounded queue of events.
+    """
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = False
+
+    def get(self, timeout=None):
+        """
+        Return the next event, DROPPED if the subscriber was dropped, or None if
+        nothing arrived within timeout seconds or the subscriber was probed.
+        """
+        try:
+            event = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return None if event is PROBE else event
+
+    def probe(self):
+        """
+        Wake the stream up to send a keep-alive, which fails if its client has gone.
+        """
+        try:
+            self.queue.put_nowait(PROBE)
+        except queue.Full:
+            pass
+
+
+class EventBroker:
+    """
+    Fans change events out to subscribers (the GET /events streams).
+    Every subscriber has a bounded queue, and publish() never blocks: a subscriber
+    whose queue is full is dropped, its pending events are discarded and it gets
+    DROPPED instead, so a slow client can neither hold up writers nor grow memory.
+    A dropped client reconnects and catches up through GET /books/changes.
+    A stream only learns that its client left when it next writes, so when all
+    max_subscribers slots are taken a new subscriber probes the others (see
+    Subscription.probe) and waits briefly for the slots of departed clients.
+    """
+    def __init__(self, queue_size=1000, max_subscribers=4):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Condition()
+
+    def subscribe(self, timeout=0):
+        """
+        Return a new Subscription, or None if there are still max_subscribers after
+        probing them and waiting up to timeout seconds for one to leave.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers and timeout:
+                for subscription in self._subscribers:
+                    subscription.probe()
+                self._lock.wait_for(lambda: len(self._subscribers) < self.max_subscribers, timeout)
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self.queue_size)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            self._lock.notify_all()
+
+    def publish(self, event):
+        """
+        Queue event for every subscriber, dropping the ones that cannot keep up.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                self._drop(subscription)
+
+    def _drop(self, subscription):
+        self.unsubscribe(subscription)
+        subscription.dropped = True
+        while True:
+            try:
+                subscription.queue.get_nowait()
+            except queue.Empty:
+                break
+        subscription.queue.put_nowait(DROPPED)
+
+
+def format_event(event):
+    """
+    Encode a change event ({'op', 'version', ...}) as one Server-Sent Events message,
+    with the op as event type and the catalogue version as event id.
+    """
+    return f"id: {event['version']}\nevent: {event['op']}\ndata: {json.dumps(event)}\n\n"
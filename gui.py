@@ -1,6 +1,7 @@
 # Import required modules for PyQt GUI and HTTP requests
 import sys
-import requests
+import threading
+from client import LibraryClient, LibraryError
 from PyQt6.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -8,8 +9,8 @@ from PyQt6.QtWidgets import (
     QVBoxLayout,
     QHBoxLayout,
     QPushButton,
-    QTableWidget,
-    QTableWidgetItem,
+    QTableView,
+    QAbstractItemView,
     QLineEdit,
     QComboBox,
     QLabel,
@@ -17,8 +18,294 @@ from PyQt6.QtWidgets import (
     QDialog,
     QMessageBox,
     QHeaderView,
+    QCompleter,
+    QProgressBar,
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import (
+    Qt,
+    QTimer,
+    QStringListModel,
+    QObject,
+    QRunnable,
+    QThread,
+    QThreadPool,
+    pyqtSignal,
+    QAbstractTableModel,
+    QModelIndex,
+    QSortFilterProxyModel,
+)
+from PyQt6.QtGui import QBrush
+
+# Seconds to wait for the backend before giving up on a request
+REQUEST_TIMEOUT = 5
+
+# Books fetched from the backend per page as the table is scrolled
+PAGE_SIZE = 500
+
+# Seconds between checks whether the overdue marks changed with the date
+OVERDUE_CHECK_INTERVAL = 600
+
+# Table columns: (heading, index into a BookTableModel row tuple)
+COLUMNS = (
+    ("Name", 1),
+    ("Author", 2),
+    ("Publication Date", 3),
+    ("Category", 4),
+    ("Status", 5),
+    ("Borrower's Name", 6),
+)
+
+
+class RequestSignals(QObject):
+    """
+    Signals a RequestTask uses to hand its result back to the GUI thread.
+    finished carries the call's return value, failed the exception it raised.
+    skipped is emitted instead when the task was cancelled before it started.
+    """
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    skipped = pyqtSignal()
+
+
+class RequestTask(QRunnable):
+    """
+    One LibraryClient call, run on a QThreadPool worker thread so the Qt event
+    loop never waits on the network.
+    Setting cancelled makes a task that has not started yet skip the call; the
+    window also ignores the result of a cancelled task that was already running.
+    """
+    def __init__(self, call):
+        super().__init__()
+        self.call = call
+        self.cancelled = False
+        self.signals = RequestSignals()
+        # The window keeps a reference until the result arrives
+        self.setAutoDelete(False)
+
+    def run(self):
+        """
+        Make the call and emit finished or failed.
+        """
+        if self.cancelled:
+            self.signals.skipped.emit()
+            return
+        try:
+            result = self.call()
+        except Exception as e:
+            self.signals.failed.emit(e)
+            return
+        self.signals.finished.emit(result)
+
+
+class EventListener(QThread):
+    """
+    Follows the backend's GET /events stream on its own thread and emits every event
+    (a dict with 'event', 'id' and 'data') to the GUI thread. A lost stream is
+    reopened with a growing delay, until stop() is called.
+    """
+    received = pyqtSignal(dict)
+
+    def __init__(self, client, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.stream = None
+        self.stopping = threading.Event()
+
+    def run(self):
+        delay = 1
+        while not self.stopping.is_set():
+            try:
+                self.stream = self.client.events()
+                # stop() may have run while the stream was being opened
+                if self.stopping.is_set():
+                    self.stream.close()
+                    break
+                for event in self.stream:
+                    delay = 1
+                    self.received.emit(event)
+            except Exception:
+                pass
+            if not self.stopping.wait(delay):
+                delay = min(delay * 2, 30)
+
+    def stop(self):
+        """
+        End the stream and let the thread finish: a blocked read returns at once, and
+        only a connection attempt in progress (at most REQUEST_TIMEOUT) is waited for.
+        """
+        self.stopping.set()
+        if self.stream is not None:
+            self.stream.close()
+
+
+class BookTableModel(QAbstractTableModel):
+    """
+    Table model over the books loaded from the backend.
+    Each book is kept as one compact tuple (id, name, author, publication_date,
+    category, borrowed, borrower_name, due_date, overdue), and cell text and colours
+    are only produced when the view asks for them in data(), i.e. for the visible rows.
+    The overdue flag comes from the backend, which sends the ids of the overdue books
+    with every list and delta, so it follows the server's date rather than this machine's.
+    The catalogue is loaded a page at a time: the view calls fetchMore() as it is
+    scrolled to the end, which asks fetch_page(cursor) for the next page.
+    Changes are applied one row at a time so the view only repaints what changed.
+    """
+    def __init__(self, fetch_page, parent=None):
+        super().__init__(parent)
+        self.fetch_page = fetch_page
+        self.rows = []
+        self.rows_by_id = {}
+        self.next_cursor = None
+        self.fetching = False
+
+    @staticmethod
+    def make_row(book, overdue=False):
+        """
+        Return the row tuple of a book.
+        """
+        borrowed = bool(book.get('borrowed', False))
+        return (
+            book.get('id'),
+            book.get('name', ''),
+            book.get('author', ''),
+            book.get('publication_date', ''),
+            book.get('category', ''),
+            borrowed,
+            book.get('borrower_name', ''),
+            book.get('due_date', ''),
+            bool(overdue),
+        )
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return COLUMNS[section][0]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        """
+        Cell text, the book id (UserRole), and a red background for overdue books.
+        """
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            field = COLUMNS[index.column()][1]
+            if field == 5:
+                return "Borrowed" if row[5] else "Available"
+            return str(row[field])
+        if role == Qt.ItemDataRole.BackgroundRole and row[8]:
+            return QBrush(Qt.GlobalColor.red)
+        if role == Qt.ItemDataRole.UserRole:
+            return row[0]
+        return None
+
+    def book_id(self, row):
+        return self.rows[row][0]
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.next_cursor is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.fetching or self.next_cursor is None:
+            return
+        self.fetching = True
+        self.fetch_page(self.next_cursor)
+
+    def reset(self, books, next_cursor=None, overdue=None):
+        """
+        Replace all rows; next_cursor is where the following page starts (None if none)
+        and overdue the set of ids of the overdue books.
+        """
+        overdue = overdue or ()
+        self.beginResetModel()
+        self.rows = [self.make_row(book, book.get('id') in overdue) for book in books]
+        self.rows_by_id = {row[0]: i for i, row in enumerate(self.rows)}
+        self.next_cursor = next_cursor
+        self.fetching = False
+        self.endResetModel()
+
+    def append_page(self, books, next_cursor, overdue=None):
+        """
+        Append a page fetched by fetchMore(), skipping books that are already shown.
+        """
+        overdue = overdue or ()
+        self.fetching = False
+        self.next_cursor = next_cursor
+        new_rows = [self.make_row(book, book.get('id') in overdue)
+                    for book in books if book.get('id') not in self.rows_by_id]
+        if not new_rows:
+            return
+        first = len(self.rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_rows) - 1)
+        for i, row in enumerate(new_rows, first):
+            self.rows.append(row)
+            self.rows_by_id[row[0]] = i
+        self.endInsertRows()
+
+    def upsert(self, book, overdue=False, allow_insert=True):
+        """
+        Update the row of a changed book, or append it if it is new and allow_insert is set.
+        Books past the pages loaded so far are left for fetchMore() to bring in.
+        """
+        i = self.rows_by_id.get(book['id'])
+        if i is not None:
+            self.rows[i] = self.make_row(book, overdue)
+            self.dataChanged.emit(self.index(i, 0), self.index(i, len(COLUMNS) - 1))
+        elif allow_insert and self.next_cursor is None:
+            i = len(self.rows)
+            self.beginInsertRows(QModelIndex(), i, i)
+            self.rows.append(self.make_row(book, overdue))
+            self.rows_by_id[book['id']] = i
+            self.endInsertRows()
+
+    def remove(self, book_id):
+        """
+        Remove the row of a deleted book, if shown.
+        """
+        i = self.rows_by_id.get(book_id)
+        if i is None:
+            return
+        self.beginRemoveRows(QModelIndex(), i, i)
+        del self.rows[i]
+        self.endRemoveRows()
+        del self.rows_by_id[book_id]
+        for j in range(i, len(self.rows)):
+            self.rows_by_id[self.rows[j][0]] = j
+
+
+class BookFilterProxy(QSortFilterProxyModel):
+    """
+    Sorts the book table by the clicked column and filters it by category and
+    borrowed status locally, without asking the backend.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.category = None
+        self.borrowed = None
+
+    def set_filters(self, category=None, borrowed=None):
+        """
+        category: category name or None for all; borrowed: 'available', 'borrowed' or None.
+        """
+        self.category = category.lower() if category else None
+        self.borrowed = borrowed
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        row = self.sourceModel().rows[source_row]
+        if self.category and row[4].lower() != self.category:
+            return False
+        if self.borrowed == 'available' and row[5]:
+            return False
+        if self.borrowed == 'borrowed' and not row[5]:
+            return False
+        return True
 
 
 class AddBookDialog(QDialog):
@@ -87,10 +374,23 @@ class BorrowBookDialog(QDialog):
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, base_url="http://localhost:5000"):
         super().__init__()
         self.setWindowTitle("Online Library")
-        self.base_url = "http://localhost:5000"
+        self.base_url = base_url
+        self.client = LibraryClient(self.base_url, timeout=REQUEST_TIMEOUT)
+
+        # What the table currently shows: the search text (None for the catalogue list),
+        # the catalogue version it reflects and the list's ETag
+        self.view_search = None
+        self.version = None
+        self.list_etag = None
+
+        # Backend requests run on a thread pool; in_flight holds the latest task per
+        # kind ('list', 'suggest', ...) so a newer request supersedes an older one
+        self.pool = QThreadPool(self)
+        self.pending = set()
+        self.in_flight = {}
 
         central = QWidget()
         self.setCentralWidget(central)
@@ -99,7 +399,7 @@ class MainWindow(QMainWindow):
         # Search and filter layout
         search_layout = QHBoxLayout()
         self.search_edit = QLineEdit()
-        self.search_edit.setPlaceholderText("Search by name...")
+        self.search_edit.setPlaceholderText("Search by title, author or category...")
         self.search_btn = QPushButton("Search")
         self.category_combo = QComboBox()
         self.category_combo.addItem("All Categories")
@@ -120,11 +420,31 @@ class MainWindow(QMainWindow):
         search_layout.addWidget(self.borrowed_combo)
         search_layout.addWidget(self.refresh_btn)
 
-        # Table widget for displaying books
-        self.table_widget = QTableWidget()
-        self.table_widget.setColumnCount(6)
-        self.table_widget.setHorizontalHeaderLabels(["Name", "Author", "Publication Date", "Category", "Status", "Borrower's Name"])
-        self.table_widget.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        # Search-as-you-type: suggestions are fetched once typing pauses, and a request
+        # still in flight is superseded when a newer one is sent
+        self.suggest_model = QStringListModel()
+        self.completer = QCompleter(self.suggest_model, self)
+        self.completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.completer.setFilterMode(Qt.MatchFlag.MatchContains)
+        self.search_edit.setCompleter(self.completer)
+        self.suggest_timer = QTimer(self)
+        self.suggest_timer.setSingleShot(True)
+        self.suggest_timer.setInterval(200)
+
+        # Table view for displaying books: the model holds the loaded books and the
+        # proxy sorts (click a column header) and filters them locally
+        self.model = BookTableModel(self.fetch_page, self)
+        self.proxy = BookFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+        self.table_view = QTableView()
+        self.table_view.setModel(self.proxy)
+        # Start unsorted (catalogue order); clicking a header sorts by that column
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.table_view.setSortingEnabled(True)
+        self.table_view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table_view.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.table_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
 
         # Buttons panel
         btn_layout = QHBoxLayout()
@@ -138,11 +458,22 @@ class MainWindow(QMainWindow):
         btn_layout.addWidget(self.return_btn)
 
         layout.addLayout(search_layout)
-        layout.addWidget(self.table_widget)
+        layout.addWidget(self.table_view)
         layout.addLayout(btn_layout)
 
+        # Busy indicator shown in the status bar while requests are running
+        self.busy_bar = QProgressBar()
+        self.busy_bar.setRange(0, 0)
+        self.busy_bar.setMaximumWidth(120)
+        self.busy_bar.hide()
+        self.statusBar().addPermanentWidget(self.busy_bar)
+
         # Connect signals to slots
         self.search_btn.clicked.connect(self.search)
+        self.search_edit.returnPressed.connect(self.search)
+        self.search_edit.textEdited.connect(self.suggest_timer.start)
+        self.suggest_timer.timeout.connect(self.request_suggestions)
+        self.completer.activated.connect(lambda text: self.search())
         self.category_combo.currentTextChanged.connect(self.filter_books)
         self.borrowed_combo.currentTextChanged.connect(self.filter_books)
         self.refresh_btn.clicked.connect(self.load_books)
@@ -150,188 +481,351 @@ class MainWindow(QMainWindow):
         self.delete_btn.clicked.connect(self.delete_book)
         self.borrow_btn.clicked.connect(self.borrow_book)
         self.return_btn.clicked.connect(self.return_book)
-        self.table_widget.cellDoubleClicked.connect(self.show_metadata)
+        self.table_view.doubleClicked.connect(self.show_metadata)
+
+        # Changes pushed by the backend are applied shortly after they arrive; a burst
+        # of events is folded into one /books/changes request
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.setInterval(100)
+        self.sync_timer.timeout.connect(self.sync_changes)
+        # Books become overdue as days pass without any change to the catalogue. The list
+        # is revalidated now and then; its ETag includes the backend's date, so this
+        # costs a 304 until the day (or the catalogue) changes
+        self.overdue_timer = QTimer(self)
+        self.overdue_timer.setInterval(OVERDUE_CHECK_INTERVAL * 1000)
+        self.overdue_timer.timeout.connect(self.check_overdue)
+        self.overdue_timer.start()
+        self.events = EventListener(self.client, self)
+        self.events.received.connect(self.handle_event)
 
         # Load initial book list
         self.load_books()
+        self.events.start()
 
-    def populate_table(self, books):
-        """
-        Populate the QTableWidget with a list of book dictionaries.
-        Clears existing rows and sets new rows for each book.
-        Marks row red if borrowed and due_date is past today.
-        """
-        from datetime import datetime
-        self.table_widget.setRowCount(len(books))
-        today = datetime.now().strftime('%d.%m.%Y')
-        for i, book in enumerate(books):
-            self.table_widget.setItem(i, 0, QTableWidgetItem(book.get('name', '')))
-            self.table_widget.setItem(i, 1, QTableWidgetItem(book.get('author', '')))
-            self.table_widget.setItem(i, 2, QTableWidgetItem(book.get('publication_date', '')))
-            self.table_widget.setItem(i, 3, QTableWidgetItem(book.get('category', '')))
-            status = "Borrowed" if book.get('borrowed', False) else "Available"
-            self.table_widget.setItem(i, 4, QTableWidgetItem(status))
-            self.table_widget.setItem(i, 5, QTableWidgetItem(book.get('borrower_name', '')))
-
-            # Check if overdue
-            due_date = book.get('due_date', '')
-            is_overdue = book.get('borrowed', False) and due_date and due_date < today
-            if is_overdue:
-                for col in range(6):
-                    item = self.table_widget.item(i, col)
-                    if item:
-                        item.setBackground(Qt.GlobalColor.red)
+    def check_overdue(self):
+        """
+        Revalidate the catalogue list shown, so overdue marks follow the backend's date.
+        """
+        if self.view_search is None:
+            self.load_books()
+
+    def populate_table(self, books, overdue=None):
+        """
+        Show a complete list of book dictionaries in the table, replacing what is shown.
+        overdue is the set of ids of the overdue books.
+        """
+        self.model.reset(books, overdue=overdue)
+
+    def book_id_at(self, index):
+        """
+        Return the backend id of the book in the given (proxy) table index, or None.
+        """
+        if not index.isValid():
+            return None
+        return self.model.book_id(self.proxy.mapToSource(index).row())
+
+    def selected_book_id(self):
+        """
+        Return the id of the selected book, or None if no row is selected.
+        """
+        return self.book_id_at(self.table_view.currentIndex())
+
+    def send(self, call, on_result, key=None, quiet=False, on_failure=None):
+        """
+        Run call (a function making LibraryClient requests) without blocking the GUI.
+        on_result(result) is called on the GUI thread when it returns.
+        A call with the same key as one still in flight supersedes it: the older
+        one is cancelled and its result ignored. If the call fails, on_failure() is
+        called and, unless quiet is set, the backend's error message (or "Cannot
+        connect to backend." for connection errors and timeouts) is shown.
+        """
+        self.cancel(key)
+        task = RequestTask(call)
+        task.signals.finished.connect(lambda result: self.request_finished(task, key, on_result, result))
+        task.signals.failed.connect(lambda error: self.request_failed(task, key, quiet, on_failure, error))
+        task.signals.skipped.connect(lambda: self.end_request(task, key))
+        if key is not None:
+            self.in_flight[key] = task
+        self.pending.add(task)
+        self.update_busy()
+        self.pool.start(task)
+
+    def cancel(self, key):
+        """
+        Cancel the request in flight under key, if any.
+        """
+        if key is not None and key in self.in_flight:
+            self.in_flight.pop(key).cancelled = True
+
+    def request_finished(self, task, key, on_result, result):
+        self.end_request(task, key)
+        if not task.cancelled:
+            on_result(result)
+
+    def request_failed(self, task, key, quiet, on_failure, error):
+        self.end_request(task, key)
+        if task.cancelled:
+            return
+        if on_failure is not None:
+            on_failure()
+        if not quiet:
+            message = error.message if isinstance(error, LibraryError) else "Cannot connect to backend."
+            QMessageBox.warning(self, "Error", message)
+
+    def end_request(self, task, key):
+        """
+        Forget a completed request and update the busy indicator.
+        """
+        self.pending.discard(task)
+        if key is not None and self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        self.update_busy()
+
+    def update_busy(self):
+        """
+        Show the busy indicator while any request is running.
+        """
+        if self.pending:
+            self.busy_bar.show()
+            self.statusBar().showMessage("Working...")
+        else:
+            self.busy_bar.hide()
+            self.statusBar().clearMessage()
+
+    def closeEvent(self, event):
+        """
+        Cancel queued requests when the window closes instead of waiting for them.
+        Requests already running are waited for (at most REQUEST_TIMEOUT each), as their
+        tasks emit to signal objects that must outlive them.
+        """
+        for task in self.pending:
+            task.cancelled = True
+        self.pool.clear()
+        self.pool.waitForDone()
+        # The thread must have ended before the window (its parent) is destroyed
+        self.events.stop()
+        self.events.wait()
+        self.client.close()
+        super().closeEvent(event)
 
     def load_books(self):
         """
-        Load all books from backend and display in the table.
+        Load the first page of the catalogue from the backend and show it; further
+        pages are fetched as the table is scrolled. Reloading the list already shown
+        sends its ETag, so an unchanged catalogue costs a 304 instead of a download.
         """
-        try:
-            response = requests.get(f"{self.base_url}/books")
-            if response.status_code == 200:
-                books = response.json()
-                self.populate_table(books)
-        except requests.exceptions.RequestException:
-            QMessageBox.warning(self, "Error", "Cannot connect to backend.")
+        etag = self.list_etag if self.view_search is None else None
+        self.cancel('page')
+
+        def on_result(listing):
+            if listing is None:
+                return  # not modified
+            self.view_search = None
+            self.remember_version(listing)
+            self.model.reset(listing.books, listing.next_cursor, listing.overdue)
+
+        self.send(lambda: self.client.list_books(limit=PAGE_SIZE, etag=etag), on_result, key='list')
+
+    def fetch_page(self, cursor):
+        """
+        Fetch the page of the catalogue starting at cursor for the model's fetchMore().
+        """
+        def on_result(listing):
+            self.model.append_page(listing.books, listing.next_cursor, listing.overdue)
+
+        def on_failure():
+            self.model.fetching = False
+
+        self.send(lambda: self.client.list_books(limit=PAGE_SIZE, cursor=cursor), on_result,
+                  key='page', on_failure=on_failure)
+
+    def remember_version(self, listing):
+        """
+        Record the catalogue version and ETag of the listing being shown.
+        """
+        self.version = listing.version
+        self.list_etag = listing.etag
+
+    def reload_view(self):
+        """
+        Fetch the list currently shown again from scratch.
+        """
+        self.list_etag = None
+        if self.view_search is not None:
+            self.search()
+        else:
+            self.load_books()
+
+    def sync_changes(self):
+        """
+        Bring the table up to date by applying only the books changed since the
+        version it shows, instead of downloading the whole list again.
+        """
+        if self.version is None:
+            self.reload_view()
+            return
+
+        def on_result(delta):
+            if delta.get('reset'):
+                self.reload_view()
+            else:
+                self.apply_changes(delta)
+
+        since = self.version
+        self.send(lambda: self.client.changes(since), on_result, key='sync')
+
+    def handle_event(self, event):
+        """
+        React to a change event from the backend: fetch the changes if the event is
+        newer than the version shown, or reload everything after a 'reset'.
+        """
+        if event['event'] == 'reset':
+            self.reload_view()
+        elif self.version is not None and event['data'].get('version', 0) > self.version:
+            self.sync_timer.start()
+
+    def apply_changes(self, delta):
+        """
+        Patch the model row by row with a delta from /books/changes. The proxy then
+        re-filters and re-sorts just those rows. Search results only get existing
+        rows updated, never new books appended.
+        """
+        for book_id in delta.get('deleted', []):
+            self.model.remove(book_id)
+        overdue = set(delta.get('overdue', ()))
+        for book in delta.get('upserted', []):
+            self.model.upsert(book, book['id'] in overdue, allow_insert=self.view_search is None)
+        self.version = delta['version']
+        self.list_etag = None
 
     def search(self):
         """
-        Search books by exact name and display results in the table.
+        Full-text search over name, author and category; results are shown best match first.
+        An empty search box shows all books again.
         """
-        name = self.search_edit.text().strip()
-        if name:
-            try:
-                response = requests.get(f"{self.base_url}/books", params={'name': name})
-                if response.status_code == 200:
-                    books = response.json()
-                    self.populate_table(books)
-            except requests.exceptions.RequestException:
-                QMessageBox.warning(self, "Error", "Cannot connect to backend.")
+        query = self.search_edit.text().strip()
+        if not query:
+            self.load_books()
+            return
+        self.cancel('page')
+
+        def on_result(listing):
+            self.view_search = query
+            self.remember_version(listing)
+            self.model.reset(listing.books, overdue=listing.overdue)
+            # Show results in relevance order until a column header is clicked
+            self.table_view.sortByColumn(-1, Qt.SortOrder.AscendingOrder)
+
+        self.send(lambda: self.client.search(query), on_result, key='list')
+
+    def request_suggestions(self):
+        """
+        Ask the backend for title/author suggestions for the text typed so far.
+        Any previous suggestion request that has not finished yet is superseded.
+        """
+        prefix = self.search_edit.text().strip()
+        if len(prefix) < 2:
+            self.cancel('suggest')
+            return
+        self.send(lambda: self.client.suggest(prefix, 10), self.show_suggestions, key='suggest', quiet=True)
+
+    def show_suggestions(self, suggestions):
+        """
+        Show the suggestions from a finished request.
+        """
+        self.suggest_model.setStringList([s['text'] for s in suggestions])
+        self.completer.complete()
 
     def filter_books(self):
         """
-        Filter books based on category and borrowed status dropdown selections.
-        Fetches filtered books from backend and updates the table.
+        Filter the table by the category and borrowed status dropdown selections.
+        This happens locally in the proxy model, without a request to the backend.
         """
         category = self.category_combo.currentText()
         borrowed = self.borrowed_combo.currentText()
-        params = {}
-        if category != "All Categories":
-            params['category'] = category
-        if borrowed != "All":
-            params['borrowed'] = borrowed.lower()
-        try:
-            response = requests.get(f"{self.base_url}/books", params=params)
-            if response.status_code == 200:
-                books = response.json()
-                self.populate_table(books)
-        except requests.exceptions.RequestException:
-            QMessageBox.warning(self, "Error", "Cannot connect to backend.")
+        self.proxy.set_filters(
+            category if category != "All Categories" else None,
+            borrowed.lower() if borrowed != "All" else None,
+        )
+
+    def change(self, call):
+        """
+        Run a mutating client call; on success apply the changes to the table,
+        on failure the backend's error is shown.
+        """
+        self.send(call, lambda result: self.sync_changes())
 
     def add_book(self):
         """
         Show dialog to add a new book.
-        On success, reload the book list.
+        On success, apply the changes to the table.
         """
         dialog = AddBookDialog()
         if dialog.exec():
-            data = {
-                'name': dialog.name_edit.text(),
-                'publication_date': dialog.date_edit.text(),
-                'author': dialog.author_edit.text(),
-                'category': dialog.category_edit.text()
-            }
-            try:
-                response = requests.post(f"{self.base_url}/books", json=data)
-                if response.status_code == 201:
-                    self.load_books()
-                else:
-                    QMessageBox.warning(self, "Error", response.json().get('error', 'Failed to add book'))
-            except requests.exceptions.RequestException:
-                QMessageBox.warning(self, "Error", "Cannot connect to backend.")
+            name = dialog.name_edit.text()
+            publication_date = dialog.date_edit.text()
+            author = dialog.author_edit.text()
+            category = dialog.category_edit.text()
+            self.change(lambda: self.client.add_book(name, publication_date, author, category))
 
     def delete_book(self):
         """
-        Delete the selected book from the backend and reload table.
+        Delete the selected book from the backend and update the table.
         """
-        current_row = self.table_widget.currentRow()
-        if current_row >= 0:
-            book_id = current_row
-            try:
-                response = requests.delete(f"{self.base_url}/books/{book_id}")
-                if response.status_code == 200:
-                    self.load_books()
-                else:
-                    QMessageBox.warning(self, "Error", response.json().get('error', 'Failed to delete book'))
-            except requests.exceptions.RequestException:
-                QMessageBox.warning(self, "Error", "Cannot connect to backend.")
+        book_id = self.selected_book_id()
+        if book_id is not None:
+            self.change(lambda: self.client.delete_book(book_id))
 
     def borrow_book(self):
         """
         Show dialog to borrow the selected book with borrower name and due date input.
-        On success, reload the book list.
+        On success, apply the changes to the table.
         """
-        current_row = self.table_widget.currentRow()
-        if current_row >= 0:
-            book_id = current_row
+        book_id = self.selected_book_id()
+        if book_id is not None:
             dialog = BorrowBookDialog()
             if dialog.exec():
                 borrower_name = dialog.borrower_name_edit.text().strip()
                 due_date = dialog.due_date_edit.text().strip()
                 if borrower_name and due_date:
-                    data = {'borrower_name': borrower_name, 'due_date': due_date}
-                    try:
-                        response = requests.post(f"{self.base_url}/books/{book_id}/borrow", json=data)
-                        if response.status_code == 200:
-                            self.load_books()
-                        else:
-                            QMessageBox.warning(self, "Error", response.json().get('error', 'Failed to borrow book'))
-                    except requests.exceptions.RequestException:
-                        QMessageBox.warning(self, "Error", "Cannot connect to backend.")
+                    self.change(lambda: self.client.borrow_book(book_id, borrower_name, due_date))
                 else:
                     QMessageBox.warning(self, "Error", "Borrower name and due date are required.")
 
     def return_book(self):
         """
-        Return the selected book via backend and reload table.
+        Return the selected book via backend and update the table.
         """
-        current_row = self.table_widget.currentRow()
-        if current_row >= 0:
-            book_id = current_row
-            try:
-                response = requests.post(f"{self.base_url}/books/{book_id}/return")
-                if response.status_code == 200:
-                    self.load_books()
-                else:
-                    QMessageBox.warning(self, "Error", response.json().get('error', 'Failed to return book'))
-            except requests.exceptions.RequestException:
-                QMessageBox.warning(self, "Error", "Cannot connect to backend.")
+        book_id = self.selected_book_id()
+        if book_id is not None:
+            self.change(lambda: self.client.return_book(book_id))
 
-    def show_metadata(self, row, column):
+    def show_metadata(self, index):
         """
         Show a message box displaying details of the double-clicked book row.
         """
-        book_id = row
-        try:
-            response = requests.get(f"{self.base_url}/books/{book_id}")
-            if response.status_code == 200:
-                book = response.json()
-                msg = (
-                    f"Name: {book.get('name','')}\n"
-                    f"Author: {book.get('author','')}\n"
-                    f"Publication Date: {book.get('publication_date','')}\n"
-                    f"Category: {book.get('category','')}\n"
-                    f"Borrowed: {book.get('borrowed', False)}"
-                )
-                if book.get('borrower_name'):
-                    msg += f"\nBorrower's Name: {book.get('borrower_name')}"
-                if book.get('borrow_date'):
-                    msg += f"\nBorrow Date: {book.get('borrow_date')}"
-                if book.get('due_date'):
-                    msg += f"\nDue Date: {book.get('due_date')}"
-                QMessageBox.information(self, "Book Metadata", msg)
-        except requests.exceptions.RequestException:
-            QMessageBox.warning(self, "Error", "Cannot connect to backend.")
+        book_id = self.book_id_at(index)
+        if book_id is None:
+            return
+
+        def on_result(book):
+            msg = (
+                f"Name: {book.get('name','')}\n"
+                f"Author: {book.get('author','')}\n"
+                f"Publication Date: {book.get('publication_date','')}\n"
+                f"Category: {book.get('category','')}\n"
+                f"Borrowed: {book.get('borrowed', False)}"
+            )
+            if book.get('borrower_name'):
+                msg += f"\nBorrower's Name: {book.get('borrower_name')}"
+            if book.get('borrow_date'):
+                msg += f"\nBorrow Date: {book.get('borrow_date')}"
+            if book.get('due_date'):
+                msg += f"\nDue Date: {book.get('due_date')}"
+            QMessageBox.information(self, "Book Metadata", msg)
+
+        self.send(lambda: self.client.get_book(book_id), on_result, key='metadata')
 
 
 if __name__ == "__main__":
@@ -1,45 +1,198 @@
+import argparse
+import json
 import multiprocessing
+import signal
+import socket
 import time
 import sys
-from flask import Flask
-from PyQt6.QtWidgets import QApplication
+import urllib.error
+import urllib.request
 
-# Import the Flask app instance from backend.py
-from backend import app as flask_app
 
-# Import the main GUI window from gui.py
-from gui import MainWindow
+def stop_server(signum, frame):
+    """
+    SIGTERM handler for server processes: waitress treats SystemExit as a request to
+    stop accepting connections and finish the requests already running.
+    """
+    raise SystemExit(0)
 
-def run_server():
+
+def run_server(host='127.0.0.1', port=5000, threads=8, backlog=1024, sock=None):
     """
-    Run the Flask server.
-    This function starts the Flask app with debug mode enabled, disables the
-    reloader to avoid double server start, and listens on all available IP addresses on port 5000.
+    Run the Flask app under the waitress production WSGI server until SIGTERM or Ctrl+C.
+    waitress serves requests from a pool of threads; the store behind the app is locked,
+    so concurrent requests are safe. When sock is given, the server accepts connections
+    on that already listening socket (shared by several worker processes) instead of
+    binding host and port itself. On shutdown in-flight requests are allowed to
+    finish and the storage engine is closed.
     """
-    flask_app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000)
+    from waitress import create_server
+    from backend import app, events, max_event_subscribers, store
 
-if __name__ == '__main__':
-    # Start the Flask server in a separate process using multiprocessing.
-    # This allows the Flask server to run concurrently alongside the PyQt GUI,
-    # so both can operate without blocking each other.
-    server_process = multiprocessing.Process(target=run_server)
-    server_process.start()
+    # Event streams hold a request thread each, so their cap follows the thread count
+    events.max_subscribers = max_event_subscribers(threads)
+    signal.signal(signal.SIGTERM, stop_server)
+    if sock is not None:
+        server = create_server(app, sockets=[sock], threads=threads)
+    else:
+        server = create_server(app, host=host, port=port, threads=threads, backlog=backlog)
+    try:
+        server.run()
+    finally:
+        store.storage.close()
+
+
+def start_server(args):
+    """
+    Start args.workers server processes and return them.
+    With more than one worker the listening socket is created here, before forking,
+    so that all workers accept connections from the same socket.
+    """
+    if args.workers == 1:
+        process = multiprocessing.Process(
+            target=run_server, args=(args.host, args.port, args.threads, args.backlog))
+        process.start()
+        return [process]
 
-    # Wait for 2 seconds to allow the Flask server to initialize before starting the GUI.
-    time.sleep(2) 
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        sys.exit("--workers greater than 1 needs a platform that supports fork")
+    sock = socket.create_server((args.host, args.port), backlog=args.backlog)
+    context = multiprocessing.get_context('fork')
+    processes = []
+    for _ in range(args.workers):
+        process = context.Process(target=run_server, kwargs={'threads': args.threads, 'sock': sock})
+        process.start()
+        processes.append(process)
+    sock.close()
+    return processes
+
+
+def stop_processes(processes, timeout=10):
+    """
+    Ask the server processes to shut down gracefully, killing any that do not
+    finish within timeout seconds.
+    """
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+
+def wait_until_ready(url, processes, timeout=10.0):
+    """
+    Poll GET url (the backend's /readyz) until it answers 200, starting with short
+    waits and backing off to at most 0.25 seconds between attempts.
+    Returns the decoded readiness report. Raises RuntimeError if a server process
+    exits or the backend is not ready within timeout seconds.
+    """
+    # The backend is local, so never go through a proxy configured in the environment
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    while True:
+        try:
+            with opener.open(url, timeout=1) as response:
+                return json.loads(response.read())
+        except (urllib.error.URLError, OSError):
+            # Not listening yet (connection refused) or not ready yet (503)
+            pass
+        for process in processes:
+            if not process.is_alive():
+                raise RuntimeError(f"Backend process exited with code {process.exitcode}")
+        if time.monotonic() + delay > deadline:
+            raise RuntimeError(f"Backend was not ready at {url} within {timeout:g} seconds")
+        time.sleep(delay)
+        delay = min(delay * 1.5, 0.25)
+
+
+def serve(args):
+    """
+    Headless mode: run only the backend until SIGTERM or Ctrl+C. PyQt is never imported.
+    """
+    if args.workers == 1:
+        run_server(args.host, args.port, args.threads, args.backlog)
+        return
+    processes = start_server(args)
+    signal.signal(signal.SIGTERM, stop_server)
+    try:
+        for process in processes:
+            process.join()
+    except (SystemExit, KeyboardInterrupt):
+        pass
+    finally:
+        stop_processes(processes)
+
+
+def run_gui(args):
+    """
+    Start the backend in separate processes and run the GUI against it.
+    When the GUI is closed the backend is shut down gracefully.
+    """
+    # Start the backend in separate processes, so the server and the PyQt GUI
+    # can operate without blocking each other.
+    processes = start_server(args)
+
+    # Import the GUI while the backend loads the catalogue; the server processes
+    # were started first so that they never import PyQt
+    from PyQt6.QtWidgets import QApplication
+    from gui import MainWindow
+
+    # Start the GUI as soon as the backend reports it is ready
+    host = '127.0.0.1' if args.host in ('0.0.0.0', '') else args.host
+    base_url = f"http://{host}:{args.port}"
+    try:
+        wait_until_ready(f"{base_url}/readyz", processes, args.ready_timeout)
+    except RuntimeError as e:
+        stop_processes(processes)
+        sys.exit(f"Cannot start the GUI: {e}")
 
     # Create the PyQt application instance
     qt_app = QApplication(sys.argv)
 
     # Create and show the main window from the GUI module
-    window = MainWindow()
+    window = MainWindow(base_url)
     window.show()
 
     # Start the Qt event loop; this call blocks until the GUI is closed by the user.
     exit_code = qt_app.exec()
 
-    # When the GUI exits, terminate the Flask server process to clean up
-    server_process.terminate()
+    # When the GUI exits, let the server finish its requests and stop
+    stop_processes(processes)
 
     # Exit the program with the Qt application's exit code
     sys.exit(exit_code)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Online Library: backend server and desktop GUI.")
+    parser.add_argument('--serve', action='store_true',
+                        help="run only the backend server (headless, no GUI)")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on (default 127.0.0.1; 0.0.0.0 for all interfaces)")
+    parser.add_argument('--port', type=int, default=5000, help="port to listen on (default 5000)")
+    parser.add_argument('--threads', type=int, default=8,
+                        help="request threads per server process (default 8); a quarter of them, "
+                             "at least one, can serve GET /events streams (LIBRARY_MAX_SUBSCRIBERS overrides this)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="server processes sharing the port (default 1)")
+    parser.add_argument('--backlog', type=int, default=1024,
+                        help="pending connections the socket queues (default 1024)")
+    parser.add_argument('--ready-timeout', type=float, default=10,
+                        help="seconds the GUI waits for the backend to become ready (default 10)")
+    args = parser.parse_args(argv)
+    if args.threads < 1 or args.workers < 1 or args.backlog < 1:
+        parser.error("--threads, --workers and --backlog must be at least 1")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        run_gui(args)
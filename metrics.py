@@ -0,0 +1,174 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds of the latency buckets, in seconds, and of the payload size buckets, in bytes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# What metrics.stage() returns while metrics are disabled
+_NO_STAGE = nullcontext()
+
+
+def _labels(names, values):
+    """
+    Format label names and values as '{name="value",...}', escaped for the Prometheus text format.
+    """
+    if not names:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic count per label values.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, values=(), amount=1):
+        self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self):
+        for values, value in sorted(self._values.items()):
+            yield f'{self.name}{_labels(self.labels, values)} {_number(value)}'
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down per label values.
+    """
+    kind = 'gauge'
+
+
+class Histogram:
+    """
+    Observations per label values, counted into cumulative buckets with their sum and count.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+
+    def observe(self, values, value):
+        entry = self._values.get(values)
+        if entry is None:
+            # Per bucket counts (the last one is +Inf), then the sum
+            entry = self._values[values] = [0] * (len(self.buckets) + 1) + [0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def samples(self):
+        names = self.labels + ('le',)
+        for values, entry in sorted(self._values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), entry):
+                total += count
+                yield f'{self.name}_bucket{_labels(names, values + (bound,))} {total}'
+            yield f'{self.name}_sum{_labels(self.labels, values)} {_number(entry[-1])}'
+            yield f'{self.name}_count{_labels(self.labels, values)} {total}'
+
+
+class Metrics:
+    """
+    Request and stage metrics of the backend, rendered in the Prometheus text format.
+    Disabled until enable() is called: while disabled stage() returns a shared no-op
+    context manager and nothing is recorded, so the instrumentation costs next to nothing.
+    Requests are labelled by route pattern (e.g. /books/<int:book_id>), not by URL, so
+    the number of series stays bounded.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.requests = Counter('library_http_requests_total',
+                                'Requests handled, by route, method and status.', ('route', 'method', 'status'))
+        self.latency = Histogram('library_http_request_duration_seconds',
+                                 'Time to produce a response, by route and method.', ('route', 'method'))
+        self.in_flight = Gauge('library_http_requests_in_flight',
+                               'Requests being handled, by route.', ('route',))
+        self.response_size = Histogram('library_http_response_size_bytes',
+                                       'Size of response bodies of known length, by route.', ('route',),
+                                       SIZE_BUCKETS)
+        self.request_size = Histogram('library_http_request_size_bytes',
+                                      'Size of request bodies, by route.', ('route',), SIZE_BUCKETS)
+        self.stages = Histogram('library_stage_duration_seconds',
+                                'Time spent in the storage, filter, serialize and render stages.', ('stage',))
+        self._metrics = [self.requests, self.latency, self.in_flight,
+                         self.response_size, self.request_size, self.stages]
+
+    def enable(self):
+        self.enabled = True
+
+    def stage(self, name):
+        """
+        Context manager that times the block as stage name.
+        """
+        if not self.enabled:
+            return _NO_STAGE
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.stages.observe((name,), elapsed)
+
+    def request_started(self, route, size):
+        with self._lock:
+            self.in_flight.inc((route,))
+            if size:
+                self.request_size.observe((route,), size)
+
+    def request_finished(self, route, method, status, seconds, size):
+        """
+        Record a response; size is None for streamed bodies of unknown length.
+        """
+        with self._lock:
+            self.requests.inc((route, method, str(status)))
+            self.latency.observe((route, method), seconds)
+            if size is not None:
+                self.response_size.observe((route,), size)
+
+    def request_ended(self, route):
+        with self._lock:
+            self.in_flight.inc((route,), -1)
+
+    def render(self, extra=()):
+        """
+        Return all metrics, followed by the extra (name, kind, help, value) gauges and
+        counters, in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for metric in self._metrics:
+                lines.append(f'# HELP {metric.name} {metric.help}')
+                lines.append(f'# TYPE {metric.name} {metric.kind}')
+                lines.extend(metric.samples())
+        for name, kind, help, value in extra:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by the backend and the store; the backend enables it when LIBRARY_METRICS is set
+metrics = Metrics()
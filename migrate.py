@@ -0,0 +1,27 @@
+import argparse
+from storage import JournalStorage, open_storage
+
+
+def migrate(source, target, engine='sqlite'):
+    """
+    Copy every book from the JSON data file source (plus its journal, if any) into a
+    new storage engine at target, keeping the books' ids.
+    Returns the number of books copied.
+    """
+    books, next_id = JournalStorage(source).load()
+    storage = open_storage(engine, target)
+    try:
+        storage.replace_all(books.values(), next_id)
+    finally:
+        storage.close()
+    return len(books)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Copy the books in data.db into another storage engine.")
+    parser.add_argument('source', nargs='?', default='data.db', help="JSON data file to read (default: data.db)")
+    parser.add_argument('target', nargs='?', default='library.sqlite', help="file to write (default: library.sqlite)")
+    parser.add_argument('--engine', default='sqlite', choices=('sqlite', 'snapshot', 'journal', 'json'))
+    args = parser.parse_args()
+    count = migrate(args.source, args.target, args.engine)
+    print(f"Migrated {count} books from {args.source} to {args.target} ({args.engine})")
@@ -0,0 +1,200 @@
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from collections import deque
+
+# File formats a capture can be written in
+PROFILE_FORMATS = ('prof', 'collapsed')
+
+# Deepest call stack written to a collapsed-stack file
+MAX_STACK_DEPTH = 64
+
+# How many of the slow requests that could not be profiled are listed
+MISSED_KEEP = 20
+
+
+def _frame_name(func):
+    filename, line, name = func
+    if filename == '~':
+        # Built-in functions have no file
+        return name.replace(';', ':')
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(';', ':')
+
+
+def collapsed_stacks(stats):
+    """
+    Turn cProfile stats into collapsed-stack lines ('outer;inner;leaf microseconds'), the
+    input of flamegraph.pl and speedscope. cProfile only records caller/callee pairs, so
+    the time of a function called from several places is split between its call paths in
+    proportion to the time each caller spent in it.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, {})[func] = edge[3]
+    roots = [func for func, entry in stats.items() if not any(caller in stats for caller in entry[4])]
+
+    totals = {}
+
+    def walk(func, stack, cumulative):
+        total_time = stats[func][3]
+        share = cumulative / total_time if total_time else 0
+        stack = stack + [_frame_name(func)]
+        self_time = stats[func][2] * share
+        path = ';'.join(stack)
+        totals[path] = totals.get(path, 0) + self_time
+        if len(stack) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge_time in callees.get(func, {}).items():
+            # Recursion is cut off at the first repeat, its time stays with the outer call;
+            # paths under a microsecond are dropped, which also bounds the walk
+            if callee in stats and edge_time * share >= 1e-6 and _frame_name(callee) not in stack:
+                walk(callee, stack, edge_time * share)
+
+    for root in roots:
+        walk(root, [], stats[root][3])
+    return [f"{path} {round(seconds * 1e6)}" for path, seconds in totals.items() if round(seconds * 1e6) > 0]
+
+
+class Capture:
+    """
+    One request being timed by RequestProfiler, with its cProfile profile if it got one.
+    """
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.profile = None
+        self.started = time.perf_counter()
+
+
+class RequestProfiler:
+    """
+    Profiles a sampled fraction of requests with cProfile, and keeps the profiles of
+    requests slower than a threshold. Every capture is written to directory as a .prof
+    file (for pstats/snakeviz) or as collapsed stacks (.txt, for flamegraph tools),
+    next to a .json file with its route, method, query string and duration. Only the
+    newest keep captures are kept.
+    Catching slow requests means profiling every request, since whether a request is
+    slow is only known at its end, so slow_ms costs more than a small sample_rate.
+    cProfile can only profile one request at a time, so requests arriving meanwhile
+    are only timed; the slow ones among them are counted and the latest MISSED_KEEP
+    listed by missed() (per server process).
+    """
+    def __init__(self, directory, sample_rate=0.0, slow_ms=None, keep=100, fmt='prof'):
+        if fmt not in PROFILE_FORMATS:
+            raise ValueError(f"Unknown profile format: {fmt}")
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.keep = keep
+        self.fmt = fmt
+        self._busy = threading.Lock()
+        self._files_lock = threading.Lock()
+        self._missed_lock = threading.Lock()
+        self._missed_count = 0
+        self._missed = deque(maxlen=MISSED_KEEP)
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.slow_ms is not None
+
+    def start(self):
+        """
+        Start timing the current request if it is sampled (or slow requests are caught),
+        and profile it unless another request is being profiled. Returns the running
+        capture, to be passed to finish(), or None.
+        """
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not (sampled or self.slow_ms is not None):
+            return None
+        capture = Capture(sampled)
+        if self._busy.acquire(blocking=False):
+            capture.profile = cProfile.Profile()
+            capture.profile.enable()
+        return capture
+
+    def finish(self, capture, route, method, query):
+        """
+        Stop a capture from start() and save its profile if the request was sampled or
+        slow. A slow request that could not be profiled is recorded as missed.
+        Returns the name of the saved capture, or None.
+        """
+        profile = capture.profile
+        if profile is not None:
+            profile.disable()
+            self._busy.release()
+        duration_ms = (time.perf_counter() - capture.started) * 1000
+        slow = self.slow_ms is not None and duration_ms >= self.slow_ms
+        if profile is None:
+            if slow:
+                with self._missed_lock:
+                    self._missed_count += 1
+                    self._missed.append({'route': route, 'method': method, 'query': query,
+                                         'duration_ms': round(duration_ms, 3), 'time': round(time.time(), 3)})
+            return None
+        if not (capture.sampled or slow):
+            return None
+        return self._save(profile, route, method, query, duration_ms)
+
+    def missed(self):
+        """
+        Return {'count', 'recent'}: how many slow requests this process could not profile
+        because another request was being profiled, and the latest of them.
+        """
+        with self._missed_lock:
+            return {'count': self._missed_count, 'recent': list(self._missed)}
+
+    def _save(self, profile, route, method, query, duration_ms):
+        os.makedirs(self.directory, exist_ok=True)
+        # Names start with the time, so they sort oldest first
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        name = f"{time.time_ns() // 1000:016d}-{os.getpid()}-{method}-{slug}-{round(duration_ms)}ms"
+        path = os.path.join(self.directory, name)
+        if self.fmt == 'prof':
+            profile.dump_stats(path + '.prof')
+        else:
+            lines = collapsed_stacks(pstats.Stats(profile).stats)
+            with open(path + '.txt', 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+        with open(path + '.json', 'w') as f:
+            json.dump({'name': name, 'file': f"{name}.{'prof' if self.fmt == 'prof' else 'txt'}",
+                       'route': route, 'method': method, 'query': query,
+                       'duration_ms': round(duration_ms, 3), 'time': round(time.time(), 3)}, f)
+        self._rotate()
+        return name
+
+    def _rotate(self):
+        # The directory may be shared by several server processes, so it is listed each time
+        with self._files_lock:
+            names = sorted(entry[:-5] for entry in os.listdir(self.directory) if entry.endswith('.json'))
+            for name in names[:max(len(names) - self.keep, 0)]:
+                for ext in ('.json', '.prof', '.txt'):
+                    try:
+                        os.remove(os.path.join(self.directory, name + ext))
+                    except FileNotFoundError:
+                        pass
+
+    def captures(self, limit=None):
+        """
+        Return the metadata of the saved captures, slowest first.
+        """
+        captures = []
+        try:
+            entries = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        for entry in entries:
+            if not entry.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, entry)) as f:
+                    captures.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed or still being written by another process
+                continue
+        captures.sort(key=lambda capture: capture['duration_ms'], reverse=True)
+        return captures[:limit] if limit else captures
@@ -0,0 +1,262 @@
+import bisect
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Book fields that are searchable
+SEARCH_FIELDS = ('name', 'author', 'category')
+
+# Book fields offered as search-as-you-type suggestions
+SUGGEST_FIELDS = ('name', 'author')
+
+
+def tokenize(text):
+    """
+    Split text into lower-cased word tokens.
+    """
+    return TOKEN_RE.findall(str(text).lower())
+
+
+class SearchIndex:
+    """
+    Inverted index over the tokens of each book's name, author and category.
+    Postings map a token to {book id: term frequency}. Books are added and removed
+    one at a time as the catalogue changes, and queries are ranked with BM25,
+    so only the postings of the query terms are ever visited.
+    """
+    def __init__(self, k1=1.2, b=0.75, common_term_ratio=0.05):
+        self.k1 = k1
+        self.b = b
+        self.common_term_ratio = common_term_ratio
+        self._postings = defaultdict(dict)
+        # token -> {(term frequency, book length): ascending ids}: the postings grouped
+        # by their BM25 weight, which only depends on these two numbers. Built for a
+        # token the first time a search walks it, then kept up to date
+        self._impacts = {}
+        self._doc_terms = {}
+        self._lengths = {}
+        self._total_length = 0
+
+    def add(self, book):
+        """
+        Index one book. The book must not already be in the index.
+        """
+        terms = defaultdict(int)
+        for field in SEARCH_FIELDS:
+            for token in tokenize(book.get(field, '')):
+                terms[token] += 1
+        book_id = book['id']
+        length = sum(terms.values())
+        for token, tf in terms.items():
+            self._postings[token][book_id] = tf
+            if token in self._impacts:
+                bisect.insort(self._impacts[token].setdefault((tf, length), []), book_id)
+        self._doc_terms[book_id] = terms
+        self._lengths[book_id] = length
+        self._total_length += length
+
+    def remove(self, book_id):
+        """
+        Remove one book from the index, if present.
+        """
+        terms = self._doc_terms.pop(book_id, None)
+        if terms is None:
+            return
+        length = self._lengths.pop(book_id)
+        for token, tf in terms.items():
+            postings = self._postings[token]
+            postings.pop(book_id, None)
+            if not postings:
+                del self._postings[token]
+                self._impacts.pop(token, None)
+                continue
+            groups = self._impacts.get(token)
+            if groups is None:
+                continue
+            ids = groups[(tf, length)]
+            i = bisect.bisect_left(ids, book_id)
+            if i < len(ids) and ids[i] == book_id:
+                del ids[i]
+            if not ids:
+                del groups[(tf, length)]
+        self._total_length -= length
+
+    def _groups(self, token):
+        """
+        Return the postings of token grouped by (term frequency, book length).
+        """
+        groups = self._impacts.get(token)
+        if groups is None:
+            groups = defaultdict(list)
+            for book_id, tf in self._postings[token].items():
+                groups[(tf, self._lengths[book_id])].append(book_id)
+            for ids in groups.values():
+                ids.sort()
+            groups = self._impacts[token] = dict(groups)
+        return groups
+
+    def _weight(self, idf, tf, length, avg_length):
+        """
+        BM25 weight of a term occurring tf times in a book of the given length.
+        """
+        norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+        return idf * tf * (self.k1 + 1) / (tf + norm)
+
+    def search(self, query, limit=None):
+        """
+        Return (book id, score) pairs for the books matching any term of the query,
+        best match first. A book matching more (and rarer) terms ranks higher.
+        Terms found in more than common_term_ratio of all books only rank the
+        matches of rarer terms, unless the query has no rarer matching terms.
+        """
+        n = len(self._doc_terms)
+        if not n:
+            return []
+        avg_length = self._total_length / n
+        # Rarest terms first: once they have found candidates, a very common term
+        # (e.g. a category name) only adds to their scores instead of pulling in
+        # every book it appears in
+        terms = []
+        for token in sorted((token for token in set(tokenize(query)) if token in self._postings),
+                            key=lambda token: len(self._postings[token])):
+            df = len(self._postings[token])
+            terms.append((token, math.log(1 + (n - df + 0.5) / (df + 0.5))))
+        rare = [token for token, _ in terms if len(self._postings[token]) <= n * self.common_term_ratio]
+        candidate_terms = rare or [token for token, _ in terms[:1]]
+        if limit is not None and len(candidate_terms) == 1:
+            return self._top(terms, candidate_terms[0], limit, avg_length)
+        scores = defaultdict(float)
+        for token, idf in terms:
+            postings = self._postings[token]
+            if token in candidate_terms:
+                matches = postings.items()
+            else:
+                matches = [(book_id, postings[book_id]) for book_id in scores if book_id in postings]
+            for book_id, tf in matches:
+                scores[book_id] += self._weight(idf, tf, self._lengths[book_id], avg_length)
+        if limit is None:
+            return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def _top(self, terms, candidate_term, limit, avg_length):
+        """
+        The best limit matches of a query whose candidates all come from one term,
+        ranked exactly as search() ranks them. The candidates are visited from the
+        highest weight of that term down (a group of equal weights at a time, in id
+        order) and the walk stops as soon as no book left can enter the top limit,
+        so a common term costs about limit steps instead of one per book it is in.
+        """
+        if limit <= 0:
+            return []
+        max_weights = {
+            token: max(self._weight(idf, tf, length, avg_length) for tf, length in self._groups(token))
+            for token, idf in terms
+        }
+
+        def bound(weight):
+            # Highest score a candidate with this weight for candidate_term can have.
+            # Summed in the same order as the scores, so rounding cannot exceed it
+            total = 0.0
+            for token, _ in terms:
+                total += weight if token == candidate_term else max_weights[token]
+            return total
+
+        idf = dict(terms)[candidate_term]
+        groups = sorted(((self._weight(idf, tf, length, avg_length), ids)
+                         for (tf, length), ids in self._groups(candidate_term).items()),
+                        key=lambda group: -group[0])
+        best = []  # min-heap of (score, -id): best[0] is the worst of the top limit
+        for i, (weight, ids) in enumerate(groups):
+            group_bound = bound(weight)
+            later_bound = bound(groups[i + 1][0]) if i + 1 < len(groups) else None
+            for book_id in ids:
+                if len(best) == limit:
+                    worst_score, worst_id = best[0][0], -best[0][1]
+                    # Books later in this group have larger ids, those in later groups lower weights
+                    if ((later_bound is None or worst_score > later_bound)
+                            and (worst_score > group_bound or (worst_score == group_bound and worst_id < book_id))):
+                        return [(-neg_id, score) for score, neg_id in sorted(best, reverse=True)]
+                length = self._lengths[book_id]
+                score = 0.0
+                for token, term_idf in terms:
+                    tf = self._postings[token].get(book_id)
+                    if tf:
+                        score += self._weight(term_idf, tf, length, avg_length)
+                entry = (score, -book_id)
+                if len(best) < limit:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+        return [(-neg_id, score) for score, neg_id in sorted(best, reverse=True)]
+
+
+class PrefixIndex:
+    """
+    Sorted array of distinct (key, field, text) entries for search-as-you-type.
+    Each title and author gets one entry per word it contains, keyed by the lower-cased
+    text from that word on, so 'pot' finds "Harry Potter ...". A prefix query is a
+    binary search followed by a walk over at most limit matching entries.
+    Reference counts let several books share one title or author.
+    """
+    def __init__(self):
+        self._entries = []
+        self._counts = defaultdict(int)
+
+    def _keys(self, book):
+        for field in SUGGEST_FIELDS:
+            text = str(book.get(field, '')).strip()
+            lowered = text.lower()
+            for match in TOKEN_RE.finditer(lowered):
+                if match.start() == 0 or len(match.group()) > 1:
+                    yield (lowered[match.start():], field, text)
+
+    def add(self, book):
+        for entry in set(self._keys(book)):
+            self._counts[entry] += 1
+            if self._counts[entry] == 1:
+                bisect.insort(self._entries, entry)
+
+    def add_many(self, books):
+        """
+        Add many books, sorting the new entries once instead of inserting them one by one.
+        """
+        added = Counter(entry for book in books for entry in set(self._keys(book)))
+        new = [entry for entry in added if entry not in self._counts]
+        for entry, count in added.items():
+            self._counts[entry] += count
+        if new:
+            self._entries.extend(new)
+            self._entries.sort()
+
+    def remove(self, book):
+        for entry in set(self._keys(book)):
+            self._counts[entry] -= 1
+            if self._counts[entry] <= 0:
+                del self._counts[entry]
+                i = bisect.bisect_left(self._entries, entry)
+                if i < len(self._entries) and self._entries[i] == entry:
+                    del self._entries[i]
+
+    def suggest(self, prefix, limit=10):
+        """
+        Return up to limit {'text', 'field'} suggestions whose title or author has a
+        word starting with prefix, in alphabetical order of the matched text.
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        suggestions = []
+        seen = set()
+        i = bisect.bisect_left(self._entries, (prefix,))
+        while i < len(self._entries) and len(suggestions) < limit:
+            key, field, text = self._entries[i]
+            if not key.startswith(prefix):
+                break
+            if (field, text) not in seen:
+                seen.add((field, text))
+                suggestions.append({'text': text, 'field': field})
+            i += 1
+        return suggestions
@@ -0,0 +1,95 @@
+import json
+import threading
+from collections import OrderedDict
+
+# orjson is several times faster than the json module; it is used when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# No spaces after ',' and ':'
+COMPACT_SEPARATORS = (',', ':')
+
+
+def dumps(data):
+    """
+    Encode data as compact UTF-8 JSON bytes, with orjson when it is installed.
+    Values orjson rejects (e.g. integers over 64 bits or lone surrogates) fall back to
+    the json module, which escapes non-ASCII characters and so accepts any string.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(data, separators=COMPACT_SEPARATORS).encode()
+
+
+def loads(raw):
+    """
+    Decode JSON bytes or text, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+class RecordCache:
+    """
+    Encoded JSON bytes of recently sent books, so list responses are assembled by
+    joining them instead of encoding every book on every request.
+    An entry is only used for the book it was encoded from (the same object, or an
+    equal one for engines that decode a new dict on every read): the store replaces
+    a book's dict whenever the book changes, so a changed book is encoded again.
+    As a store listener, invalidate() frees the entries of changed books.
+    The cache is an LRU bounded to max_bytes of encoded JSON, so it keeps the books
+    that are listed often without growing with the catalogue.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def encode(self, book):
+        """
+        Return the JSON bytes of one book.
+        """
+        book_id = book['id']
+        with self._lock:
+            entry = self._entries.get(book_id)
+            if entry is not None and (entry[0] is book or entry[0] == book):
+                self._entries.move_to_end(book_id)
+                return entry[1]
+        data = dumps(book)
+        with self._lock:
+            self._remove(book_id)
+            self._entries[book_id] = (book, data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return data
+
+    def encode_list(self, books):
+        """
+        Return the JSON bytes of a list of books.
+        """
+        return b'[' + b','.join(map(self.encode, books)) + b']'
+
+    def _remove(self, book_id):
+        entry = self._entries.pop(book_id, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def invalidate(self, event):
+        with self._lock:
+            if event['op'] == 'reset':
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                self._remove(event.get('id'))
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,295 @@
+import mmap
+import struct
+import uuid
+from array import array
+from collections.abc import MutableMapping, ValuesView
+
+from serialization import dumps, loads
+
+# Binary snapshot layout (all integers little-endian):
+#   header   HEADER: magic, format version, number of books, next_id, snapshot id
+#            (16 random bytes) and the offsets of the three sections below
+#   strings  STRING_COUNT, then count + 1 u64 byte offsets into the UTF-8 blob that
+#            follows them; string i is blob[offsets[i]:offsets[i + 1]]
+#   index    one ENTRY (id, offset of the record) per book, sorted by id
+#   records  per book in id order: a u32 length, then RECORD (id, flags and one
+#            string number per STRING_FIELDS entry, NO_STRING if absent), then the
+#            compact JSON of any other keys if FLAG_EXTRA is set
+# Every distinct string is stored once, so repeated categories, authors and dates
+# take four bytes per book and decode to a single shared str.
+MAGIC = b'LIBSNAP1'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIQQ16sQQQ')
+STRING_COUNT = struct.Struct('<Q')
+ENTRY = struct.Struct('<qQ')
+LENGTH = struct.Struct('<I')
+STRING_FIELDS = ('name', 'author', 'publication_date', 'category', 'borrow_date', 'due_date', 'borrower_name')
+RECORD = struct.Struct(f'<qB{len(STRING_FIELDS)}I')
+PREFIXED_RECORD = struct.Struct(f'<IqB{len(STRING_FIELDS)}I')
+NO_STRING = 0xFFFFFFFF
+
+FLAG_HAS_BORROWED = 1
+FLAG_BORROWED = 2
+FLAG_EXTRA = 4
+
+
+def encode_snapshot(books, next_id):
+    """
+    Encode books (an iterable of book dicts with ids) as a binary snapshot, with the
+    records in id order. Returns (bytes, snapshot id as a hex string).
+    """
+    strings = {}
+    records = []
+    for book in books:
+        flags = 0
+        if isinstance(book.get('borrowed'), bool):
+            flags |= FLAG_HAS_BORROWED | (FLAG_BORROWED if book['borrowed'] else 0)
+        refs = []
+        for field in STRING_FIELDS:
+            value = book.get(field)
+            if isinstance(value, str):
+                refs.append(strings.setdefault(value, len(strings)))
+            else:
+                refs.append(NO_STRING)
+        # Keys the fixed part cannot hold (other fields, or values that are not strings)
+        extra = {k: v for k, v in book.items()
+                 if k != 'id' and not (k == 'borrowed' and flags & FLAG_HAS_BORROWED)
+                 and not (k in STRING_FIELDS and isinstance(v, str))}
+        record = RECORD.pack(book['id'], flags | (FLAG_EXTRA if extra else 0), *refs)
+        if extra:
+            record += dumps(extra)
+        records.append((book['id'], record))
+
+    blob = bytearray()
+    offsets = array('Q', [0])
+    for text in strings:
+        blob += text.encode('utf-8', 'surrogatepass')
+        offsets.append(len(blob))
+    string_section = STRING_COUNT.pack(len(strings)) + offsets.tobytes() + bytes(blob)
+
+    strings_offset = HEADER.size
+    index_offset = strings_offset + len(string_section)
+    records_offset = index_offset + ENTRY.size * len(records)
+    record_section = bytearray()
+    entries = []
+    records.sort(key=lambda item: item[0])
+    for book_id, record in records:
+        entries.append((book_id, records_offset + len(record_section)))
+        record_section += LENGTH.pack(len(record)) + record
+    index_section = b''.join(ENTRY.pack(*entry) for entry in entries)
+
+    snapshot_id = uuid.uuid4()
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(records), next_id, snapshot_id.bytes,
+                         strings_offset, index_offset, records_offset)
+    return header + string_section + index_section + bytes(record_section), snapshot_id.hex
+
+
+class Snapshot:
+    """
+    A binary snapshot file, memory-mapped. get() decodes a single book straight from
+    the mapping without reading the rest of the file; items() decodes them all in turn.
+    Raises ValueError if the file is not a snapshot. Close it (or use it as a context
+    manager) to unmap the file.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._map) < HEADER.size:
+                raise ValueError(f"{path} is not a library snapshot")
+            (magic, version, self.count, self.next_id, snapshot_id,
+             self._strings_offset, self._index_offset, self._records_offset) = HEADER.unpack_from(self._map)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{path} is not a library snapshot (version {FORMAT_VERSION})")
+        except Exception:
+            self._map.close()
+            raise
+        self.snapshot_id = snapshot_id.hex()
+        self._string_count, = STRING_COUNT.unpack_from(self._map, self._strings_offset)
+        self._blob_offset = self._strings_offset + STRING_COUNT.size + 8 * (self._string_count + 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def _string(self, number):
+        start, end = struct.unpack_from('<QQ', self._map, self._strings_offset + STRING_COUNT.size + 8 * number)
+        return self._map[self._blob_offset + start:self._blob_offset + end].decode('utf-8', 'surrogatepass')
+
+    def _strings(self):
+        """
+        Decode the whole string table.
+        """
+        offsets = array('Q')
+        offsets.frombytes(self._map[self._strings_offset + STRING_COUNT.size:self._blob_offset])
+        blob = self._map[self._blob_offset:self._blob_offset + offsets[-1]]
+        return [blob[start:end].decode('utf-8', 'surrogatepass') for start, end in zip(offsets, offsets[1:])]
+
+    def _decode(self, offset, string):
+        """
+        Decode the record at offset, looking strings up with string(number).
+        Returns (book, offset of the next record).
+        """
+        length, book_id, flags, *refs = PREFIXED_RECORD.unpack_from(self._map, offset)
+        book = {field: string(ref) for field, ref in zip(STRING_FIELDS, refs) if ref != NO_STRING}
+        book['id'] = book_id
+        if flags & FLAG_HAS_BORROWED:
+            book['borrowed'] = bool(flags & FLAG_BORROWED)
+        end = offset + LENGTH.size + length
+        if flags & FLAG_EXTRA:
+            book.update(loads(self._map[offset + PREFIXED_RECORD.size:end]))
+        return book, end
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self._map, self._index_offset + ENTRY.size * i)
+
+    def offset(self, book_id):
+        """
+        Return the offset of the record of the given id, or None if there is none.
+        Looks the id up by binary search in the index.
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_id, offset = self._entry(mid)
+            if entry_id == book_id:
+                return offset
+            if entry_id < book_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def get(self, book_id):
+        """
+        Return the book with the given id, decoded on its own, or None.
+        """
+        offset = self.offset(book_id)
+        return None if offset is None else self._decode(offset, self._string)[0]
+
+    def ids(self):
+        """
+        Return the ids of the books in the snapshot, in ascending order.
+        """
+        index = self._map[self._index_offset:self._records_offset]
+        return [book_id for book_id, _ in ENTRY.iter_unpack(index)]
+
+    def items(self):
+        """
+        Decode every book in turn. Yields (id, book) in id order.
+        """
+        # Same decoding as _decode, inlined, with the string table decoded once:
+        # this loop runs once per book whenever the whole catalogue is read
+        strings = self._strings()
+        unpack = PREFIXED_RECORD.unpack_from
+        data = self._map
+        offset = self._records_offset
+        for _ in range(self.count):
+            length, book_id, flags, *refs = unpack(data, offset)
+            book = {field: strings[ref] for field, ref in zip(STRING_FIELDS, refs) if ref != NO_STRING}
+            book['id'] = book_id
+            if flags & FLAG_HAS_BORROWED:
+                book['borrowed'] = bool(flags & FLAG_BORROWED)
+            end = offset + LENGTH.size + length
+            if flags & FLAG_EXTRA:
+                book.update(loads(data[offset + PREFIXED_RECORD.size:end]))
+            yield book_id, book
+            offset = end
+
+
+class SnapshotBooks(MutableMapping):
+    """
+    id -> book mapping over a Snapshot, in id order. Books are decoded from the
+    mapped file each time they are read, so the catalogue itself is never held in
+    memory: only the books added, changed or deleted since the snapshot was written
+    are kept, as dicts laid over it. Every read returns a new dict, so changing a
+    book means storing it again.
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._changed = {}  # id in the snapshot -> new book, or None if deleted
+        self._added = {}    # books that are not in the snapshot
+        self._len = snapshot.count
+
+    def __getitem__(self, book_id):
+        if book_id in self._added:
+            return self._added[book_id]
+        book = self._changed.get(book_id, False)
+        if book is False:
+            book = self.snapshot.get(book_id) if type(book_id) is int else None
+        if book is None:
+            raise KeyError(book_id)
+        return book
+
+    def __contains__(self, book_id):
+        if book_id in self._added:
+            return True
+        if book_id in self._changed:
+            return self._changed[book_id] is not None
+        return type(book_id) is int and self.snapshot.offset(book_id) is not None
+
+    def __setitem__(self, book_id, book):
+        if book_id in self._added or self.snapshot.offset(book_id) is None:
+            self._len += book_id not in self._added
+            self._added[book_id] = book
+        else:
+            self._len += self._changed.get(book_id, False) is None
+            self._changed[book_id] = book
+
+    def __delitem__(self, book_id):
+        if book_id not in self:
+            raise KeyError(book_id)
+        self._len -= 1
+        if book_id in self._added:
+            del self._added[book_id]
+        else:
+            self._changed[book_id] = None
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        changed = self._changed
+        for book_id in self.snapshot.ids():
+            if changed.get(book_id, False) is not None:
+                yield book_id
+        yield from list(self._added)
+
+    def values(self):
+        return SnapshotValues(self)
+
+    def iter_books(self):
+        """
+        Yield every book in id order, decoding the snapshot sequentially.
+        """
+        changed = self._changed
+        for book_id, book in self.snapshot.items():
+            book = changed.get(book_id, book)
+            if book is not None:
+                yield book
+        yield from list(self._added.values())
+
+
+class SnapshotValues(ValuesView):
+    """
+    The books of a SnapshotBooks, read in one sequential pass over the snapshot
+    instead of one index lookup per book.
+    """
+    def __iter__(self):
+        return self._mapping.iter_books()
+
+
+def is_snapshot(path):
+    """
+    Tell whether the file at path starts like a binary snapshot.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
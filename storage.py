@@ -0,0 +1,470 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from dates import due_date_key
+from serialization import COMPACT_SEPARATORS, dumps, loads
+from snapshot import Snapshot, SnapshotBooks, encode_snapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def apply_record(books, record):
+    """
+    Apply one mutation record to a dict of id -> book and return the affected book.
+    Records are dicts with an 'op' of 'add', 'update' or 'delete'.
+    """
+    op = record['op']
+    if op == 'add':
+        book = record['book']
+        books[book['id']] = book
+        return book
+    book_id = record['id']
+    if op == 'update':
+        book = books[book_id]
+        book.update(record.get('fields', {}))
+        for key in record.get('remove', ()):
+            book.pop(key, None)
+        # Stored again for mappings that decode a new dict on every read (SnapshotBooks)
+        books[book_id] = book
+        return book
+    if op == 'delete':
+        return books.pop(book_id)
+    raise ValueError(f"Unknown record op: {op}")
+
+
+def assign_ids(books, next_id=0):
+    """
+    Give every book without an 'id' the next free one, in list order.
+    Returns the dict of id -> book (in list order) and the next unused id.
+    Data files written before books had ids get ids 0, 1, 2, ... this way.
+    """
+    next_id = max([next_id] + [book['id'] + 1 for book in books if 'id' in book])
+    by_id = {}
+    for book in books:
+        if 'id' not in book:
+            book['id'] = next_id
+            next_id += 1
+        by_id[book['id']] = book
+    return by_id, next_id
+
+
+def write_atomic(path, data):
+    """
+    Replace the file at path with data (bytes) so that readers and crashes only ever
+    see the old or the new contents: write a temp file, fsync it and rename it over path.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class FileLock:
+    """
+    Exclusive lock on a file, shared by every process that uses the same data
+    (flock on POSIX, msvcrt.locking on Windows). It is re-entrant within a process;
+    threads of one process must be serialized by the caller.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._pid = None
+        self._depth = 0
+
+    def __enter__(self):
+        if self._depth == 0:
+            # A lock file inherited through fork would be shared with the parent, so reopen it
+            if self._file is None or self._pid != os.getpid():
+                self._file = open(self.path, 'a+b')
+                self._pid = os.getpid()
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Storage:
+    """
+    Base class for the persistence engines behind BookStore.
+    An engine loads the full catalogue, persists single mutation records and
+    reports a signature that changes when another process modifies the data.
+    Every book carries a persistent 'id'; next_id is the first id never handed out,
+    which engines store so that ids of deleted books are not reused.
+    Engines with their own indexes may also answer filter queries.
+    lock() guards the data against writers in other processes through '<path>.lock'.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file_lock = FileLock(path + '.lock')
+
+    def lock(self):
+        """
+        Return a context manager that keeps other processes from writing the data while held.
+        """
+        return self._file_lock
+
+    def load(self):
+        """
+        Return (books, next_id) where books is a dict of id -> book in catalogue order.
+        """
+        raise NotImplementedError
+
+    def signature(self):
+        """
+        Return a value that changes whenever the stored data changes outside this process.
+        """
+        return None
+
+    def commit(self, record, books, next_id):
+        """
+        Persist one mutation record. books is the in-memory dict with the record already applied.
+        """
+        self.commit_many([record], books, next_id)
+
+    def commit_many(self, records, books, next_id):
+        """
+        Persist several mutation records with a single write, all or nothing.
+        books is the in-memory dict with the records already applied.
+        """
+        raise NotImplementedError
+
+    def replace_all(self, books, next_id=None):
+        """
+        Overwrite the stored data with the given books (any iterable of book dicts).
+        Books without an id are given one.
+        """
+        raise NotImplementedError
+
+    def query(self, borrowed=None, category=None, name=None):
+        """
+        Return the ids of the books matching the filters in catalogue order, or None if
+        this engine cannot answer the query and the caller should filter in memory.
+        """
+        return None
+
+    def close(self):
+        self._file_lock.close()
+
+
+class JSONStorage(Storage):
+    """
+    The whole catalogue as one compact JSON file, rewritten on every change.
+    The file is replaced atomically (see write_atomic), so it is never half-written.
+    The file holds {"next_id": ..., "books": [...]}; a bare JSON array of books
+    (the original data.db format, or a hand-edited file) is read as well.
+    """
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def signature(self):
+        return self._stat(self.path)
+
+    def _read(self):
+        """
+        Return the raw bytes of the data file, or None if it does not exist.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def _parse(self, raw):
+        """
+        Decode the data file into (books, next_id) with every book given an id.
+        """
+        data = loads(raw) if raw is not None else []
+        if isinstance(data, dict):
+            return assign_ids(data.get('books', []), data.get('next_id', 0))
+        return assign_ids(data)
+
+    def _dump(self, books, next_id):
+        """
+        Encode the catalogue as compact JSON bytes.
+        """
+        books, next_id = assign_ids(list(books), next_id or 0)
+        return dumps({'next_id': next_id, 'books': list(books.values())})
+
+    def load(self):
+        return self._parse(self._read())
+
+    def commit_many(self, records, books, next_id):
+        self.replace_all(books.values(), next_id)
+
+    def replace_all(self, books, next_id=None):
+        write_atomic(self.path, self._dump(books, next_id))
+
+
+class JournalStorage(JSONStorage):
+    """
+    JSON snapshot plus an append-only journal of mutation records in '<path>.journal'.
+    A mutation appends one small record, so write cost does not depend on the size of
+    the catalogue. The snapshot is rebuilt once the journal holds compact_every records,
+    or as many records as there are books if that is more, so a large import does not
+    rewrite the whole catalogue every few chunks. Loading replays the snapshot followed
+    by the journal.
+    """
+    def __init__(self, path, compact_every=1000):
+        super().__init__(path)
+        self.journal_path = path + '.journal'
+        self.compact_every = compact_every
+        self._snapshot_hash = None
+        self._journal_records = 0
+
+    def signature(self):
+        return (self._stat(self.path), self._stat(self.journal_path))
+
+    def load(self):
+        raw = self._read()
+        books, next_id = self._parse(raw)
+        self._snapshot_hash = hashlib.sha1(raw).hexdigest() if raw is not None else None
+        self._journal_records = 0
+        next_id = self._replay(books, next_id)
+        return books, next_id
+
+    def _replay(self, books, next_id):
+        """
+        Apply the journal on top of the snapshot that was just loaded.
+        The journal's first line names the snapshot it was written against; a journal
+        left over from an interrupted compaction does not match and is ignored.
+        A torn last line from a crash mid-append is skipped as well.
+        Returns the next unused id after replaying.
+        """
+        if not os.path.exists(self.journal_path):
+            return next_id
+        with open(self.journal_path, 'r') as f:
+            lines = f.read().splitlines()
+        if not lines:
+            return next_id
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return next_id
+        if header.get('op') != 'base' or header.get('snapshot') != self._snapshot_hash:
+            return next_id
+        for line in lines[1:]:
+            try:
+                record = loads(line)
+            except ValueError:
+                break
+            if record['op'] == 'add':
+                record['book'].setdefault('id', next_id)
+                next_id = max(next_id, record['book']['id'] + 1)
+            apply_record(books, record)
+            self._journal_records += 1
+        return next_id
+
+    def commit_many(self, records, books, next_id):
+        if not os.path.exists(self.journal_path):
+            self._reset_journal()
+        with open(self.journal_path, 'a') as f:
+            f.write(''.join(json.dumps(record, separators=COMPACT_SEPARATORS) + '\n' for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_records += len(records)
+        if self._journal_records >= max(self.compact_every, len(books)):
+            self.replace_all(books.values(), next_id)
+
+    def _reset_journal(self):
+        """
+        Atomically replace the journal with an empty one bound to the current snapshot.
+        """
+        write_atomic(self.journal_path, (json.dumps({'op': 'base', 'snapshot': self._snapshot_hash}) + '\n').encode())
+        self._journal_records = 0
+
+    def replace_all(self, books, next_id=None):
+        """
+        Fold the journal into a fresh snapshot of the data file.
+        The snapshot is replaced atomically, so a crash leaves either the old snapshot
+        plus its journal or the new one.
+        """
+        raw = self._dump(books, next_id)
+        write_atomic(self.path, raw)
+        self._snapshot_hash = hashlib.sha1(raw).hexdigest()
+        self._reset_journal()
+
+
+class SnapshotStorage(JournalStorage):
+    """
+    Binary snapshot (see snapshot.py) plus the append-only journal of JournalStorage.
+    load() returns a SnapshotBooks over the memory-mapped snapshot: books are decoded
+    from the file when they are read, and only the journal's changes are held in memory.
+    Compaction writes a new binary snapshot; the journal is bound to the snapshot's id.
+    The mapping keeps the replaced file readable (POSIX), so the books loaded before a
+    compaction stay valid.
+    """
+    def load(self):
+        books, next_id, self._snapshot_hash = {}, 0, None
+        if os.path.exists(self.path):
+            snapshot = Snapshot(self.path)
+            books, next_id, self._snapshot_hash = SnapshotBooks(snapshot), snapshot.next_id, snapshot.snapshot_id
+        self._journal_records = 0
+        next_id = self._replay(books, next_id)
+        return books, next_id
+
+    def replace_all(self, books, next_id=None):
+        books, next_id = assign_ids(list(books), next_id or 0)
+        raw, self._snapshot_hash = encode_snapshot(books.values(), next_id)
+        write_atomic(self.path, raw)
+        self._reset_journal()
+
+
+class SQLiteStorage(Storage):
+    """
+    Books stored as rows of a SQLite database in WAL mode.
+    Each row keeps the full book as JSON plus case-folded name and category, the
+    borrowed flag and the due date (as a sortable 'yyyy-mm-dd' key) in indexed
+    columns, so filters run as indexed queries.
+    The next unused id is kept in the meta table.
+    """
+    def __init__(self, path):
+        super().__init__(path)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS books (
+                id INTEGER PRIMARY KEY,
+                name_key TEXT NOT NULL DEFAULT '',
+                category_key TEXT NOT NULL DEFAULT '',
+                borrowed INTEGER NOT NULL DEFAULT 0,
+                due_date TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_books_name ON books(name_key);
+            CREATE INDEX IF NOT EXISTS idx_books_category ON books(category_key);
+            CREATE INDEX IF NOT EXISTS idx_books_borrowed ON books(borrowed);
+            CREATE INDEX IF NOT EXISTS idx_books_due_date ON books(due_date);
+        """)
+
+    def signature(self):
+        # data_version changes whenever another connection commits to the database
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def load(self):
+        books = {}
+        for book_id, data in self.conn.execute('SELECT id, data FROM books ORDER BY id'):
+            book = loads(data)
+            book['id'] = book_id
+            books[book_id] = book
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        next_id = max([row[0] if row else 0] + [book_id + 1 for book_id in books])
+        return books, next_id
+
+    def _row(self, book):
+        return (
+            book['id'],
+            str(book.get('name', '')).lower(),
+            str(book.get('category', '')).lower(),
+            1 if book.get('borrowed', False) else 0,
+            due_date_key(book.get('due_date')) or None,
+            json.dumps(book, separators=COMPACT_SEPARATORS),
+        )
+
+    def _upsert(self, book):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO books (id, name_key, category_key, borrowed, due_date, data) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            self._row(book),
+        )
+
+    def _set_next_id(self, next_id):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)", (next_id,))
+
+    def commit_many(self, records, books, next_id):
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            for record in records:
+                op = record['op']
+                if op == 'add':
+                    self._upsert(record['book'])
+                elif op == 'update':
+                    # A later delete in the same batch removes the row again
+                    if record['id'] in books:
+                        self._upsert(books[record['id']])
+                elif op == 'delete':
+                    self.conn.execute('DELETE FROM books WHERE id = ?', (record['id'],))
+            if any(record['op'] == 'add' for record in records):
+                self._set_next_id(next_id)
+
+    def replace_all(self, books, next_id=None):
+        books, next_id = assign_ids(list(books), next_id or 0)
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute('DELETE FROM books')
+            self.conn.executemany(
+                'INSERT INTO books (id, name_key, category_key, borrowed, due_date, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self._row(book) for book in books.values()),
+            )
+            self._set_next_id(next_id)
+
+    def query(self, borrowed=None, category=None, name=None):
+        clauses, params = [], []
+        if borrowed == 'available':
+            clauses.append('borrowed = 0')
+        elif borrowed == 'borrowed':
+            clauses.append('borrowed = 1')
+        if category:
+            clauses.append('category_key = ?')
+            params.append(category.lower())
+        if name:
+            clauses.append('name_key = ?')
+            params.append(name.lower())
+        sql = 'SELECT id FROM books'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY id'
+        return [book_id for (book_id,) in self.conn.execute(sql, params)]
+
+    def close(self):
+        self.conn.close()
+        super().close()
+
+
+def open_storage(engine, path):
+    """
+    Create the storage engine named by engine ('json', 'journal', 'snapshot' or 'sqlite') for path.
+    """
+    if engine == 'json':
+        return JSONStorage(path)
+    if engine == 'journal':
+        return JournalStorage(path)
+    if engine == 'snapshot':
+        return SnapshotStorage(path)
+    if engine == 'sqlite':
+        return SQLiteStorage(path)
+    raise ValueError(f"Unknown storage engine: {engine}")
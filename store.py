@@ -0,0 +1,742 @@
+import base64
+import bisect
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from collections.abc import Mapping, ValuesView
+from contextlib import contextmanager
+
+from dates import due_date_key, today_key
+from metrics import metrics
+from search import PrefixIndex, SearchIndex
+
+# Orders GET /books can be sorted in; 'id' is catalogue order
+SORT_FIELDS = ('id', 'name', 'author', 'publication_date', 'due_date')
+
+# How many recent changes are remembered for changes(since)
+CHANGE_LOG_SIZE = 10000
+
+# Writes changing more books than this rebuild the sorted indexes with one merge each
+# instead of inserting every book into them on its own
+BULK_INDEX_THRESHOLD = 64
+
+
+def sort_key(book, field):
+    """
+    Return the value a book is ordered by for one of SORT_FIELDS.
+    Text is compared case-insensitively; books without a due date sort after the others.
+    """
+    if field == 'id':
+        return book['id']
+    if field == 'due_date':
+        key = due_date_key(book.get('due_date'))
+        return (0, key) if key else (1, '')
+    return str(book.get(field, '')).lower()
+
+
+def encode_cursor(sort, entry):
+    """
+    Encode the (key, id) of the last book on a page as an opaque cursor string.
+    """
+    raw = json.dumps([sort, entry[0], entry[1]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(sort, cursor):
+    """
+    Decode a cursor made by encode_cursor back into a (key, id) entry.
+    Raises ValueError if the cursor is malformed or was made for another sort order.
+    """
+    try:
+        cursor_sort, key, book_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort:
+        raise ValueError('Cursor does not match sort order')
+    # The key must compare with the keys sort_key() makes for this sort order
+    if sort == 'id':
+        valid = type(key) is int
+    elif sort == 'due_date':
+        valid = (isinstance(key, list) and len(key) == 2 and type(key[0]) is int
+                 and isinstance(key[1], str))
+        key = tuple(key) if valid else key
+    else:
+        valid = isinstance(key, str)
+    if not valid or type(book_id) is not int:
+        raise ValueError('Invalid cursor')
+    return (key, book_id)
+
+
+class CatalogueView(Mapping):
+    """
+    Read-only id -> book view of the catalogue as it is after a write: the resident
+    books with changed (id -> new book, or None for a deleted book) laid over them.
+    It lets the storage engine persist a write before readers see it, without
+    copying the catalogue.
+    """
+    def __init__(self, books, changed):
+        self._books = books
+        self._changed = changed
+
+    def __getitem__(self, book_id):
+        if book_id in self._changed:
+            book = self._changed[book_id]
+            if book is None:
+                raise KeyError(book_id)
+            return book
+        return self._books[book_id]
+
+    def __iter__(self):
+        for book_id in self._books:
+            if self._changed.get(book_id, True) is not None:
+                yield book_id
+        for book_id, book in self._changed.items():
+            if book is not None and book_id not in self._books:
+                yield book_id
+
+    def values(self):
+        return CatalogueValues(self)
+
+    def __len__(self):
+        count = len(self._books)
+        for book_id, book in self._changed.items():
+            if book is None:
+                count -= book_id in self._books
+            else:
+                count += book_id not in self._books
+        return count
+
+
+class CatalogueValues(ValuesView):
+    """
+    The books of a CatalogueView, read in one pass over the resident books' values
+    (sequentially decoded for the snapshot engine) instead of one lookup per id.
+    """
+    def __iter__(self):
+        view = self._mapping
+        for book in view._books.values():
+            book = view._changed.get(book['id'], book)
+            if book is not None:
+                yield book
+        for book_id, book in view._changed.items():
+            if book is not None and book_id not in view._books:
+                yield book
+
+
+class BookStore:
+    """
+    Process-resident copy of the library catalogue on top of a storage engine.
+    The catalogue is loaded once at startup and every read is served from memory
+    (for the snapshot engine, from the memory-mapped snapshot: only the indexes and
+    the books changed since the snapshot are held as Python objects).
+    Mutations are written through to the engine, and the engine's signature is
+    checked before each access so that changes made outside this process trigger a reload.
+
+    Books are kept in a dict keyed by their persistent id, so lookups, updates and
+    deletes are O(1). Ids are assigned by add() and never reused.
+
+    Secondary indexes map lower-cased category and name to sets of ids and keep
+    the borrowed and available ids as sets, so filters are answered by set
+    intersection instead of a scan of the whole catalogue. A full-text SearchIndex
+    over name, author and category and a PrefixIndex of titles and authors for
+    search-as-you-type are maintained the same way, as is one sorted list of
+    (sort key, id) per entry of SORT_FIELDS for keyset pagination. Loans (borrowed
+    books with a due date) are kept in a sorted list of (due date key, id), so the
+    books due before a date, such as the overdue ones, are found by binary search,
+    and in a dict of id -> due date key, so whether a book is overdue is one lookup.
+    Each of these is built the first time a read needs it, not when the catalogue is
+    loaded, so startup only reads the books (for the snapshot engine, only maps the
+    file) and a process never pays for indexes it does not use.
+
+    Every mutation increases the catalogue version by one and is remembered in a
+    bounded change log, so clients can fetch only what changed since the version
+    they last saw. Versions start from the clock in microseconds when the catalogue
+    is (re)loaded, so they keep increasing across restarts and external reloads.
+
+    Writes are copy-on-write: a changed book is a new dict, and books handed out are
+    never modified afterwards. Writers take the catalogue write lock and the storage
+    engine's inter-process lock, persist the change, and only then take the short
+    in-memory lock to publish it, so readers never wait for disk I/O. A caller that
+    checks a book and then changes it (e.g. borrow) passes the check to update() as
+    a precondition, or builds the records with apply_plan(), so it runs under both
+    locks against the refreshed catalogue and no other thread or process can change
+    the book in between.
+
+    Functions in listeners are called with an event dict for every change:
+    {'op': 'upsert' or 'delete', 'id', 'version'}, or {'op': 'reset', 'version'}
+    when the catalogue was reloaded. They are called with the write lock held and
+    must not block.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self._books = {}
+        self._next_id = 0
+        self._signature = None
+        self._rebuild_indexes()
+        self._version = 0
+        self._load_version = 0
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)
+        self._book_versions = {}
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self.loaded = False
+        self.listeners = []
+        self.reload()
+
+    def reload(self):
+        """
+        Unconditionally re-read the catalogue from the storage engine.
+        What changed is unknown, so the change log starts over at a new version.
+        The storage lock keeps other processes from writing (or compacting a journal)
+        while the data is read, and the signature is taken before the data, so an
+        edit made outside the lock meanwhile is still noticed by the next refresh().
+        """
+        with self._write_lock, self.storage.lock(), self._lock:
+            self._signature = self.storage.signature()
+            with metrics.stage('storage'):
+                self._books, self._next_id = self.storage.load()
+            self._rebuild_indexes()
+            self._version = max(self._version + 1, time.time_ns() // 1000)
+            self._load_version = self._version
+            self._changes.clear()
+            self._book_versions = {}
+            self.loaded = True
+            self._notify({'op': 'reset', 'version': self._version})
+
+    def _rebuild_indexes(self):
+        """
+        Drop all secondary indexes. Each is built again from the books the first time
+        a read needs it (see _filter_index() and the methods after it).
+        """
+        self._by_category = None
+        self._by_name = None
+        self._borrowed = None
+        self._available = None
+        self._search = None
+        self._prefixes = None
+        # Replaced rather than changed in place, as writers merge it without the lock
+        self._orderings = {}
+        self._loans = None
+        self._due_keys = None
+
+    # The index builders below are called with _lock held. They read the books once,
+    # as the engine may decode them on every read (see SnapshotBooks)
+
+    def _filter_index(self):
+        """
+        Build the category, name and borrowed status indexes if they are not built yet.
+        """
+        if self._by_category is not None:
+            return
+        by_category, by_name, borrowed, available = defaultdict(set), defaultdict(set), set(), set()
+        for book in self._books.values():
+            book_id = book['id']
+            by_category[str(book.get('category', '')).lower()].add(book_id)
+            by_name[str(book.get('name', '')).lower()].add(book_id)
+            (borrowed if book.get('borrowed', False) else available).add(book_id)
+        self._by_category, self._by_name, self._borrowed, self._available = by_category, by_name, borrowed, available
+
+    def _search_index(self):
+        """
+        Return the full-text SearchIndex, building it first if needed.
+        """
+        if self._search is None:
+            search = SearchIndex()
+            for book in self._books.values():
+                search.add(book)
+            self._search = search
+        return self._search
+
+    def _prefix_index(self):
+        """
+        Return the PrefixIndex of titles and authors, building it first if needed.
+        """
+        if self._prefixes is None:
+            prefixes = PrefixIndex()
+            prefixes.add_many(self._books.values())
+            self._prefixes = prefixes
+        return self._prefixes
+
+    def _ordering(self, field):
+        """
+        Return the sorted list of (sort key, id) for one of SORT_FIELDS, building it
+        first if needed. The list is built with one sort; inserting book by book would
+        make it quadratic in the size of the catalogue.
+        """
+        ordering = self._orderings.get(field)
+        if ordering is None:
+            if field == 'id':
+                # Needs no book to be read
+                ordering = [(book_id, book_id) for book_id in sorted(self._books)]
+            else:
+                ordering = sorted((sort_key(book, field), book['id']) for book in self._books.values())
+            self._orderings = dict(self._orderings, **{field: ordering})
+        return ordering
+
+    def _loan_index(self):
+        """
+        Build the sorted loans and the due date key of each loan if they are not built yet.
+        """
+        if self._loans is not None and self._due_keys is not None:
+            return
+        self._loans = sorted(loan for loan in map(self._loan, self._books.values()) if loan)
+        self._due_keys = {book_id: key for key, book_id in self._loans}
+
+    def _index(self, book, sorted_indexes=True):
+        """
+        Add one book to the secondary indexes that are built. With sorted_indexes false
+        the prefix index, the orderings and the loans are left to the caller.
+        """
+        book_id = book['id']
+        if self._by_category is not None:
+            self._by_category[str(book.get('category', '')).lower()].add(book_id)
+            self._by_name[str(book.get('name', '')).lower()].add(book_id)
+            (self._borrowed if book.get('borrowed', False) else self._available).add(book_id)
+        if self._search is not None:
+            self._search.add(book)
+        loan = self._loan(book)
+        if loan and self._due_keys is not None:
+            self._due_keys[book_id] = loan[0]
+        if not sorted_indexes:
+            return
+        if self._prefixes is not None:
+            self._prefixes.add(book)
+        for field, ordering in self._orderings.items():
+            bisect.insort(ordering, (sort_key(book, field), book_id))
+        if loan and self._loans is not None:
+            bisect.insort(self._loans, loan)
+
+    def _unindex(self, book, sorted_indexes=True):
+        """
+        Remove one book from the secondary indexes that are built, dropping keys that
+        become empty. With sorted_indexes false the orderings and the loans are left
+        to the caller.
+        """
+        book_id = book['id']
+        if self._by_category is not None:
+            for index, key in ((self._by_category, str(book.get('category', '')).lower()),
+                               (self._by_name, str(book.get('name', '')).lower())):
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(book_id)
+                    if not ids:
+                        del index[key]
+            self._borrowed.discard(book_id)
+            self._available.discard(book_id)
+        if self._due_keys is not None:
+            self._due_keys.pop(book_id, None)
+        if self._search is not None:
+            self._search.remove(book_id)
+        if self._prefixes is not None:
+            self._prefixes.remove(book)
+        if not sorted_indexes:
+            return
+        for field, ordering in self._orderings.items():
+            entry = (sort_key(book, field), book_id)
+            i = bisect.bisect_left(ordering, entry)
+            if i < len(ordering) and ordering[i] == entry:
+                del ordering[i]
+        loan = self._loan(book)
+        if loan and self._loans is not None:
+            i = bisect.bisect_left(self._loans, loan)
+            if i < len(self._loans) and self._loans[i] == loan:
+                del self._loans[i]
+
+    def _merged_sorted_indexes(self, changed):
+        """
+        Return new (orderings, loans) with the changed books (id -> new book, or None if
+        deleted) merged in: the entries of their old versions are filtered out and the
+        new entries added with one sort per list, which merges the two sorted runs.
+        Only the lists that are built are merged (loans is None if they are not).
+        Must be called inside _writing(); the current lists are left untouched, so
+        readers keep using them until the new ones are published.
+        """
+        old = [self._books[book_id] for book_id in changed if book_id in self._books]
+        new = [book for book in changed.values() if book is not None]
+
+        def merged(entries, stale, added):
+            stale = set(stale)
+            result = [entry for entry in entries if entry not in stale] if stale else list(entries)
+            result.extend(added)
+            result.sort()
+            return result
+
+        orderings = {
+            field: merged(ordering, ((sort_key(book, field), book['id']) for book in old),
+                          ((sort_key(book, field), book['id']) for book in new))
+            for field, ordering in self._orderings.items()
+        }
+        loans = self._loans
+        if loans is not None:
+            loans = merged(loans, filter(None, map(self._loan, old)), filter(None, map(self._loan, new)))
+        return orderings, loans
+
+    @staticmethod
+    def _loan(book):
+        """
+        Return the (due date key, id) entry of a borrowed book with a valid due date, else None.
+        """
+        if not book.get('borrowed', False):
+            return None
+        key = due_date_key(book.get('due_date'))
+        return (key, book['id']) if key else None
+
+    def refresh(self):
+        """
+        Reload the catalogue only if the stored data changed since we last saw it.
+        While another thread is writing the check is skipped: the writer has already
+        changed the stored data and publishes its change itself.
+        """
+        if not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                if self.storage.signature() != self._signature:
+                    self.reload()
+        finally:
+            self._write_lock.release()
+
+    def _notify(self, event):
+        for listener in self.listeners:
+            listener(event)
+
+    @contextmanager
+    def _writing(self):
+        """
+        Hold the catalogue write lock and the storage engine's inter-process lock,
+        with the catalogue refreshed from any writes by other processes.
+        """
+        with self._write_lock, self.storage.lock():
+            self.refresh()
+            yield
+
+    def _commit(self, record):
+        """
+        Persist a mutation record through the storage engine and apply it in memory.
+        """
+        return self._commit_many([record])[0]
+
+    def _commit_many(self, records):
+        """
+        Persist mutation records with one storage write, then publish them in memory.
+        Must be called inside _writing(). Returns the affected book after each record.
+        If persisting fails the in-memory copy is reloaded so it never runs ahead of disk.
+        """
+        # Work out the new books first; nothing readers can see is modified yet
+        changed = {}
+        results = []
+        for record in records:
+            op = record['op']
+            if op == 'add':
+                book = record['book']
+            else:
+                book_id = record['id']
+                current = changed[book_id] if book_id in changed else self._books[book_id]
+                if op == 'delete':
+                    changed[book_id] = None
+                    results.append(current)
+                    continue
+                book = dict(current)
+                book.update(record.get('fields', {}))
+                for key in record.get('remove', ()):
+                    book.pop(key, None)
+            changed[book['id']] = book
+            results.append(book)
+        try:
+            with metrics.stage('storage'):
+                self.storage.commit_many(records, CatalogueView(self._books, changed), self._next_id)
+        except Exception:
+            self.reload()
+            raise
+        bulk = len(changed) > BULK_INDEX_THRESHOLD
+        if bulk:
+            orderings, loans = self._merged_sorted_indexes(changed)
+        events = []
+        with self._lock:
+            self._signature = self.storage.signature()
+            for book_id, book in changed.items():
+                old = self._books.pop(book_id, None) if book is None else self._books.get(book_id)
+                if old is not None:
+                    self._unindex(old, not bulk)
+                if book is not None:
+                    self._books[book_id] = book
+                    self._index(book, not bulk)
+            if bulk:
+                if self._prefixes is not None:
+                    self._prefixes.add_many(book for book in changed.values() if book is not None)
+                # Lists a reader built meanwhile lack this write; they are built again when needed
+                self._orderings, self._loans = orderings, loans
+            for record, result in zip(records, results):
+                self._version += 1
+                book_id = result['id']
+                self._changes.append((self._version, book_id))
+                if record['op'] == 'delete':
+                    self._book_versions.pop(book_id, None)
+                else:
+                    self._book_versions[book_id] = self._version
+                events.append({'op': 'delete' if record['op'] == 'delete' else 'upsert',
+                               'id': book_id, 'version': self._version})
+        for event in events:
+            self._notify(event)
+        return results
+
+    @property
+    def version(self):
+        """
+        The current catalogue version; it increases with every change.
+        """
+        with self._lock:
+            self.refresh()
+            return self._version
+
+    def book_version(self, book_id):
+        """
+        Return the catalogue version at which the given book last changed.
+        """
+        with self._lock:
+            self.refresh()
+            return self._book_versions.get(book_id, self._load_version)
+
+    def changes(self, since):
+        """
+        Return what changed after catalogue version since as
+        {'version', 'upserted': [current books], 'deleted': [ids]}.
+        If since is older than the change log remembers (or not from this catalogue),
+        {'version', 'reset': True} is returned and the caller must reload everything.
+        """
+        with self._lock:
+            self.refresh()
+            # The log holds every change after this version
+            oldest = self._changes[0][0] - 1 if self._changes else self._version
+            if since > self._version or since < oldest:
+                return {'version': self._version, 'reset': True}
+            changed = {}
+            for version, book_id in reversed(self._changes):
+                if version <= since:
+                    break
+                changed.setdefault(book_id, version)
+            return {
+                'version': self._version,
+                'upserted': [self._books[i] for i in changed if i in self._books],
+                'deleted': [i for i in changed if i not in self._books],
+            }
+
+    def books(self):
+        """
+        Return the resident dict of id -> book in catalogue order.
+        Callers must treat it as read-only.
+        """
+        self.refresh()
+        return self._books
+
+    def get(self, book_id):
+        """
+        Return the book with the given id, or None if there is none.
+        """
+        return self.books().get(book_id)
+
+    def filter(self, borrowed=None, category=None, name=None):
+        """
+        Return the books matching borrowed status ('available' or 'borrowed'),
+        category and exact name (both case-insensitive), in catalogue order.
+        The storage engine answers the query when it has indexes of its own, otherwise
+        the candidate sets from the secondary indexes are intersected, smallest first.
+        """
+        with self._lock:
+            books = self.books()
+            if not (borrowed in ('available', 'borrowed') or category or name):
+                return list(books.values())
+            ids = None
+            # While a write is being persisted the engine is ahead of the resident books,
+            # so the query is then answered from memory
+            if self._write_lock.acquire(blocking=False):
+                try:
+                    ids = self.storage.query(borrowed, category, name)
+                finally:
+                    self._write_lock.release()
+            if ids is None:
+                self._filter_index()
+                candidates = []
+                if borrowed == 'available':
+                    candidates.append(self._available)
+                elif borrowed == 'borrowed':
+                    candidates.append(self._borrowed)
+                if category:
+                    candidates.append(self._by_category.get(category.lower(), set()))
+                if name:
+                    candidates.append(self._by_name.get(name.lower(), set()))
+                candidates.sort(key=len)
+                result = set(candidates[0])
+                for other in candidates[1:]:
+                    if not result:
+                        break
+                    result &= other
+                ids = sorted(result)
+            # The engine may already hold rows another process added after the last refresh
+            return [books[book_id] for book_id in ids if book_id in books]
+
+    def page(self, borrowed=None, category=None, name=None, sort='id', limit=None, cursor=None):
+        """
+        Return one page of the filtered books in the given sort order as
+        (books, total, next_cursor). cursor is the next_cursor of the previous page
+        (None for the first page); next_cursor is None on the last page.
+        Without filters the page is cut from the pre-sorted ordering with a binary
+        search; with filters only the matching books are sorted.
+        Raises ValueError for an unknown sort field or an invalid cursor.
+        """
+        sort = sort or 'id'
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"Unknown sort field: {sort}")
+        with self._lock:
+            books = self.books()
+            if borrowed in ('available', 'borrowed') or category or name:
+                matches = self.filter(borrowed, category, name)
+                entries = sorted((sort_key(book, sort), book['id']) for book in matches)
+            else:
+                entries = self._ordering(sort)
+            start = 0
+            if cursor:
+                start = bisect.bisect_right(entries, decode_cursor(sort, cursor))
+            end = len(entries) if limit is None else start + limit
+            page_entries = entries[start:end]
+            next_cursor = None
+            if end < len(entries) and page_entries:
+                next_cursor = encode_cursor(sort, page_entries[-1])
+            return [books[book_id] for _, book_id in page_entries], len(entries), next_cursor
+
+    def due_before(self, date_key, limit=None):
+        """
+        Return the borrowed books due before date_key ('yyyy-mm-dd'), earliest due first,
+        at most limit of them. Costs a binary search plus one step per book returned.
+        """
+        with self._lock:
+            books = self.books()
+            self._loan_index()
+            end = bisect.bisect_left(self._loans, (date_key,))
+            if limit is not None:
+                end = min(end, max(limit, 0))
+            return [books[book_id] for _, book_id in self._loans[:end]]
+
+    def overdue_ids(self, books, today=None):
+        """
+        Return the ids of the overdue books among books (borrowed, and due before today,
+        a today_key()). Their due dates are looked up already parsed, so this costs one
+        dict lookup per book.
+        """
+        today = today or today_key()
+        with self._lock:
+            self._loan_index()
+            due_keys = self._due_keys
+            return [book['id'] for book in books if due_keys.get(book['id'], today) < today]
+
+    def overdue(self, limit=None):
+        """
+        Return the borrowed books whose due date is past, earliest due first.
+        """
+        return self.due_before(today_key(), limit)
+
+    def search(self, query, limit=None):
+        """
+        Return the books matching any word of query in their name, author or category,
+        ranked by relevance (BM25), at most limit of them.
+        """
+        with self._lock:
+            books = self.books()
+            return [books[book_id] for book_id, _ in self._search_index().search(query, limit)]
+
+    def suggest(self, prefix, limit=10):
+        """
+        Return up to limit title/author suggestions for a partly typed search.
+        """
+        with self._lock:
+            self.refresh()
+            return self._prefix_index().suggest(prefix, limit)
+
+    def add(self, book):
+        """
+        Give a new book the next unused id, store it and persist it.
+        """
+        with self._writing():
+            book['id'] = self._next_id
+            self._next_id += 1
+            return self._commit({'op': 'add', 'book': book})
+
+    def update(self, book_id, fields=None, remove=(), precondition=None):
+        """
+        Set the given fields on a book and drop the keys listed in remove.
+        The id itself cannot be changed.
+        precondition, if given, is called with the current book under the write and
+        inter-process locks; if it returns an error message nothing is changed and
+        ValueError is raised with it.
+        Returns the updated book, or None if there is no book with that id.
+        """
+        with self._writing():
+            if book_id not in self._books:
+                return None
+            error = precondition(self._books[book_id]) if precondition else None
+            if error:
+                raise ValueError(error)
+            fields = {k: v for k, v in (fields or {}).items() if k != 'id'}
+            remove = [k for k in remove if k != 'id']
+            return self._commit({'op': 'update', 'id': book_id, 'fields': fields, 'remove': remove})
+
+    def delete(self, book_id):
+        """
+        Remove the book with the given id and persist the change.
+        Returns the removed book, or None if there is no book with that id.
+        """
+        with self._writing():
+            if book_id not in self._books:
+                return None
+            return self._commit({'op': 'delete', 'id': book_id})
+
+    def add_many(self, books):
+        """
+        Give each new book an id and store them all with a single write.
+        """
+        with self._writing():
+            records = []
+            for book in books:
+                book['id'] = self._next_id
+                self._next_id += 1
+                records.append({'op': 'add', 'book': book})
+            return self._commit_many(records)
+
+    def apply_batch(self, records):
+        """
+        Apply a list of 'update' and 'delete' records atomically with a single write.
+        Every record is checked before any is applied: if one addresses a book that does
+        not exist (or was deleted earlier in the batch) nothing is changed and
+        KeyError is raised with its id. Returns the affected book after each record.
+        """
+        with self._writing():
+            deleted = set()
+            for record in records:
+                if record['op'] not in ('update', 'delete'):
+                    raise ValueError(f"Unsupported batch op: {record['op']}")
+                if record['id'] not in self._books or record['id'] in deleted:
+                    raise KeyError(record['id'])
+                if record['op'] == 'delete':
+                    deleted.add(record['id'])
+            records = [
+                dict(record,
+                     fields={k: v for k, v in record.get('fields', {}).items() if k != 'id'},
+                     remove=[k for k in record.get('remove', ()) if k != 'id'])
+                if record['op'] == 'update' else record
+                for record in records
+            ]
+            return self._commit_many(records)
+
+    def apply_plan(self, plan):
+        """
+        Build a batch from the current catalogue and apply it like apply_batch().
+        plan is called under the write and inter-process locks with get(book_id), which
+        returns the current book or None, and returns the records to apply, or None to
+        apply nothing. Returns the affected book after each record, or None.
+        """
+        with self._writing():
+            records = plan(self._books.get)
+            if records is None:
+                return None
+            return self.apply_batch(records)
@@ -0,0 +1,210 @@
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BOOKS = 5
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    # The backend opens its data file when it is imported, so each test imports a fresh copy
+    path = tmp_path / 'data.db'
+    path.write_text(json.dumps([
+        {'name': f'Book {i}', 'author': 'Author', 'publication_date': '2000', 'category': 'Fiction',
+         'borrowed': False}
+        for i in range(BOOKS)
+    ]))
+    monkeypatch.setenv('LIBRARY_STORAGE', 'json')
+    monkeypatch.setenv('LIBRARY_DATA_FILE', str(path))
+    sys.modules.pop('backend', None)
+    module = importlib.import_module('backend')
+    yield module
+    module.store.storage.close()
+    sys.modules.pop('backend', None)
+
+
+@pytest.fixture
+def client(backend):
+    return backend.app.test_client()
+
+
+def new_book(name='New'):
+    return {'name': name, 'author': 'Someone', 'publication_date': '2024', 'category': 'Science'}
+
+
+def catalogue_version(client):
+    return int(client.get('/books').headers['X-Catalogue-Version'])
+
+
+def test_every_change_bumps_the_catalogue_version(client):
+    version = catalogue_version(client)
+    assert client.post('/books', json=new_book()).status_code == 201
+    assert catalogue_version(client) == version + 1
+    assert client.post('/books/0/borrow', json={}).status_code == 200
+    assert catalogue_version(client) == version + 2
+    assert client.delete('/books/1').status_code == 200
+    assert catalogue_version(client) == version + 3
+    # Failed changes do not count
+    assert client.post('/books/0/borrow', json={}).status_code == 400
+    assert client.delete('/books/1').status_code == 404
+    assert catalogue_version(client) == version + 3
+
+
+def test_changes_returns_the_delta_since_a_version(client):
+    version = catalogue_version(client)
+    assert client.get(f'/books/changes?since={version}').get_json() == {
+        'version': version, 'upserted': [], 'deleted': [], 'overdue': []}
+    created = client.post('/books', json=new_book()).get_json()
+    client.post('/books/2/borrow', json={'due_date': '01.01.2000'})
+    client.post('/books/2/return', json={})
+    client.delete('/books/3')
+    delta = client.get(f'/books/changes?since={version}').get_json()
+    assert delta['version'] == version + 4
+    assert sorted(book['id'] for book in delta['upserted']) == [2, created['id']]
+    assert not next(book for book in delta['upserted'] if book['id'] == 2)['borrowed']
+    assert delta['deleted'] == [3]
+    assert delta['overdue'] == []
+    # Only what changed after the given version
+    delta = client.get(f"/books/changes?since={version + 3}").get_json()
+    assert delta['upserted'] == [] and delta['deleted'] == [3]
+
+
+def test_changes_asks_for_a_reset_when_it_cannot_answer(backend, client):
+    version = catalogue_version(client)
+    # A version from the future, or older than the change log remembers
+    assert client.get(f'/books/changes?since={version + 1}').get_json() == {'version': version, 'reset': True}
+    backend.store.reload()
+    reloaded = catalogue_version(client)
+    assert reloaded > version
+    assert client.get(f'/books/changes?since={version}').get_json() == {'version': reloaded, 'reset': True}
+    assert client.get('/books/changes').status_code == 400
+
+
+def test_books_list_is_not_modified_until_the_catalogue_changes(client):
+    response = client.get('/books')
+    etag = response.headers['ETag']
+    again = client.get('/books', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b''
+    client.post('/books/0/borrow', json={})
+    changed = client.get('/books', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()[0]['borrowed']
+
+
+def test_book_is_not_modified_until_it_changes(client):
+    etag = client.get('/books/1').headers['ETag']
+    assert client.get('/books/1', headers={'If-None-Match': etag}).status_code == 304
+    # Other books changing leave its tag alone
+    client.post('/books/2/borrow', json={})
+    assert client.get('/books/1', headers={'If-None-Match': etag}).status_code == 304
+    client.post('/books/1/borrow', json={})
+    response = client.get('/books/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.get_json()['borrowed']
+    client.delete('/books/1')
+    assert client.get('/books/1', headers={'If-None-Match': etag}).status_code == 404
+
+
+@pytest.mark.parametrize('field, value', [('name', None), ('author', 5), ('category', ['Fiction']),
+                                          ('publication_date', 2024)])
+def test_book_fields_must_be_strings(client, field, value):
+    version = catalogue_version(client)
+    book = dict(new_book(), **{field: value})
+    response = client.post('/books', json=book)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': f'Field {field} must be a string'}
+    response = client.post('/books/bulk', json=[new_book(), book])
+    assert response.status_code == 400
+    assert response.get_json()['results'] == [{'index': 1, 'status': 400, 'error': f'Field {field} must be a string'}]
+    assert catalogue_version(client) == version
+    assert len(client.get('/books').get_json()) == BOOKS
+
+
+def test_batch_applies_every_operation_in_order(client):
+    version = catalogue_version(client)
+    response = client.post('/books/batch', json={'operations': [
+        {'op': 'borrow', 'id': 0, 'borrower_name': 'Ann', 'due_date': '01.02.2030'},
+        {'op': 'return', 'id': 0},
+        {'op': 'borrow', 'id': 1},
+        {'op': 'edit', 'id': 2, 'fields': {'name': 'Renamed', 'category': 'Science'}},
+        {'op': 'delete', 'id': 3},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == [200] * 5
+    assert results[0]['book']['borrower_name'] == 'Ann'
+    assert not results[1]['book']['borrowed'] and 'borrower_name' not in results[1]['book']
+    assert results[2]['book']['borrowed']
+    assert results[3]['book']['name'] == 'Renamed'
+    assert results[4]['book']['id'] == 3
+    assert catalogue_version(client) == version + 5
+    books = {book['id']: book for book in client.get('/books').get_json()}
+    assert sorted(books) == [0, 1, 2, 4]
+    assert not books[0]['borrowed'] and books[1]['borrowed'] and books[2]['category'] == 'Science'
+
+
+def test_batch_with_a_failing_operation_changes_nothing(backend, client):
+    version = catalogue_version(client)
+    before = client.get('/books').get_json()
+    with open(backend.DATA_FILE, 'rb') as f:
+        stored = f.read()
+    response = client.post('/books/batch', json=[
+        {'op': 'borrow', 'id': 0},
+        {'op': 'borrow', 'id': 0},
+        {'op': 'edit', 'id': 1, 'fields': {'name': 5}},
+        {'op': 'edit', 'id': 1, 'fields': {'borrowed': True}},
+        {'op': 'delete', 'id': 99},
+        {'op': 'delete', 'id': '2'},
+        {'op': 'lend', 'id': 2},
+        {'op': 'edit', 'id': 2, 'fields': {'author': 'Fine'}},
+    ])
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Batch rejected', 'results': [
+        {'status': 200},
+        {'status': 400, 'error': 'Book already borrowed'},
+        {'status': 400, 'error': 'Field name must be a string'},
+        {'status': 400, 'error': 'Invalid fields'},
+        {'status': 404, 'error': 'Book not found'},
+        {'status': 400, 'error': 'Invalid id'},
+        {'status': 400, 'error': 'Unknown op'},
+        {'status': 200},
+    ]}
+    # Nothing reached the store or the data file
+    assert catalogue_version(client) == version
+    assert client.get('/books').get_json() == before
+    with open(backend.DATA_FILE, 'rb') as f:
+        assert f.read() == stored
+
+
+def test_batch_request_must_be_a_list_of_operations(client):
+    assert client.post('/books/batch', json={'op': 'delete', 'id': 0}).status_code == 400
+    assert client.post('/books/batch', data='not json').status_code == 400
+
+
+def test_overdue_books_are_marked_in_lists_and_on_the_web_page(client):
+    client.post('/books/1/borrow', json={'due_date': '01.01.2000'})
+    client.post('/books/2/borrow', json={'due_date': '01.01.2999'})
+    assert client.get('/books?limit=10').get_json()['overdue'] == [1]
+    assert client.get('/books/search?q=book').headers['X-Overdue'] == '1'
+    page = client.get('/').get_data(as_text=True)
+    assert '<tr id="book-1" style="background-color: red;">' in page
+    assert '<tr id="book-2" >' in page
+    assert 'background-color: red' in client.get('/web/row/1').get_data(as_text=True)
+    assert 'background-color: red' not in client.get('/web/row/2').get_data(as_text=True)
+
+
+@pytest.mark.parametrize('path', ['/books/overdue', '/books/due?before=01.01.2999'])
+def test_due_lists_take_a_positive_limit(client, path):
+    for book_id in range(3):
+        client.post(f'/books/{book_id}/borrow', json={'due_date': f'0{book_id + 1}.01.2000'})
+    separator = '&' if '?' in path else '?'
+    assert [book['id'] for book in client.get(path).get_json()] == [0, 1, 2]
+    assert [book['id'] for book in client.get(f'{path}{separator}limit=2').get_json()] == [0, 1]
+    for limit in (0, -1):
+        assert client.get(f'{path}{separator}limit={limit}').status_code == 400
@@ -0,0 +1,52 @@
+import json
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BOOKS = 100
+PROCESSES = 2
+
+
+def borrow_all(barrier, results):
+    # Runs in a fresh process: the backend opens the data file named in the environment
+    import backend
+    client = backend.app.test_client()
+    barrier.wait()
+    results.put(sum(client.post(f'/books/{book_id}/borrow', json={}).status_code == 200
+                    for book_id in range(BOOKS)))
+
+
+@pytest.mark.parametrize('engine', ['json', 'journal', 'snapshot', 'sqlite'])
+def test_borrow_is_exclusive_across_processes(tmp_path, monkeypatch, engine):
+    source = tmp_path / 'data.db'
+    source.write_text(json.dumps([
+        {'name': f'Book {i}', 'author': 'Author', 'publication_date': '2000', 'category': 'Fiction',
+         'borrowed': False}
+        for i in range(BOOKS)
+    ]))
+    path = str(source)
+    if engine in ('snapshot', 'sqlite'):
+        from migrate import migrate
+        path = str(tmp_path / f'library.{engine}')
+        migrate(str(source), path, engine)
+    monkeypatch.setenv('LIBRARY_STORAGE', engine)
+    monkeypatch.setenv('LIBRARY_DATA_FILE', path)
+    monkeypatch.setenv('PYTHONPATH', ROOT)
+
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(PROCESSES)
+    results = context.Queue()
+    processes = [context.Process(target=borrow_all, args=(barrier, results)) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    successes = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join()
+
+    # Every book is borrowed exactly once, however the two processes interleave
+    assert sum(successes) == BOOKS
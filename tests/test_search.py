@@ -0,0 +1,71 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmark import generate_books  # noqa: E402
+from search import SearchIndex  # noqa: E402
+
+QUERIES = ['the', 'fiction', 'Silent', 'Silent Smith', 'silent silent', 'Garden River 42',
+           'Omar Haddad 17', 'non fiction history', 'stone 7', 'zzz']
+
+
+def build_index(books, **options):
+    index = SearchIndex(**options)
+    for book in books:
+        index.add(book)
+    return index
+
+
+def test_books_matching_more_and_rarer_terms_rank_first():
+    books = [
+        {'id': 0, 'name': 'Garden Night', 'author': 'Lena Berg', 'category': 'Fiction'},
+        {'id': 1, 'name': 'Garden', 'author': 'Omar Kim', 'category': 'Fiction'},
+        {'id': 2, 'name': 'Night Garden Night', 'author': 'Omar Kim', 'category': 'Fiction'},
+        {'id': 3, 'name': 'Winter', 'author': 'Sara Costa', 'category': 'Science'},
+    ]
+    index = build_index(books, common_term_ratio=1.0)
+    assert [book_id for book_id, _ in index.search('garden night')] == [2, 0, 1]
+    assert [book_id for book_id, _ in index.search('garden night', limit=2)] == [2, 0]
+    assert [book_id for book_id, _ in index.search('omar garden', limit=1)] == [1]
+    assert index.search('ocean') == []
+    # Here every term is common: only the books with the rarest one match
+    index = build_index(books)
+    assert [book_id for book_id, _ in index.search('garden night')] == [2, 0]
+
+
+def test_limited_search_returns_the_top_of_the_full_ranking():
+    books = generate_books(3000)
+    index = build_index(books)
+    for query in QUERIES:
+        index.search(query, 10)
+    # The weight groups built by those searches must follow later changes
+    for book in books[::7]:
+        index.remove(book['id'])
+    for book in books[::14]:
+        index.add(book)
+    for query in QUERIES:
+        ranking = index.search(query)
+        for limit in (0, 1, 5, 50):
+            assert index.search(query, limit) == ranking[:limit], (query, limit)
+
+
+def test_limited_search_stops_early_on_common_terms():
+    index = build_index(generate_books(3000))
+    postings = index._postings['the']
+    visited = []
+    # Count the books scored for a query matching every book
+    index._postings['the'] = CountingDict(postings, visited)
+    assert len(index.search('the', 10)) == 10
+    assert len(visited) < 100
+
+
+class CountingDict(dict):
+    def __init__(self, items, visited):
+        super().__init__(items)
+        self.visited = visited
+
+    def get(self, key, default=None):
+        self.visited.append(key)
+        return super().get(key, default)
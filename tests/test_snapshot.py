@@ -0,0 +1,159 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from snapshot import Snapshot, SnapshotBooks, encode_snapshot, is_snapshot  # noqa: E402
+from storage import JournalStorage, SnapshotStorage  # noqa: E402
+from store import BookStore  # noqa: E402
+
+BOOKS = [
+    {'id': 0, 'name': 'Plain', 'author': 'Author', 'publication_date': '2000', 'category': 'Fiction',
+     'borrowed': False},
+    {'id': 3, 'name': 'Borrowed', 'author': 'Author', 'publication_date': '2001', 'category': 'Fiction',
+     'borrowed': True, 'borrower_name': 'Ann', 'borrow_date': '01.01.2030', 'due_date': '15.01.2030'},
+    {'id': 4, 'name': 'Ünïcode ✓ 書', 'author': '', 'category': 'Science'},
+    {'id': 7, 'name': 5, 'author': None, 'category': ['a', 'b'], 'borrowed': 1, 'pages': 320,
+     'tags': {'shelf': 'B2'}},
+    {'id': 9, 'name': '\udc80 surrogate'},
+    {'id': 12},
+]
+# The JSON engines cannot store lone surrogates
+STORED_BOOKS = [book for book in BOOKS if book['id'] != 9]
+
+
+def write_snapshot(path, books, next_id):
+    raw, snapshot_id = encode_snapshot(books, next_id)
+    path.write_bytes(raw)
+    return snapshot_id
+
+
+def test_snapshot_round_trips_every_book(tmp_path):
+    path = tmp_path / 'library.snap'
+    # Records are written in id order whatever order the books come in
+    snapshot_id = write_snapshot(path, reversed(BOOKS), 20)
+    assert is_snapshot(str(path))
+    with Snapshot(str(path)) as snapshot:
+        assert snapshot.count == len(BOOKS) and snapshot.next_id == 20
+        assert snapshot.snapshot_id == snapshot_id
+        assert snapshot.ids() == [book['id'] for book in BOOKS]
+        assert [book for _, book in snapshot.items()] == BOOKS
+        for book in BOOKS:
+            assert snapshot.get(book['id']) == book
+        for book_id in (-1, 1, 13):
+            assert snapshot.get(book_id) is None
+
+
+def test_empty_snapshot_round_trips(tmp_path):
+    path = tmp_path / 'library.snap'
+    write_snapshot(path, [], 0)
+    with Snapshot(str(path)) as snapshot:
+        assert snapshot.count == 0 and snapshot.next_id == 0
+        assert snapshot.ids() == [] and list(snapshot.items()) == [] and snapshot.get(0) is None
+
+
+def test_other_files_are_not_snapshots(tmp_path):
+    path = tmp_path / 'data.db'
+    path.write_text('[]')
+    assert not is_snapshot(str(path))
+    assert not is_snapshot(str(tmp_path / 'missing'))
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
+
+
+def test_snapshot_books_lay_changes_over_the_file(tmp_path):
+    path = tmp_path / 'library.snap'
+    write_snapshot(path, BOOKS, 20)
+    with Snapshot(str(path)) as snapshot:
+        books = SnapshotBooks(snapshot)
+        books[3] = dict(BOOKS[1], borrowed=False)
+        del books[4]
+        books[20] = {'id': 20, 'name': 'Added'}
+        books[4] = {'id': 4, 'name': 'Back'}
+        del books[12]
+        expected = {book['id']: book for book in BOOKS}
+        expected.update({3: dict(BOOKS[1], borrowed=False), 4: {'id': 4, 'name': 'Back'}, 20: {'id': 20, 'name': 'Added'}})
+        del expected[12]
+        assert len(books) == len(expected)
+        assert dict(books) == expected
+        assert list(books.values()) == list(expected.values())
+        assert 12 not in books and '3' not in books and 20 in books
+        with pytest.raises(KeyError):
+            books[12]
+        with pytest.raises(KeyError):
+            del books[12]
+
+
+@pytest.mark.parametrize('storage_class, name', [(JournalStorage, 'data.db'), (SnapshotStorage, 'library.snap')])
+def test_restart_replays_the_journal(tmp_path, storage_class, name):
+    path = str(tmp_path / name)
+    storage_class(path).replace_all([dict(book) for book in STORED_BOOKS], 20)
+    store = BookStore(storage_class(path))
+    store.add({'name': 'Added', 'author': 'New', 'borrowed': False})
+    store.update(0, {'borrowed': True, 'due_date': '01.02.2030'})
+    store.update(3, {'borrowed': False}, remove=['borrower_name', 'borrow_date', 'due_date'])
+    store.delete(4)
+    store.apply_batch([{'op': 'update', 'id': 7, 'fields': {'name': 'Named'}}, {'op': 'delete', 'id': 12}])
+    expected = store.books()
+    store.storage.close()
+
+    storage = storage_class(path)
+    store = BookStore(storage)
+    assert storage._journal_records == 6
+    assert dict(store.books()) == dict(expected)
+    assert store.add({'name': 'Next'})['id'] == 21
+    assert [book['id'] for book in store.overdue()] == []
+    assert [book['id'] for book in store.search('added')] == [20]
+    store.storage.close()
+
+
+@pytest.mark.parametrize('storage_class, name', [(JournalStorage, 'data.db'), (SnapshotStorage, 'library.snap')])
+def test_journal_of_another_snapshot_or_torn_line_is_not_replayed(tmp_path, storage_class, name):
+    path = str(tmp_path / name)
+    storage_class(path).replace_all([dict(book) for book in STORED_BOOKS], 20)
+    store = BookStore(storage_class(path))
+    store.update(0, {'name': 'Renamed'})
+    store.storage.close()
+    with open(path + '.journal', 'a') as f:
+        f.write('{"op": "delete", "id"')
+
+    # The torn last line from a crash mid-append is skipped
+    store = BookStore(storage_class(path))
+    assert store.get(0)['name'] == 'Renamed' and len(store.books()) == len(STORED_BOOKS)
+    store.storage.close()
+
+    # A journal left over from an interrupted compaction belongs to the old snapshot
+    with open(path + '.journal', 'rb') as f:
+        journal = f.read()
+    storage_class(path).replace_all([dict(book) for book in STORED_BOOKS[:-1]], 20)
+    with open(path + '.journal', 'wb') as f:
+        f.write(journal)
+    store = BookStore(storage_class(path))
+    assert store.get(0)['name'] == 'Plain' and len(store.books()) == len(STORED_BOOKS) - 1
+    store.storage.close()
+
+
+def test_compaction_writes_a_new_snapshot(tmp_path):
+    path = str(tmp_path / 'library.snap')
+    SnapshotStorage(path).replace_all([dict(book) for book in STORED_BOOKS], 20)
+    storage = SnapshotStorage(path)
+    storage.compact_every = 3
+    store = BookStore(storage)
+    snapshot = store.books().snapshot
+    for i, book in enumerate(STORED_BOOKS):
+        store.update(book['id'], {'name': f'Compacted {i}'})
+    expected = dict(store.books())
+    # The mapping of the replaced snapshot is still readable
+    assert store.books().snapshot is snapshot
+    assert snapshot.get(0)['name'] == 'Plain'
+    store.storage.close()
+
+    storage = SnapshotStorage(path)
+    store = BookStore(storage)
+    assert storage._journal_records == 0
+    assert isinstance(store.books(), SnapshotBooks)
+    assert dict(store.books()) == expected
+    store.storage.close()
@@ -0,0 +1,149 @@
+import base64
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import open_storage  # noqa: E402
+from store import BULK_INDEX_THRESHOLD, SORT_FIELDS, BookStore, decode_cursor, encode_cursor, sort_key  # noqa: E402
+
+ENGINES = ['json', 'journal', 'snapshot', 'sqlite']
+
+
+def open_store(tmp_path, engine):
+    return BookStore(open_storage(engine, str(tmp_path / f'library.{engine}')))
+
+
+def make_book(i, **fields):
+    book = {'name': f'Book {i}', 'author': f'Author {i % 3}', 'publication_date': str(2000 + i),
+            'category': 'Fiction', 'borrowed': False}
+    book.update(fields)
+    return book
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_store_restarts_on_books_with_non_string_fields(tmp_path, engine):
+    store = open_store(tmp_path, engine)
+    store.add_many([make_book(i) for i in range(3)])
+    store.add(make_book(3, category=None))
+    store.update(0, {'name': 5})
+    store.apply_batch([{'op': 'update', 'id': 1, 'fields': {'author': None, 'category': 7}}])
+    store.storage.close()
+
+    # A restart rebuilds every index from the stored books
+    store = open_store(tmp_path, engine)
+    assert len(store.books()) == 4
+    assert [book['id'] for book in store.filter(name='5')] == [0]
+    assert [book['id'] for book in store.filter(category='none')] == [3]
+    assert [book['id'] for book in store.filter(category='7')] == [1]
+    books, total, _ = store.page(sort='name')
+    assert total == 4 and books[0]['id'] == 0
+    store.delete(3)
+    store.update(0, {'name': 'Book 0'})
+    assert [book['id'] for book in store.filter(category='fiction')] == [0, 2]
+
+
+@pytest.mark.parametrize('sort', SORT_FIELDS)
+def test_cursor_pages_cover_the_catalogue_once(tmp_path, sort):
+    store = open_store(tmp_path, 'json')
+    store.add_many([make_book(i, name=f'Book {i % 4}', borrowed=i % 3 == 0, due_date=f'{i % 28 + 1:02d}.01.2030')
+                    for i in range(25)])
+    expected, total, _ = store.page(sort=sort)
+    seen = []
+    cursor = None
+    while True:
+        books, total, cursor = store.page(sort=sort, limit=4, cursor=cursor)
+        seen.extend(books)
+        if cursor is None:
+            break
+        assert decode_cursor(sort, cursor) == (sort_key(books[-1], sort), books[-1]['id'])
+    assert total == 25
+    assert seen == expected
+
+
+@pytest.mark.parametrize('sort, key', [
+    ('id', 'x'), ('id', 1.5), ('id', True), ('name', 1), ('name', None), ('name', [0, '']),
+    ('due_date', 'x'), ('due_date', [0]), ('due_date', ['0', '']), ('due_date', [0, 1]),
+])
+def test_cursor_with_a_key_of_the_wrong_type_is_rejected(tmp_path, sort, key):
+    store = open_store(tmp_path, 'json')
+    store.add_many([make_book(i) for i in range(5)])
+    cursor = base64.urlsafe_b64encode(json.dumps([sort, key, 1]).encode()).decode()
+    with pytest.raises(ValueError):
+        store.page(sort=sort, limit=2, cursor=cursor)
+
+
+@pytest.mark.parametrize('cursor', ['', 'not base64!', encode_cursor('name', ('a', 1)),
+                                    base64.urlsafe_b64encode(b'[1, 2]').decode(),
+                                    base64.urlsafe_b64encode(b'["id", 1, "x"]').decode()])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor('id', cursor or '=')
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_overdue_ids_follow_loans_and_the_date(tmp_path, engine):
+    store = open_store(tmp_path, engine)
+    store.add_many([make_book(i) for i in range(4)])
+    store.update(0, {'borrowed': True, 'due_date': '10.03.2030'})
+    store.update(1, {'borrowed': True, 'due_date': '20.03.2030'})
+    store.update(2, {'borrowed': True})
+    store.update(3, {'borrowed': False, 'due_date': '01.01.2000'})
+    books = list(store.books().values())
+    assert store.overdue_ids(books, '2030-03-10') == []
+    assert store.overdue_ids(books, '2030-03-11') == [0]
+    assert store.overdue_ids(books, '2031-01-01') == [0, 1]
+    # Writes large enough to merge the sorted indexes keep the due dates as well
+    added = store.add_many([make_book(i, borrowed=True, due_date='01.06.2030')
+                            for i in range(BULK_INDEX_THRESHOLD + 1)])
+    store.apply_batch([{'op': 'update', 'id': book_id, 'fields': {'borrowed': False}, 'remove': ['due_date']}
+                       for book_id in [0, 1] + [book['id'] for book in added[1:]]]
+                      + [{'op': 'update', 'id': 3, 'fields': {'borrowed': True}}])
+    books = list(store.books().values())
+    assert store.overdue_ids(books, '2031-01-01') == [3, added[0]['id']]
+    store.storage.close()
+    store = open_store(tmp_path, engine)
+    assert store.overdue_ids(list(store.books().values()), '2031-01-01') == [3, added[0]['id']]
+
+
+def test_due_before_with_a_negative_limit_returns_nothing(tmp_path):
+    store = open_store(tmp_path, 'json')
+    store.add_many([make_book(i, borrowed=True, due_date=f'0{i + 1}.01.2000') for i in range(3)])
+    assert [book['id'] for book in store.due_before('2030-01-01', 2)] == [0, 1]
+    assert store.due_before('2030-01-01', 0) == []
+    assert store.due_before('2030-01-01', -1) == []
+
+
+def read_everything(store):
+    return ([book['id'] for book in store.filter(borrowed='borrowed')],
+            [book['id'] for book in store.filter(category='science', name='book 7')],
+            {sort: [book['id'] for book in store.page(sort=sort)[0]] for sort in SORT_FIELDS},
+            [book['id'] for book in store.due_before('2031-01-01')],
+            [book['id'] for book in store.search('book author 2', 10)],
+            store.suggest('boo', 5))
+
+
+@pytest.mark.parametrize('warm', [False, True])
+@pytest.mark.parametrize('engine', ['journal', 'snapshot'])
+def test_indexes_built_before_or_after_writes_agree(tmp_path, engine, warm):
+    store = open_store(tmp_path, engine)
+    store.add_many([make_book(i, category='Science' if i % 2 else 'Fiction') for i in range(BULK_INDEX_THRESHOLD + 1)])
+    store.storage.close()
+    store = open_store(tmp_path, engine)
+    # The indexes are only built when a read needs them
+    assert store._search is None and store._loans is None and store._orderings == {}
+    if warm:
+        read_everything(store)
+    store.update(7, {'borrowed': True, 'due_date': '01.01.2030'})
+    store.delete(8)
+    store.add_many([make_book(i, borrowed=True, due_date=f'{i % 28 + 1:02d}.02.2030')
+                    for i in range(BULK_INDEX_THRESHOLD + 1)])
+    store.apply_batch([{'op': 'update', 'id': book_id, 'fields': {'name': f'Book {book_id % 9}'}}
+                       for book_id in range(1, 2 * BULK_INDEX_THRESHOLD, 2)])
+    result = read_everything(store)
+    store.storage.close()
+    assert result == read_everything(open_store(tmp_path, engine))